@@ -1,49 +1,200 @@
+import os
+import threading
+import time
 import requests
 import logging
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from circuit_breaker import CircuitBreaker, CircuitOpen
 from config import Config
+from http_session import PooledSession
+from rate_limiter import RateLimiter, PRIORITY_DEFAULT, PRIORITY_NAMES
+from logging_setup import truncate
+from metrics import RATE_LIMIT_WAIT_SECONDS, observe_client_request
 
 logger = logging.getLogger(__name__)
 
 class AmoCRMClient:
-    def __init__(self):
-        self.base_url = f"https://{Config.AMOCRM_DOMAIN}/api/v4"
+    def __init__(self, domain=None, access_token=None, rate_limit=None):
+        # По умолчанию — аккаунт из Config; арендаторы (tenants.py) передают свои domain и токен
+        domain = domain or Config.AMOCRM_DOMAIN
+        self.base_url = f"https://{domain}/api/v4"
         self.headers = {
-            "Authorization": f"Bearer {Config.AMOCRM_ACCESS_TOKEN}",
+            "Authorization": f"Bearer {access_token or Config.AMOCRM_ACCESS_TOKEN}",
             "Content-Type": "application/json"
         }
+        self._session = None
+        self._batcher = None
+        # Лимит amoCRM (~7 запросов/с на интеграцию) общий для всех процессов на хосте, у каждого аккаунта свой
+        self.rate_limiter = RateLimiter(Config.RATE_LIMIT_DB, f"amocrm:{domain}", rate_limit or Config.AMOCRM_RATE_LIMIT)
+        # Пока amoCRM не отвечает, запросы сразу получают CircuitOpen вместо ожидания таймаута
+        self.breaker = CircuitBreaker(
+            Config.RATE_LIMIT_DB, f"amocrm:{domain}", Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_TIMEOUT
+        )
 
-    def get_lead_by_id(self, lead_id):
+    @property
+    def session(self):
+        # Пул соединений создаётся заново в каждом процессе после fork
+        if self._session is None or self._session.pid != os.getpid():
+            self._session = PooledSession(retry_methods=("GET", "PATCH"), service="amocrm")
+            self._session.headers.update(self.headers)
+        return self._session
+
+    def _request(self, method, url, priority=PRIORITY_DEFAULT, **kwargs):
+        self.breaker.before_request()
+        waited = self.rate_limiter.acquire(priority)
+        RATE_LIMIT_WAIT_SECONDS.labels(PRIORITY_NAMES.get(priority, str(priority))).observe(waited)
+        path = url[len(self.base_url):]
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, url, **kwargs)
+        except requests.RequestException as e:
+            observe_client_request("amocrm", method, path, started, error=e)
+            self.breaker.observe(error=e)
+            raise
+        observe_client_request("amocrm", method, path, started, status=response.status_code)
+        self.breaker.observe(status=response.status_code)
+        return response
+
+    def batch(self, priority=PRIORITY_DEFAULT):
+        """Новый накопитель изменений сделок; отправляется вызовом flush()."""
+        return LeadBatch(self, priority)
+
+    def submit(self, batch):
+        """Ставит изменения в общее окно отправки процесса.
+
+        Изменения из разных потоков, пришедшие в пределах AMOCRM_BATCH_WINDOW, уходят
+        одним PATCH /leads и одним POST /leads/notes. Возвращает Future с результатами по сделкам.
+        """
+        if self._batcher is None or self._batcher.pid != os.getpid():
+            self._batcher = AmoCRMBatcher(self, Config.AMOCRM_BATCH_WINDOW)
+        return self._batcher.submit(batch)
+
+    def apply(self, batch):
+        """Отправляет изменения через общее окно и ждёт результата; BatchError, если хоть одна сделка не обновилась."""
+        results = self.submit(batch).result()
+        errors = {lead_id: error for lead_id, error in results.items() if error is not None}
+        if errors:
+            raise BatchError(errors)
+        return results
+
+    def update_leads(self, leads, priority=PRIORITY_DEFAULT):
+        url = f"{self.base_url}/leads"
+        try:
+            response = self._request("PATCH", url, json=leads, priority=priority)
+            logger.info(f"Bulk update of {len(leads)} leads response: {response.status_code}, {truncate(response.text)}")
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            logger.error(f"Failed to bulk update {len(leads)} leads: {str(e)}")
+            raise
+
+    def add_notes(self, notes, priority=PRIORITY_DEFAULT):
+        url = f"{self.base_url}/leads/notes"
+        try:
+            response = self._request("POST", url, json=notes, priority=priority)
+            logger.info(f"Bulk add of {len(notes)} notes response: {response.status_code}, {truncate(response.text)}")
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            logger.error(f"Failed to bulk add {len(notes)} notes: {str(e)}")
+            raise
+
+    def get_lead_by_id(self, lead_id, priority=PRIORITY_DEFAULT):
         url = f"{self.base_url}/leads/{lead_id}"
         try:
             logger.info(f"Sending request to {url}")
-            response = requests.get(url, headers=self.headers)
-            logger.info(f"Response status: {response.status_code}, content: {response.text}")
+            response = self._request("GET", url, priority=priority)
+            logger.info(f"Response status: {response.status_code}, content: {truncate(response.text)}")
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
             logger.error(f"Failed to fetch lead {lead_id}: {str(e)}")
             raise
 
-    def get_leads_by_pipeline_status(self, pipeline_id, status_id):
+    def iter_lead_pages(self, rules, priority=PRIORITY_DEFAULT, limit=250):
+        """Все сделки в статусах rules = {pipeline_id: status_ids} страницами по limit (не больше 250), по возрастанию id.
+
+        Следующая страница запрашивается в фоне, пока вызывающий обрабатывает текущую,
+        поэтому в памяти не больше двух страниц.
+        """
+        params = {"limit": limit, "order[id]": "asc"}
+        index = 0
+        for pipeline_id, status_ids in rules.items():
+            for status_id in sorted(status_ids):
+                params[f"filter[statuses][{index}][pipeline_id]"] = pipeline_id
+                params[f"filter[statuses][{index}][status_id]"] = status_id
+                index += 1
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            page = 1
+            future = executor.submit(self._get_leads_page, params, page, priority)
+            while future is not None:
+                leads, has_next = future.result()
+                page += 1
+                future = executor.submit(self._get_leads_page, params, page, priority) if has_next else None
+                if leads:
+                    yield leads
+
+    def get_leads_by_ids(self, lead_ids, priority=PRIORITY_DEFAULT):
+        """Сделки по списку id запросами по 250; удалённых сделок в ответе нет."""
+        lead_ids = list(lead_ids)
+        leads = []
+        for start in range(0, len(lead_ids), 250):
+            chunk = lead_ids[start:start + 250]
+            page, _ = self._get_leads_page({"limit": len(chunk), "filter[id][]": chunk}, 1, priority)
+            leads.extend(page)
+        return leads
+
+    def _get_leads_page(self, params, page, priority):
         url = f"{self.base_url}/leads"
-        params = {
-            "filter[pipeline_id]": pipeline_id,
-            "filter[statuses][0][status_id]": status_id
-        }
         try:
-            logger.info(f"Sending request to {url} with params {params}")
-            response = requests.get(url, headers=self.headers, params=params)
-            logger.info(f"Response status: {response.status_code}, content: {response.text}")
+            response = self._request("GET", url, params=dict(params, page=page), priority=priority)
             response.raise_for_status()
-            data = response.json()
-            leads = data.get("_embedded", {}).get("leads", [])
-            logger.info(f"Found {len(leads)} leads in pipeline {pipeline_id}, status {status_id}")
-            return leads
         except requests.RequestException as e:
-            logger.error(f"Failed to fetch leads: {str(e)}")
+            logger.error(f"Failed to fetch leads page {page}: {str(e)}")
             raise
+        # Если подходящих сделок нет, amoCRM отвечает 204 без тела
+        if response.status_code == 204:
+            return [], False
+        data = response.json()
+        leads = data.get("_embedded", {}).get("leads", [])
+        logger.info(f"Fetched leads page {page}: {len(leads)} leads")
+        return leads, "next" in data.get("_links", {})
+
+    def get_directory(self, path, etag=None, priority=PRIORITY_DEFAULT):
+        """Все страницы справочника аккаунта (leads/pipelines, leads/custom_fields).
+
+        Первая страница запрашивается с If-None-Match: если справочник не менялся, amoCRM
+        отвечает 304 и возвращается (None, etag). Иначе — (список элементов, новый ETag).
+        """
+        url = f"{self.base_url}/{path}"
+        key = path.rsplit("/", 1)[-1]
+        items = []
+        page = 1
+        while True:
+            headers = {"If-None-Match": etag} if etag and page == 1 else {}
+            try:
+                response = self._request("GET", url, params={"page": page}, headers=headers, priority=priority)
+                response.raise_for_status()
+            except requests.RequestException as e:
+                logger.error(f"Failed to fetch {path} page {page}: {str(e)}")
+                raise
+            if response.status_code == 304:
+                logger.info(f"{path} not modified since ETag {etag}")
+                return None, etag
+            if page == 1:
+                etag = response.headers.get("ETag")
+            if response.status_code == 204:
+                break
+            data = response.json()
+            items.extend(data.get("_embedded", {}).get(key, []))
+            if "next" not in data.get("_links", {}):
+                break
+            page += 1
+        logger.info(f"Fetched {path}: {len(items)} items")
+        return items, etag
 
-    def update_lead(self, lead_id, custom_field_id, payment_link):
+    def update_lead(self, lead_id, custom_field_id, payment_link, priority=PRIORITY_DEFAULT):
         url = f"{self.base_url}/leads/{lead_id}"
         data = {
             "custom_fields_values": [
@@ -54,72 +205,251 @@ class AmoCRMClient:
             ]
         }
         try:
-            response = requests.patch(url, headers=self.headers, json=data)
-            logger.info(f"Update lead {lead_id} response: {response.status_code}, {response.text}")
+            response = self._request("PATCH", url, json=data, priority=priority)
+            logger.info(f"Update lead {lead_id} response: {response.status_code}, {truncate(response.text)}")
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
             logger.error(f"Failed to update lead {lead_id}: {str(e)}")
             raise
 
-    def add_note(self, lead_id, note_text):
+    def add_note(self, lead_id, note_text, priority=PRIORITY_DEFAULT):
         url = f"{self.base_url}/leads/{lead_id}/notes"
         data = {
             "note_type": "common",
             "params": {"text": note_text}
         }
         try:
-            response = requests.post(url, headers=self.headers, json=[data])
-            logger.info(f"Add note to lead {lead_id} response: {response.status_code}, {response.text}")
+            response = self._request("POST", url, json=[data], priority=priority)
+            logger.info(f"Add note to lead {lead_id} response: {response.status_code}, {truncate(response.text)}")
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
             logger.error(f"Failed to add note to lead {lead_id}: {str(e)}")
             raise
 
-    def add_tag(self, lead_id, tag_name):
-        # Получаем текущие данные сделки
-        lead = self.get_lead_by_id(lead_id)
-        
-        # Извлекаем существующие теги
-        existing_tags = lead.get("_embedded", {}).get("tags", [])
-        existing_tag_names = [tag["name"] for tag in existing_tags]
-
-        # Проверяем, есть ли уже такой тег
-        if tag_name in existing_tag_names:
-            logger.info(f"Tag '{tag_name}' already exists on lead {lead_id}, skipping")
-            return lead
-
-        # Добавляем новый тег к списку
-        existing_tag_names.append(tag_name)
-        new_tags = [{"name": name} for name in existing_tag_names]
-
-        # Обновляем сделку с новым списком тегов
-        url = f"https://{self.domain}/api/v4/leads/{lead_id}"
-        headers = {
-            "Authorization": f"Bearer {self.access_token}",
-            "Content-Type": "application/json"
-        }
+    def add_tag(self, lead_id, tag_name, priority=PRIORITY_DEFAULT):
+        # tags_to_add дописывает тег к существующим, поэтому предварительный GET сделки не нужен
+        url = f"{self.base_url}/leads/{lead_id}"
         data = {
-            "_embedded": {
-                "tags": new_tags
-            }
+            "tags_to_add": [{"name": tag_name}]
         }
-        response = requests.patch(url, headers=headers, json=data)
-        logger.info(f"Add tag to lead {lead_id} response: {response.status_code}, {response.text}")
-        response.raise_for_status()
-        return response.json()
+        try:
+            response = self._request("PATCH", url, json=data, priority=priority)
+            logger.info(f"Add tag to lead {lead_id} response: {response.status_code}, {truncate(response.text)}")
+            response.raise_for_status()
+            return response.json()
+        except requests.RequestException as e:
+            logger.error(f"Failed to add tag to lead {lead_id}: {str(e)}")
+            raise
 
-    def change_status(self, lead_id, status_id):
+    def change_status(self, lead_id, status_id, priority=PRIORITY_DEFAULT):
         url = f"{self.base_url}/leads/{lead_id}"
         data = {
             "status_id": status_id
         }
         try:
-            response = requests.patch(url, headers=self.headers, json=data)
-            logger.info(f"Change status of lead {lead_id} response: {response.status_code}, {response.text}")
+            response = self._request("PATCH", url, json=data, priority=priority)
+            logger.info(f"Change status of lead {lead_id} response: {response.status_code}, {truncate(response.text)}")
             response.raise_for_status()
             return response.json()
         except requests.RequestException as e:
             logger.error(f"Failed to change status of lead {lead_id}: {str(e)}")
-            raise
\ No newline at end of file
+            raise
+
+
+class BatchError(Exception):
+    """Ошибки отдельных сделок после отправки пакета: errors = {lead_id: исключение}."""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"amoCRM batch failed for leads: {', '.join(str(lead_id) for lead_id in errors)}")
+
+
+class LeadBatch:
+    """Накопитель изменений сделок для пакетной отправки в amoCRM v4.
+
+    Все изменения одной сделки (поле, тег, статус) объединяются в один элемент PATCH /leads,
+    примечания всех сделок уходят одним POST /leads/notes. Примечания сделки, чей PATCH
+    не прошёл, не отправляются.
+    """
+
+    MAX_ITEMS = 50  # amoCRM рекомендует не более 50 сущностей в одном запросе
+
+    def __init__(self, client, priority=PRIORITY_DEFAULT):
+        self.client = client
+        self.priority = priority
+        self._leads = OrderedDict()
+        self._notes = []
+
+    def __bool__(self):
+        return bool(self._leads or self._notes)
+
+    def lead_ids(self):
+        ids = list(self._leads)
+        ids.extend(lead_id for lead_id, _ in self._notes if lead_id not in self._leads)
+        return list(OrderedDict.fromkeys(ids))
+
+    def _lead(self, lead_id):
+        lead_id = int(lead_id)
+        if lead_id not in self._leads:
+            self._leads[lead_id] = {"id": lead_id}
+        return self._leads[lead_id]
+
+    def update_lead(self, lead_id, custom_field_id, value):
+        fields = self._lead(lead_id).setdefault("custom_fields_values", [])
+        fields[:] = [field for field in fields if field["field_id"] != custom_field_id]
+        fields.append({"field_id": custom_field_id, "values": [{"value": value}]})
+        return self
+
+    def add_tag(self, lead_id, tag_name):
+        tags = self._lead(lead_id).setdefault("tags_to_add", [])
+        if {"name": tag_name} not in tags:
+            tags.append({"name": tag_name})
+        return self
+
+    def change_status(self, lead_id, status_id):
+        self._lead(lead_id)["status_id"] = status_id
+        return self
+
+    def add_note(self, lead_id, note_text):
+        self._notes.append((int(lead_id), note_text))
+        return self
+
+    def merge(self, other):
+        for lead_id, body in other._leads.items():
+            target = self._lead(lead_id)
+            for field in body.get("custom_fields_values", []):
+                value = field["values"][0]["value"]
+                self.update_lead(lead_id, field["field_id"], value)
+            for tag in body.get("tags_to_add", []):
+                self.add_tag(lead_id, tag["name"])
+            if "status_id" in body:
+                target["status_id"] = body["status_id"]
+        self._notes.extend(other._notes)
+        self.priority = min(self.priority, other.priority)
+        return self
+
+    def take(self):
+        """Забирает накопленное: (элементы PATCH /leads, [(lead_id, текст примечания)])."""
+        leads, notes = list(self._leads.values()), self._notes
+        self._leads, self._notes = OrderedDict(), []
+        return leads, notes
+
+    def flush(self):
+        """Отправляет накопленное и возвращает {lead_id: None | исключение}."""
+        leads, notes = self.take()
+        results = OrderedDict((lead_id, None) for lead_id in [lead["id"] for lead in leads] + [n[0] for n in notes])
+
+        for chunk in self._chunks(leads):
+            for lead_id, error in self._send(self._update_leads, chunk, lambda item: item["id"]).items():
+                results[lead_id] = error
+
+        notes = [
+            {"entity_id": lead_id, "note_type": "common", "params": {"text": text}}
+            for lead_id, text in notes if results[lead_id] is None
+        ]
+        for chunk in self._chunks(notes):
+            for lead_id, error in self._send(self._add_notes, chunk, lambda item: item["entity_id"]).items():
+                if results[lead_id] is None:
+                    results[lead_id] = error
+
+        failed = {lead_id: error for lead_id, error in results.items() if error is not None}
+        if failed:
+            logger.error(f"amoCRM batch: {len(failed)} of {len(results)} leads failed: {list(failed)}")
+        return results
+
+    def _update_leads(self, items):
+        return self.client.update_leads(items, priority=self.priority)
+
+    def _add_notes(self, items):
+        return self.client.add_notes(items, priority=self.priority)
+
+    def _chunks(self, items):
+        for start in range(0, len(items), self.MAX_ITEMS):
+            yield items[start:start + self.MAX_ITEMS]
+
+    @staticmethod
+    def _send(method, items, lead_of):
+        """Отправляет пакет; при ошибках валидации повторяет один раз без отклонённых элементов."""
+        errors = {}
+        try:
+            method(items)
+            return errors
+        except CircuitOpen as e:
+            return {lead_of(item): e for item in items}
+        except requests.RequestException as e:
+            rejected = LeadBatch._rejected_indexes(e, len(items))
+            if not rejected:
+                return {lead_of(item): e for item in items}
+            for index in rejected:
+                errors[lead_of(items[index])] = e
+        remaining = [item for index, item in enumerate(items) if index not in rejected]
+        if remaining:
+            try:
+                method(remaining)
+            except requests.RequestException as e:
+                errors.update({lead_of(item): e for item in remaining})
+        return errors
+
+    @staticmethod
+    def _rejected_indexes(error, size):
+        # На 400 amoCRM возвращает validation-errors с request_id — индексом элемента в массиве
+        response = getattr(error, "response", None)
+        if response is None or response.status_code != 400:
+            return set()
+        try:
+            validation_errors = response.json().get("validation-errors", [])
+            indexes = {int(item["request_id"]) for item in validation_errors}
+        except (ValueError, KeyError, TypeError, AttributeError):
+            return set()
+        return {index for index in indexes if 0 <= index < size}
+
+
+class AmoCRMBatcher:
+    """Окно накопления изменений из нескольких потоков процесса с отправкой одним пакетом."""
+
+    def __init__(self, client, window, max_leads=LeadBatch.MAX_ITEMS):
+        self.client = client
+        self.window = window
+        self.max_leads = max_leads
+        self.pid = os.getpid()
+        self._lock = threading.Lock()
+        self._pending = None
+        self._futures = []
+        self._timer = None
+
+    def submit(self, batch):
+        future = Future()
+        lead_ids = batch.lead_ids()
+        with self._lock:
+            if self._pending is None:
+                self._pending = LeadBatch(self.client, batch.priority)
+                if self.window > 0:
+                    self._timer = threading.Timer(self.window, self.flush)
+                    self._timer.daemon = True
+                    self._timer.start()
+            self._pending.merge(batch)
+            self._futures.append((future, lead_ids))
+            full = self.window <= 0 or len(self._pending.lead_ids()) >= self.max_leads
+        if full:
+            self.flush()
+        return future
+
+    def flush(self):
+        with self._lock:
+            pending, futures = self._pending, self._futures
+            self._pending, self._futures = None, []
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+        if pending is None:
+            return
+        try:
+            results = pending.flush()
+        except Exception as e:
+            for future, _ in futures:
+                future.set_exception(e)
+            return
+        for future, lead_ids in futures:
+            future.set_result({lead_id: results.get(lead_id) for lead_id in lead_ids})
@@ -0,0 +1,130 @@
+import json
+import logging
+import os
+import threading
+import time
+
+from config import id_or_name
+from rate_limiter import PRIORITY_LINK
+
+logger = logging.getLogger(__name__)
+
+DIRECTORIES = ("leads/pipelines", "leads/custom_fields")
+
+
+class MetadataError(LookupError):
+    pass
+
+
+class AmoCRMMetadata:
+    """Воронки, статусы и дополнительные поля сделок аккаунта amoCRM: названия -> id.
+
+    Справочники читаются из amoCRM один раз и сохраняются в файл path; процессы стартуют
+    с сохранённой копии без запросов в amoCRM. Копия старше ttl перечитывается условным
+    запросом с ETag (если справочник не менялся, amoCRM отвечает 304). Если amoCRM
+    недоступен, используется устаревшая копия. Числовые id разрешаются без справочника.
+    """
+
+    def __init__(self, amocrm_client, path, ttl):
+        self.amocrm_client = amocrm_client
+        self.path = path
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._mtime = None
+
+    def _load(self):
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return None
+        # Файл обновил другой процесс (refresh_metadata_task) — перечитываем
+        if mtime != self._mtime:
+            with open(self.path) as f:
+                self._snapshot = json.load(f)
+            self._mtime = mtime
+        return self._snapshot
+
+    def _save(self, snapshot):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(snapshot, f, ensure_ascii=False)
+        os.replace(tmp_path, self.path)
+        self._snapshot = snapshot
+        self._mtime = os.path.getmtime(self.path)
+
+    def refresh(self):
+        """Перечитывает справочники из amoCRM (условно, по ETag) и сохраняет копию; возвращает её."""
+        with self._lock:
+            previous = self._load() or {}
+            etags = previous.get("etags", {})
+            snapshot = {"fetched_at": time.time(), "etags": {}}
+            changed = False
+            for directory in DIRECTORIES:
+                key = directory.rsplit("/", 1)[-1]
+                items, etag = self.amocrm_client.get_directory(
+                    directory, etag=etags.get(key) if key in previous else None, priority=PRIORITY_LINK
+                )
+                if items is None:
+                    items = previous[key]
+                else:
+                    changed = True
+                snapshot[key] = items
+                snapshot["etags"][key] = etag
+            self._save(snapshot)
+        if changed:
+            logger.info(f"Справочники amoCRM обновлены: воронок {len(snapshot['pipelines'])}, полей {len(snapshot['custom_fields'])}")
+        return snapshot
+
+    def snapshot(self):
+        with self._lock:
+            snapshot = self._load()
+        if snapshot is None:
+            return self.refresh()
+        if snapshot["fetched_at"] < time.time() - self.ttl:
+            try:
+                return self.refresh()
+            except Exception as e:
+                logger.warning(f"Не удалось обновить справочники amoCRM, используется копия из {self.path}: {str(e)}")
+        return snapshot
+
+    def pipeline_id(self, value):
+        value = id_or_name(value)
+        if isinstance(value, int):
+            return value
+        for pipeline in self.snapshot()["pipelines"]:
+            if pipeline["name"] == value:
+                return pipeline["id"]
+        raise MetadataError(f"Воронка не найдена в amoCRM: {value}")
+
+    def status_id(self, pipeline, value):
+        """id статуса value в воронке pipeline (id или название)."""
+        value = id_or_name(value)
+        if isinstance(value, int):
+            return value
+        pipeline_id = self.pipeline_id(pipeline)
+        for item in self.snapshot()["pipelines"]:
+            if item["id"] == pipeline_id:
+                for status in item.get("_embedded", {}).get("statuses", []):
+                    if status["name"] == value:
+                        return status["id"]
+        raise MetadataError(f"Статус не найден в воронке {pipeline}: {value}")
+
+    def custom_field_id(self, value):
+        value = id_or_name(value)
+        if isinstance(value, int):
+            return value
+        for field in self.snapshot()["custom_fields"]:
+            if value in (field["name"], field.get("code")):
+                return field["id"]
+        raise MetadataError(f"Поле сделки не найдено в amoCRM: {value}")
+
+    def resolve_rules(self, rules):
+        """Правила отбора {воронка: статусы} с названиями -> {pipeline_id: frozenset(status_id)}."""
+        return {
+            self.pipeline_id(pipeline): frozenset(self.status_id(pipeline, status) for status in statuses)
+            for pipeline, statuses in rules.items()
+        }
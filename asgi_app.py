@@ -0,0 +1,232 @@
+"""asyncio-вариант webhook_handler.py с теми же маршрутами.
+
+    uvicorn asgi_app:app --host 0.0.0.0 --port 5000 --workers 2
+
+Конфигурация проверяется и логирование настраивается при запуске (lifespan) в каждом процессе uvicorn.
+
+/payment_callback только сохраняет событие и ставит задачу в очередь payments, как и во Flask;
+запросы в amoCRM выполняют только задачи Celery. Маршруты арендаторов — /webhook/{tenant}
+и /payment_callback/{tenant}. Обращения к SQLite (платежи, автоматы, отложенные задачи),
+чтение справочников amoCRM и публикация в брокер выполняются в пуле потоков: ожидание
+блокировки записи SQLite (до busy_timeout) не останавливает цикл событий.
+"""
+import asyncio
+import contextlib
+import logging
+import time
+
+from starlette.applications import Starlette
+from starlette.responses import JSONResponse, Response
+from starlette.routing import Route
+
+from circuit_breaker import circuit_states
+from bootstrap import bootstrap_web
+from config import Config
+from lead_ingest import LeadEventBuffer
+from logging_setup import new_correlation_id, set_correlation_id, reset_correlation_id, get_correlation_id
+from metrics import HTTP_REQUEST_SECONDS, WEBHOOK_EVENTS, render as render_metrics
+from payment_callback import callback_checksum, callback_sign_string
+from tasks import publish_lead_events, publish_registered_lead_events, register_lead_events, check_payments_task, enqueue_payment_event
+from tenants import UnknownTenant, registry
+from webhook_parser import has_lead_statuses, iter_lead_events
+
+logger = logging.getLogger("webhook_handler")
+callback_logger = logging.getLogger('callback_handler')
+
+lead_buffer = LeadEventBuffer(
+    publish_registered_lead_events,
+    register_lead_events,
+    maxsize=Config.INGEST_BUFFER_SIZE,
+    batch_size=Config.INGEST_BATCH_SIZE
+)
+
+
+class RequestContextMiddleware:
+    """Correlation id (X-Request-ID) и время обработки запроса — как before/after_request во Flask."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        headers = dict(scope["headers"])
+        correlation_id = headers.get(b"x-request-id", b"").decode("latin-1") or new_correlation_id()
+        token = set_correlation_id(correlation_id)
+        started = time.perf_counter()
+        status = {}
+
+        async def send_with_header(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+                message["headers"] = list(message.get("headers", [])) + [
+                    (b"x-request-id", correlation_id.encode("latin-1"))
+                ]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_header)
+        finally:
+            endpoint = scope.get("endpoint")
+            HTTP_REQUEST_SECONDS.labels(
+                getattr(endpoint, "__name__", "unknown"), str(status.get("code", 500))
+            ).observe(time.perf_counter() - started)
+            reset_correlation_id(token)
+
+
+async def index(request):
+    return JSONResponse({"status": "ok"})
+
+
+async def metrics(request):
+    body, content_type = render_metrics()
+    return Response(body, media_type=content_type)
+
+
+def circuits_state():
+    deferred = {tenant.name: registry.services(tenant.name).deferred.stats() for tenant in registry.all()}
+    return {"circuits": circuit_states(Config.RATE_LIMIT_DB), "deferred": deferred}
+
+
+async def circuits(request):
+    return JSONResponse(await asyncio.to_thread(circuits_state))
+
+
+def unknown_tenant(tenant):
+    logger.warning(f"Запрос для неизвестного арендатора: {tenant}")
+    return JSONResponse({"status": "error", "message": "Unknown tenant"}, status_code=404)
+
+
+async def webhook(request):
+    start_time = time.time()
+    tenant = request.path_params.get("tenant")
+    try:
+        services = registry.services(tenant)
+    except UnknownTenant:
+        return unknown_tenant(tenant)
+    try:
+        content_type = request.headers.get("Content-Type", "")
+        if "application/x-www-form-urlencoded" not in content_type and "application/json" not in content_type:
+            logger.warning(f"Неподдерживаемый Content-Type: {content_type}")
+            return JSONResponse({"status": "ignored_non_json"})
+
+        body = await request.body()
+        try:
+            events = iter_lead_events(body, content_type)
+        except ValueError:
+            logger.warning("Получен невалидный JSON")
+            return JSONResponse({"status": "invalid_json"})
+
+        # Правила отбора при первом обращении разрешаются по справочникам amoCRM (файл или запрос)
+        matches = await asyncio.to_thread(getattr, services.lead_filter, "matches")
+        correlation_id = get_correlation_id()
+        received = queued = 0
+        overflow = []
+        for lead_id, status_id, pipeline_id in events:
+            received += 1
+            if not matches(status_id, pipeline_id):
+                WEBHOOK_EVENTS.labels("filtered").inc()
+                continue
+            queued += 1
+            event = (lead_id, status_id, pipeline_id, correlation_id, services.tenant.name)
+            if lead_buffer.put(event):
+                WEBHOOK_EVENTS.labels("buffered").inc()
+            else:
+                WEBHOOK_EVENTS.labels("published_inline").inc()
+                overflow.append(event)
+        if overflow:
+            # Буфер переполнен: публикуем сами, но не в цикле событий
+            await asyncio.to_thread(publish_lead_events, overflow)
+
+        if not received:
+            if has_lead_statuses(body, content_type):
+                logger.info("Тестовый вебхук, возвращаем быстрый ответ")
+                return JSONResponse({"status": "test_received"})
+            logger.info("Нет обновленных сделок")
+            return JSONResponse({"status": "ignored"})
+
+        elapsed_time = time.time() - start_time
+        logger.info(f"Вебхук обработан за {elapsed_time:.3f} секунд: сделок {received}, в очередь {queued}")
+        return JSONResponse({"status": "success"})
+    except Exception as e:
+        logger.error(f"Критическая ошибка в вебхуке: {str(e)}")
+        return JSONResponse({"status": "error", "message": str(e)})
+
+
+async def check_payments(request):
+    task = await asyncio.to_thread(check_payments_task.delay)
+    logger.info(f"Проверка оплат поставлена в очередь, task_id: {task.id}")
+    open_payments = await asyncio.to_thread(
+        lambda: sum(registry.services(tenant.name).payment_store.count() for tenant in registry.all())
+    )
+    return JSONResponse({"status": "scheduled", "task_id": task.id, "open_payments": open_payments}, status_code=202)
+
+
+async def payment_callback(request):
+    callback_logger.info(f"Payment callback received: {request.url.query}")
+    tenant = request.path_params.get("tenant")
+    try:
+        services = registry.services(tenant)
+    except UnknownTenant:
+        return unknown_tenant(tenant)
+    payment_store = services.payment_store
+
+    params = request.query_params
+    md_order = params.get("mdOrder")
+    order_number = params.get("orderNumber")
+    operation = params.get("operation")
+    status = params.get("status")
+    checksum = params.get("checksum")
+
+    if not all([md_order, order_number, status]):
+        callback_logger.error("Некорректные данные в callback: отсутствуют обязательные параметры")
+        return JSONResponse({"status": "error", "message": "Missing required parameters"}, status_code=400)
+
+    if not status.isdigit():
+        callback_logger.error(f"Некорректный статус в callback: {status}")
+        return JSONResponse({"status": "error", "message": "Invalid status"}, status_code=400)
+
+    if checksum:
+        computed_checksum = callback_checksum(callback_sign_string(params.items()), services.tenant.callback_secret_key)
+        if computed_checksum != checksum:
+            callback_logger.error(f"Неверная контрольная сумма: ожидаемая {computed_checksum}, полученная {checksum}")
+            return JSONResponse({"status": "error", "message": "Invalid checksum"}, status_code=400)
+
+    # Обращение к Lazy-хранилищу тоже в потоке: при первом создаются база и миграции
+    lead_id = await asyncio.to_thread(lambda: payment_store.find_lead_by_order(md_order, order_number))
+    if not lead_id:
+        callback_logger.warning(f"Не найдена сделка с mdOrder: {md_order} и orderNumber: {order_number}")
+        return JSONResponse({"status": "received"})
+
+    event_id, pending = await asyncio.to_thread(
+        lambda: payment_store.record_callback_event(lead_id, md_order, order_number, operation, status)
+    )
+    if not pending:
+        callback_logger.info(f"Повторный callback для сделки {lead_id}: событие {event_id} уже обработано")
+    elif await asyncio.to_thread(enqueue_payment_event, event_id, services.tenant.name):
+        callback_logger.info(f"Событие {event_id} для сделки {lead_id} поставлено в очередь: операция {operation}, статус {status}")
+
+    return JSONResponse({"status": "received"})
+
+
+@contextlib.asynccontextmanager
+async def lifespan(app):
+    bootstrap_web()
+    yield
+
+
+app = Starlette(
+    routes=[
+        Route("/", index, methods=["GET"]),
+        Route("/metrics", metrics, methods=["GET"]),
+        Route("/circuits", circuits, methods=["GET"]),
+        Route("/webhook", webhook, methods=["POST"]),
+        Route("/webhook/{tenant}", webhook, methods=["POST"]),
+        Route("/check_payments", check_payments, methods=["GET"]),
+        Route("/payment_callback", payment_callback, methods=["GET"]),
+        Route("/payment_callback/{tenant}", payment_callback, methods=["GET"]),
+    ],
+    lifespan=lifespan,
+)
+app.add_middleware(RequestContextMiddleware)
@@ -0,0 +1,71 @@
+"""Нагрузочное сравнение /payment_callback: Flask под gunicorn (sync) против asgi_app под uvicorn.
+
+    python benchmarks/bench_callback_load.py [--callbacks 400] [--concurrency 200] [--latency 0.1] [--workers 4]
+
+Каждый callback — успешная оплата своего заказа. Обработчик сохраняет событие и ставит задачу
+apply_payment_event в очередь payments; запросы к заглушке amoCRM (задержка latency) делает уже
+воркер Celery, поэтому amocrm_requests здесь 0. Выводит пропускную способность и p50/p95/p99.
+"""
+import argparse
+import asyncio
+import json
+import os
+
+import bench_env
+from fake_servers import FakeAmoCRM
+from load import run_load, serve
+
+
+def seed_payments(count, offset):
+    from payment_store import PaymentStore
+    store = PaymentStore(os.environ["PAYMENTS_DB"])
+    orders = []
+    for index in range(offset, offset + count):
+        lead_id = str(100000 + index)
+        payment = {"order_number": f"bench-{index}", "amount": 100000, "form_url": "", "order_id": f"md-{index}"}
+        store.upsert(lead_id, payment)
+        orders.append((payment["order_id"], payment["order_number"]))
+    return orders
+
+
+def callback_requests(orders):
+    return [
+        ("GET", "/payment_callback",
+         {"mdOrder": md_order, "orderNumber": order_number, "operation": "deposited", "status": "1"}, None, None)
+        for md_order, order_number in orders
+    ]
+
+
+def run(app, args, amocrm, offset):
+    with serve(app, amocrm.url, workers=args.workers) as url:
+        orders = seed_payments(args.callbacks, offset)
+        requests_before = amocrm.requests
+        result = asyncio.run(run_load(url, callback_requests(orders), args.concurrency))
+        result["amocrm_requests"] = amocrm.requests - requests_before
+        return result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--callbacks", type=int, default=400)
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.1, help="Задержка ответа amoCRM, секунды")
+    parser.add_argument("--workers", type=int, default=4, help="Sync-воркеры gunicorn для Flask")
+    parser.add_argument("--apps", default="flask,asgi")
+    args = parser.parse_args()
+
+    amocrm = FakeAmoCRM(latency=args.latency).start()
+    try:
+        for offset, app in enumerate(args.apps.split(",")):
+            result = run(app, args, amocrm, offset * args.callbacks)
+            result.update(app=app, concurrency=args.concurrency, latency=args.latency)
+            if app == "flask":
+                result["workers"] = args.workers
+            print(json.dumps(result))
+    finally:
+        amocrm.stop()
+    print(f"work dir: {bench_env.WORK_DIR}")
+
+
+if __name__ == "__main__":
+    main()
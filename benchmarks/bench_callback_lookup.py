@@ -0,0 +1,90 @@
+"""Время поиска сделки по callback (mdOrder, orderNumber) в зависимости от числа открытых платежей.
+
+    python benchmarks/bench_callback_lookup.py [--sizes 100,1000,10000,100000,1000000] [--lookups 2000]
+
+Для сравнения до 10 000 платежей замеряется и старый способ: полный перебор payments.json.
+"""
+import argparse
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from payment_store import PaymentStore
+
+LEGACY_SCAN_LIMIT = 10000
+
+
+def fill_store(store, size):
+    now = time.time()
+    rows = (
+        (str(lead_id), f"{lead_id}_A100", 10000, "https://example/form", f"order-{lead_id}", now, now)
+        for lead_id in range(size)
+    )
+    with store.db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO payments (lead_id, order_number, amount, form_url, order_id, created_at, updated_at) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            rows
+        )
+
+
+def percentile(samples, pct):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * pct / 100))]
+
+
+def time_lookups(lookup, size, lookups):
+    samples = []
+    for _ in range(lookups):
+        lead_id = random.randrange(size)
+        started = time.perf_counter()
+        found = lookup(f"order-{lead_id}", f"{lead_id}_A100")
+        samples.append((time.perf_counter() - started) * 1e6)
+        assert found == str(lead_id)
+    return samples
+
+
+def legacy_scan(payments_file):
+    def lookup(md_order, order_number):
+        with open(payments_file) as f:
+            payments = json.load(f)
+        for lid, payment in payments.items():
+            if payment.get("order_id") == md_order and payment.get("order_number") == order_number:
+                return lid
+        return None
+    return lookup
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", default="100,1000,10000,100000,1000000")
+    parser.add_argument("--lookups", type=int, default=2000)
+    args = parser.parse_args()
+
+    print(f"{'payments':>10} {'store p50 us':>13} {'store p99 us':>13} {'legacy p50 us':>14}")
+    for size in [int(s) for s in args.sizes.split(",")]:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = PaymentStore(os.path.join(tmp, "payments.db"))
+            store.count()
+            fill_store(store, size)
+            samples = time_lookups(store.find_lead_by_order, size, args.lookups)
+
+            legacy = ""
+            if size <= LEGACY_SCAN_LIMIT:
+                payments_file = os.path.join(tmp, "payments.json")
+                with open(payments_file, "w") as f:
+                    json.dump({lid: payment for lid, payment in store.items()}, f, indent=4)
+                legacy_samples = time_lookups(legacy_scan(payments_file), size, min(args.lookups, 50))
+                legacy = f"{statistics.median(legacy_samples):14.1f}"
+
+            print(f"{size:>10} {statistics.median(samples):13.1f} {percentile(samples, 99):13.1f} {legacy:>14}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Окружение для бенчмарков: путь к модулям проекта и фиктивные обязательные переменные Config."""
+import os
+import sys
+import tempfile
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, ROOT)
+
+WORK_DIR = tempfile.mkdtemp(prefix="alfaamo-bench-")
+
+# Воронка и статус сделок заглушки amoCRM, для которых создаются ссылки
+BENCH_PIPELINE_ID = 100
+BENCH_STATUS_ID = 200
+
+BENCH_ENV = {
+    "FLASK_SECRET_KEY": "bench",
+    "AMOCRM_CLIENT_ID": "bench",
+    "AMOCRM_CLIENT_SECRET": "bench",
+    "AMOCRM_REDIRECT_URI": "http://127.0.0.1/",
+    "AMOCRM_ACCESS_TOKEN": "bench",
+    "AMOCRM_DOMAIN": "bench.amocrm.local",
+    "AMOCRM_ACCOUNT_ID": "1",
+    "AMO_PIPELINE_ID": str(BENCH_PIPELINE_ID),
+    "AMO_STATUS_ID": str(BENCH_STATUS_ID),
+    "AMO_ALLOWED_STATUS_IDS": f"{BENCH_STATUS_ID},201",
+    "AMO_CUSTOM_FIELD_ID": "300",
+    "SBP_MERCHANT_LOGIN": "bench",
+    "SBP_MERCHANT_PASSWORD": "bench",
+    "SBP_RETURN_URL": "http://127.0.0.1/return",
+    "CALLBACK_SECRET_KEY": "bench-secret",
+    "AMOCRM_RATE_LIMIT": "100000",
+    "PAYMENTS_DB": os.path.join(WORK_DIR, "payments.db"),
+    "PAYMENTS_FILE": os.path.join(WORK_DIR, "payments.json"),
+    "RATE_LIMIT_DB": os.path.join(WORK_DIR, "ratelimit.db"),
+    "LOG_DIR": WORK_DIR,
+}
+
+for key, value in BENCH_ENV.items():
+    os.environ.setdefault(key, value)
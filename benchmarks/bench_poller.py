@@ -0,0 +1,59 @@
+"""Опрос открытых платежей: последовательно (как раньше в /check_payments) и с параллельностью.
+
+    python benchmarks/bench_poller.py [--payments 500] [--latency 0.02] [--concurrency 1,8,32]
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+
+import bench_env  # noqa: F401  (переменные окружения до импорта config)
+from fake_servers import FakeAmoCRM, FakeBank
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--payments", type=int, default=500)
+    parser.add_argument("--latency", type=float, default=0.02, help="Задержка ответа банка, секунды")
+    parser.add_argument("--concurrency", default="1,8,32")
+    args = parser.parse_args()
+    concurrency = [int(c) for c in args.concurrency.split(",")]
+    os.environ["HTTP_POOL_SIZE"] = str(max(concurrency))
+
+    from amocrm_client import AmoCRMClient
+    from config import Config
+    from payment_poller import PaymentPoller
+    from payment_store import PaymentStore
+    from sbp_client import SBPClient
+
+    bank = FakeBank(latency=args.latency, paid_ratio=0.05).start()
+    amocrm = FakeAmoCRM().start()
+    results = []
+    try:
+        for workers in concurrency:
+            with tempfile.TemporaryDirectory() as tmp:
+                store = PaymentStore(os.path.join(tmp, "payments.db"))
+                now = time.time()
+                for lead_id in range(args.payments):
+                    store.upsert(lead_id, {"order_number": f"{lead_id}_A100", "order_id": f"o-{lead_id}",
+                                           "amount": 1000, "created_at": now})
+                sbp_client = SBPClient()
+                sbp_client.base_url = f"{bank.url}/payment/rest"
+                amocrm_client = AmoCRMClient()
+                amocrm_client.base_url = f"{amocrm.url}/api/v4"
+
+                summary = PaymentPoller(store, sbp_client, amocrm_client, Config.PAID_STATUS, Config.PAID_TAG,
+                                        max_workers=workers).run()
+                summary["concurrency"] = workers
+                summary["orders_per_second"] = round(summary["checked"] / summary["elapsed"], 1)
+                results.append(summary)
+                print(json.dumps(summary, ensure_ascii=False))
+    finally:
+        bank.stop()
+        amocrm.stop()
+    return results
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+"""Сверка открытых платежей со сделками amoCRM (reconcile.LeadReconciler).
+
+    python benchmarks/bench_reconcile.py [--leads 20000] [--missing 0.05] [--stale 500] [--latency 0.05]
+
+В хранилище заранее лежат платежи всех сделок, кроме доли missing, и stale платежей удалённых
+сделок. Выводит число страниц, созданных ссылок, снятых платежей, время и пик памяти Python.
+"""
+import argparse
+import json
+import os
+import tempfile
+import time
+import tracemalloc
+
+import bench_env  # noqa: F401  (переменные окружения до импорта config)
+from fake_servers import FakeAmoCRM, FakeBank
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leads", type=int, default=20000)
+    parser.add_argument("--missing", type=float, default=0.05, help="Доля сделок без ссылки")
+    parser.add_argument("--stale", type=int, default=500, help="Платежи удалённых сделок")
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответов amoCRM и банка, секунды")
+    parser.add_argument("--workers", type=int, default=8)
+    args = parser.parse_args()
+    os.environ["HTTP_POOL_SIZE"] = str(args.workers)
+
+    from amocrm_client import AmoCRMClient
+    from config import Config
+    from lead_filter import LeadFilter
+    from payment_store import PaymentStore
+    from reconcile import LeadReconciler
+    from sbp_client import SBPClient
+    from tenants import Tenant
+
+    amocrm = FakeAmoCRM(latency=args.latency, total_leads=args.leads).start()
+    bank = FakeBank(latency=args.latency).start()
+    try:
+        with tempfile.TemporaryDirectory() as tmp:
+            store = PaymentStore(os.path.join(tmp, "payments.db"))
+            now = time.time()
+            step = int(1 / args.missing) if args.missing else 0
+            for lead_id in range(1, args.leads + args.stale + 1):
+                if step and lead_id % step == 0:
+                    continue
+                store.upsert(lead_id, {"order_number": f"{lead_id}_old", "order_id": f"o-{lead_id}",
+                                       "amount": amocrm.price * 100, "created_at": now})
+
+            amocrm_client = AmoCRMClient()
+            amocrm_client.base_url = f"{amocrm.url}/api/v4"
+            sbp_client = SBPClient()
+            sbp_client.base_url = f"{bank.url}/payment/rest"
+
+            def register_order(lead_id, amount):
+                response = sbp_client.create_payment_link(amount, f"{lead_id}_{amount}_1")
+                return {"order_number": f"{lead_id}_{amount}_1", "order_id": response["orderId"],
+                        "form_url": response["formUrl"]}
+
+            def save_payment(lead_id, expected_rev, payment):
+                if not store.compare_and_set(lead_id, expected_rev, payment):
+                    store.upsert(lead_id, payment)
+
+            reconciler = LeadReconciler(store, amocrm_client, LeadFilter(Tenant.from_config().pipeline_rules), register_order, save_payment,
+                                        Config.PAID_STATUS, max_workers=args.workers)
+            tracemalloc.start()
+            summary = reconciler.run()
+            summary["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 2 ** 20, 1)
+            tracemalloc.stop()
+            summary["leads_per_second"] = round(summary["leads"] / summary["elapsed"], 1)
+            summary["amocrm_requests"] = amocrm.requests
+            summary["remaining"] = store.count()
+            print(json.dumps(summary, ensure_ascii=False))
+    finally:
+        amocrm.stop()
+        bank.stop()
+
+
+if __name__ == "__main__":
+    main()
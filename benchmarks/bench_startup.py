@@ -0,0 +1,76 @@
+"""Холодный старт процессов: импорт и инициализация веб-приложения и воркера Celery.
+
+    python benchmarks/bench_startup.py [--repeat 5] [--output startup.json]
+
+Каждый замер — новый интерпретатор. import_ms — время импорта модуля, bootstrap_ms — проверка
+конфигурации, настройка логирования и (для воркера) привязка задач, process_ms — весь процесс
+от запуска python. Отдельно проверяется, что модули импортируются без переменных окружения.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+import bench_env
+
+TARGETS = {
+    "web": ("webhook_handler", "webhook_handler.create_app()"),
+    "asgi": ("asgi_app", "bootstrap.bootstrap_web()"),
+    "worker": ("tasks", "tasks.app.finalize(auto=True); bootstrap.bootstrap_worker()"),
+}
+
+CHILD = """
+import sys, time, json
+sys.path.insert(0, {root!r})
+started = time.perf_counter()
+import bootstrap, {module}
+imported = time.perf_counter()
+{init}
+done = time.perf_counter()
+print(json.dumps({{"import_ms": (imported - started) * 1000, "bootstrap_ms": (done - imported) * 1000}}))
+"""
+
+
+def run_child(module, init, env):
+    code = CHILD.format(root=bench_env.ROOT, module=module, init=init)
+    started = time.perf_counter()
+    output = subprocess.run([sys.executable, "-c", code], env=env, capture_output=True, text=True, check=True)
+    process_ms = (time.perf_counter() - started) * 1000
+    result = json.loads(output.stdout.strip().splitlines()[-1])
+    result["process_ms"] = process_ms
+    return result
+
+
+def imports_without_env(module):
+    env = {"PATH": os.environ.get("PATH", ""), "HOME": os.environ.get("HOME", "")}
+    code = f"import sys; sys.path.insert(0, {bench_env.ROOT!r}); import {module}"
+    return subprocess.run([sys.executable, "-c", code], env=env, cwd=bench_env.WORK_DIR,
+                          capture_output=True).returncode == 0
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--output")
+    args = parser.parse_args()
+
+    env = dict(os.environ)
+    results = []
+    for name, (module, init) in TARGETS.items():
+        runs = [run_child(module, init, env) for _ in range(args.repeat)]
+        result = {"target": name, "module": module}
+        for key in ("import_ms", "bootstrap_ms", "process_ms"):
+            result[key] = round(statistics.median(run[key] for run in runs), 1)
+        result["imports_without_env"] = imports_without_env(module)
+        results.append(result)
+        print(json.dumps(result))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"created_at": time.strftime("%Y-%m-%dT%H:%M:%S"), "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
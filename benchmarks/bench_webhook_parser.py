@@ -0,0 +1,101 @@
+"""Разбор пакетного вебхука amoCRM: прежний parse_form_data + json.dumps против iter_lead_events.
+
+    python benchmarks/bench_webhook_parser.py [--leads 1,50,500] [--repeat 200]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from urllib.parse import parse_qs, urlencode
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from webhook_parser import iter_lead_events
+
+
+def legacy_parse_form_data(form_data):
+    # Копия прежнего webhook_handler.parse_form_data
+    result = {}
+    for key, value in form_data.items():
+        parts = key.replace(']', '').split('[')
+        current = result
+        for part in parts[:-1]:
+            if part.isdigit():
+                part = int(part)
+                if part not in current:
+                    current[part] = {}
+                current = current[part]
+            else:
+                if part not in current:
+                    current[part] = {}
+                current = current[part]
+        current[parts[-1]] = value[0] if isinstance(value, list) else value
+    return result
+
+
+def legacy_events(body):
+    form_data = parse_qs(body.decode("utf-8"))
+    data = parse_form_data_logged(form_data)
+    status_dict = data["leads"]["status"]
+    for lead_status in status_dict.values():
+        yield (
+            str(lead_status.get("id")),
+            int(lead_status.get("status_id")) if lead_status.get("status_id") else None,
+            int(lead_status.get("pipeline_id")) if lead_status.get("pipeline_id") else None,
+        )
+
+
+def parse_form_data_logged(form_data):
+    # Прежний обработчик форматировал форму и результат для лога на каждый запрос
+    str(dict(form_data))
+    data = legacy_parse_form_data(form_data)
+    json.dumps(data, indent=2)
+    return data
+
+
+def make_body(leads, first_id=1000):
+    fields = [("account[subdomain]", "bench"), ("account[id]", "1")]
+    for index in range(leads):
+        prefix = f"leads[status][{index}]"
+        fields += [
+            (f"{prefix}[id]", str(first_id + index)),
+            (f"{prefix}[name]", f"Сделка {index}"),
+            (f"{prefix}[status_id]", "200"),
+            (f"{prefix}[old_status_id]", "199"),
+            (f"{prefix}[price]", "1500"),
+            (f"{prefix}[responsible_user_id]", "42"),
+            (f"{prefix}[last_modified]", "1700000000"),
+            (f"{prefix}[pipeline_id]", "100"),
+            (f"{prefix}[created_at]", "1700000000"),
+            (f"{prefix}[account_id]", "1"),
+        ]
+    return urlencode(fields).encode("utf-8")
+
+
+def measure(parse, body, repeat):
+    started = time.perf_counter()
+    for _ in range(repeat):
+        events = list(parse(body))
+    return (time.perf_counter() - started) / repeat * 1e6, events
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--leads", default="1,50,500")
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(f"{'leads':>6} {'legacy us':>11} {'stream us':>11} {'speedup':>8}")
+    for leads in [int(n) for n in args.leads.split(",")]:
+        body = make_body(leads)
+        legacy_us, legacy = measure(legacy_events, body, args.repeat)
+        stream_us, stream = measure(
+            lambda raw: iter_lead_events(raw, "application/x-www-form-urlencoded"), body, args.repeat
+        )
+        assert sorted(legacy) == sorted(stream)
+        print(f"{leads:>6} {legacy_us:11.1f} {stream_us:11.1f} {legacy_us / stream_us:7.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+"""Локальные заглушки amoCRM v4 и Альфа-Банка для бенчмарков.
+
+Каждый сервер запускается в фоновом потоке на свободном порту; latency добавляет задержку
+к каждому ответу, error_rate — долю ответов 503.
+"""
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+
+class _ThreadingServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 1024  # Нагрузочные тесты открывают сотни соединений одновременно
+
+
+class FakeServer:
+    def __init__(self, latency=0.0, error_rate=0.0):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.requests = 0
+        self._lock = threading.Lock()
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+            disable_nagle_algorithm = True
+
+            def log_message(self, *args):
+                pass
+
+            def _handle(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                body = self.rfile.read(length) if length else b""
+                parsed = urlparse(self.path)
+                with server._lock:
+                    server.requests += 1
+                if server.latency:
+                    time.sleep(server.latency)
+                if server.error_rate and random.random() < server.error_rate:
+                    status, payload = 503, {"error": "injected"}
+                else:
+                    status, payload = server.handle(self.command, parsed.path, parse_qs(parsed.query), body)
+                data = json.dumps(payload).encode("utf-8") if payload is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_POST = do_PATCH = _handle
+
+        self.httpd = _ThreadingServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.httpd.server_address[1]}"
+        self._thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+
+    def handle(self, method, path, query, body):
+        raise NotImplementedError
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+class FakeBank(FakeServer):
+    """register.do и getOrderStatus.do; paid_ratio — доля заказов, которые считаются оплаченными."""
+
+    def __init__(self, paid_ratio=0.1, **kwargs):
+        super().__init__(**kwargs)
+        self.paid_ratio = paid_ratio
+        self.orders = {}
+
+    def handle(self, method, path, query, body):
+        if path.endswith("/register.do"):
+            params = parse_qs(body.decode("utf-8")) if body else query
+            order_number = params.get("orderNumber", [""])[0]
+            if order_number in self.orders:
+                return 200, {"errorCode": "1", "errorMessage": "Заказ с таким номером уже обработан"}
+            order_id = str(uuid.uuid4())
+            self.orders[order_number] = order_id
+            return 200, {"orderId": order_id, "formUrl": f"{self.url}/payment/merchants/pay?mdOrder={order_id}"}
+        if path.endswith("/getOrderStatus.do") or path.endswith("/getOrderStatusExtended.do"):
+            order_number = query.get("orderNumber", [""])[0]
+            if path.endswith("/getOrderStatusExtended.do") and order_number not in self.orders:
+                return 200, {"errorCode": "6", "errorMessage": "Заказ не найден"}
+            paid = random.random() < self.paid_ratio
+            return 200, {"errorCode": "0", "orderNumber": order_number, "orderStatus": 2 if paid else 0}
+        return 404, {"error": "not found"}
+
+
+class FakeAmoCRM(FakeServer):
+    """Минимальный amoCRM v4: /leads, /leads/{id}, /leads/notes, /leads/{id}/notes.
+
+    GET /leads отдаёт сделки 1..total_leads страницами (page, limit) или по filter[id][];
+    сделок с id больше total_leads нет.
+    """
+
+    LEAD_PATH = re.compile(r"^/api/v4/leads/(\d+)$")
+    NOTES_PATH = re.compile(r"^/api/v4/leads/(\d+)/notes$")
+
+    def __init__(self, price=1000, pipeline_id=100, status_id=200, total_leads=10, **kwargs):
+        super().__init__(**kwargs)
+        self.price = price
+        self.total_leads = total_leads
+        self.pipeline_id = pipeline_id
+        self.status_id = status_id
+
+    def lead(self, lead_id):
+        return {
+            "id": int(lead_id),
+            "price": self.price,
+            "pipeline_id": self.pipeline_id,
+            "status_id": self.status_id,
+            "_embedded": {"tags": []},
+        }
+
+    def list_leads(self, query):
+        if "filter[id][]" in query:
+            lead_ids = [int(lead_id) for lead_id in query["filter[id][]"] if 0 < int(lead_id) <= self.total_leads]
+            has_next = False
+        else:
+            limit = int(query.get("limit", ["50"])[0])
+            page = int(query.get("page", ["1"])[0])
+            start = (page - 1) * limit + 1
+            lead_ids = range(start, min(start + limit, self.total_leads + 1))
+            has_next = start + limit <= self.total_leads
+        if not lead_ids:
+            return 204, None
+        payload = {"_embedded": {"leads": [self.lead(lead_id) for lead_id in lead_ids]}, "_links": {}}
+        if has_next:
+            payload["_links"]["next"] = {"href": "next"}
+        return 200, payload
+
+    def handle(self, method, path, query, body):
+        match = self.LEAD_PATH.match(path)
+        if match and method == "GET":
+            return 200, self.lead(match.group(1))
+        if match and method == "PATCH":
+            return 200, {"id": int(match.group(1))}
+        if path == "/api/v4/leads" and method == "PATCH":
+            leads = json.loads(body or b"[]")
+            return 200, {"_embedded": {"leads": [{"id": lead["id"]} for lead in leads]}}
+        if path == "/api/v4/leads" and method == "GET":
+            return self.list_leads(query)
+        if (path == "/api/v4/leads/notes" or self.NOTES_PATH.match(path)) and method == "POST":
+            notes = json.loads(body or b"[]")
+            return 200, {"_embedded": {"notes": [{"id": index} for index, _ in enumerate(notes)]}}
+        return 404, {"error": "not found"}
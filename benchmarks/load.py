@@ -0,0 +1,98 @@
+"""Общие части нагрузочных бенчмарков: запуск приложения через serve_app.py и генератор HTTP-запросов.
+
+Зависимости бенчмарков: pip install -r benchmarks/requirements.txt
+"""
+import asyncio
+import contextlib
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_ready(url, timeout=30):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            with urllib.request.urlopen(f"{url}/", timeout=1) as response:
+                if response.status == 200:
+                    return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f"{url} did not start")
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def latency_summary(latencies, elapsed, errors):
+    """Пропускная способность и p50/p95/p99 в миллисекундах по списку задержек в секундах."""
+    return {
+        "requests": len(latencies),
+        "errors": errors,
+        "elapsed": round(elapsed, 2),
+        "per_second": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_ms": round(percentile(latencies, 0.50) * 1000, 1),
+        "p95_ms": round(percentile(latencies, 0.95) * 1000, 1),
+        "p99_ms": round(percentile(latencies, 0.99) * 1000, 1),
+    }
+
+
+@contextlib.contextmanager
+def serve(app, amocrm_url, bank_url=None, workers=4):
+    """Запускает webhook_handler (app="flask") или asgi_app (app="asgi") и отдаёт его URL."""
+    port = free_port()
+    command = [sys.executable, os.path.join(HERE, "serve_app.py"), app, "--port", str(port),
+               "--workers", str(workers), "--amocrm", amocrm_url]
+    if bank_url:
+        command += ["--bank", bank_url]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        url = f"http://127.0.0.1:{port}"
+        wait_ready(url)
+        yield url
+    finally:
+        server.terminate()
+        server.wait()
+
+
+async def run_load(url, requests, concurrency, ok_statuses=(200,)):
+    """Отправляет requests = [(method, path, params, data, headers)] не более чем concurrency одновременно."""
+    # aiohttp, а не httpx: пул httpcore тратит квадратичное время на очередь из сотен запросов
+    import aiohttp
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=300)) as client:
+        async def send(method, path, params, data, headers):
+            nonlocal errors
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with client.request(method, f"{url}{path}", params=params, data=data,
+                                              headers=headers) as response:
+                        await response.read()
+                        if response.status not in ok_statuses:
+                            errors += 1
+                except (aiohttp.ClientError, asyncio.TimeoutError):
+                    errors += 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(send(*request) for request in requests))
+        elapsed = time.perf_counter() - started
+    return latency_summary(latencies, elapsed, errors)
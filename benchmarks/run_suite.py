@@ -0,0 +1,231 @@
+"""Набор бенчмарков против заглушек amoCRM и Альфа-Банка с сохранением результатов в JSON.
+
+    python benchmarks/run_suite.py [--apps flask,asgi] [--requests 400] [--concurrency 100]
+                                   [--latency 0.05] [--error-rate 0] [--output bench-results.json]
+                                   [--baseline old-results.json --tolerance 0.2]
+
+Сценарии:
+  webhook, payment_callback, check_payments — HTTP-нагрузка на приложение из serve_app.py;
+  process_lead — задача целиком (amoCRM, register.do, запись в amoCRM и хранилище) в режиме eager;
+  check_payments_task — опрос открытых заказов в банке;
+  ingest — события /webhook через LeadEventBuffer и publish_lead_events в брокер; любая ошибка
+           публикации или неопубликованное событие завершают набор с кодом 1.
+
+Celery работает с брокером в памяти (memory://), RabbitMQ не нужен. С --baseline сравнивает
+per_second и p99_ms с прошлым запуском и завершается с кодом 1, если что-то хуже больше чем на tolerance.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bench_env
+from bench_callback_load import callback_requests, seed_payments
+from bench_webhook_parser import make_body
+from fake_servers import FakeAmoCRM, FakeBank
+from load import latency_summary, run_load, serve
+
+PROCESS_LEAD_FIRST_ID = 500000
+INGEST_FIRST_ID = 700000
+
+
+def webhook_requests(count, leads_per_webhook, first_id):
+    headers = {"Content-Type": "application/x-www-form-urlencoded"}
+    return [
+        ("POST", "/webhook", None, make_body(leads_per_webhook, first_id + index * leads_per_webhook), headers)
+        for index in range(count)
+    ]
+
+
+def http_scenarios(app, args, amocrm, bank, offset):
+    results = []
+    with serve(app, amocrm.url, bank.url, workers=args.workers) as url:
+        scenarios = [
+            ("webhook", webhook_requests(args.requests, args.leads_per_webhook, 1000000 + offset), (200,)),
+            ("payment_callback", callback_requests(seed_payments(args.requests, offset)), (200,)),
+            ("check_payments", [("GET", "/check_payments", None, None, None)] * args.requests, (202,)),
+        ]
+        for name, requests, ok_statuses in scenarios:
+            result = asyncio.run(run_load(url, requests, args.concurrency, ok_statuses))
+            result.update(scenario=name, app=app, concurrency=args.concurrency)
+            results.append(result)
+            print(json.dumps(result), flush=True)
+    return results
+
+
+def use_fakes(tasks, amocrm, bank):
+    tasks.app.conf.broker_url = "memory://"
+    tasks.app.conf.task_always_eager = True
+    # Задачи привязываются к приложению лениво; до запуска из пула потоков — заранее
+    tasks.app.finalize(auto=True)
+    services = tasks.registry.services()
+    services.amocrm_client.base_url = f"{amocrm.url}/api/v4"
+    services.sbp_client.base_url = f"{bank.url}/payment/rest"
+
+
+def process_lead_scenario(tasks, args):
+    def run_one(lead_id):
+        started = time.perf_counter()
+        result = tasks.process_lead.apply((str(lead_id), bench_env.BENCH_STATUS_ID, bench_env.BENCH_PIPELINE_ID))
+        return time.perf_counter() - started, result.failed()
+
+    lead_ids = range(PROCESS_LEAD_FIRST_ID, PROCESS_LEAD_FIRST_ID + args.requests)
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.task_concurrency) as executor:
+        outcomes = list(executor.map(run_one, lead_ids))
+    result = latency_summary(
+        [latency for latency, _ in outcomes], time.perf_counter() - started, sum(failed for _, failed in outcomes)
+    )
+    result.update(scenario="process_lead", app="celery-eager", concurrency=args.task_concurrency)
+    return result
+
+
+def check_payments_task_scenario(tasks, args):
+    from payment_store import PaymentStore
+    with tempfile.TemporaryDirectory() as tmp:
+        store = PaymentStore(os.path.join(tmp, "payments.db"))
+        now = time.time()
+        for lead_id in range(args.requests):
+            store.upsert(lead_id, {"order_number": f"{lead_id}_A100", "order_id": f"o-{lead_id}",
+                                   "amount": 1000, "created_at": now})
+        services = tasks.registry.services()
+        main_store, services.payment_store = services.payment_store, store
+        try:
+            summary = tasks.check_payments_task.apply().get()
+        finally:
+            services.payment_store = main_store
+    return {
+        "scenario": "check_payments_task",
+        "app": "celery-eager",
+        "concurrency": tasks.Config.PAYMENTS_POLL_CONCURRENCY,
+        "requests": summary["checked"],
+        "errors": summary["errors"],
+        "elapsed": summary["elapsed"],
+        "per_second": round(summary["checked"] / summary["elapsed"], 1) if summary["elapsed"] else None,
+    }
+
+
+def ingest_scenario(tasks, args):
+    from lead_ingest import LeadEventBuffer
+    from prometheus_client import REGISTRY
+
+    def counter(name):
+        return REGISTRY.get_sample_value(name) or 0.0
+    # Задачи только публикуются в брокер в памяти, как из процесса gunicorn; выполнять их не нужно
+    tasks.app.conf.task_always_eager = False
+    try:
+        buffer = LeadEventBuffer(tasks.publish_registered_lead_events, tasks.register_lead_events,
+                                 batch_size=tasks.Config.INGEST_BATCH_SIZE)
+        published_before = counter("alfaamo_queue_published_events_total")
+        errors_before = counter("alfaamo_ingest_publish_errors_total")
+        started = time.perf_counter()
+        for index in range(args.requests):
+            buffer.put((str(INGEST_FIRST_ID + index), bench_env.BENCH_STATUS_ID, bench_env.BENCH_PIPELINE_ID,
+                        f"bench-{index}", None))
+        buffer.drain(timeout=30.0)
+        elapsed = time.perf_counter() - started
+    finally:
+        tasks.app.conf.task_always_eager = True
+    published = int(counter("alfaamo_queue_published_events_total") - published_before)
+    publish_errors = int(counter("alfaamo_ingest_publish_errors_total") - errors_before)
+    return {
+        "scenario": "ingest",
+        "app": "celery-memory",
+        "requests": args.requests,
+        "errors": publish_errors + args.requests - published,
+        "elapsed": round(elapsed, 3),
+        "per_second": round(published / elapsed, 1) if elapsed else None,
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=bench_env.ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path, tolerance):
+    """Список ухудшений относительно baseline: меньше per_second или больше p99_ms более чем на tolerance."""
+    with open(baseline_path) as f:
+        baseline = {(item["scenario"], item["app"]): item for item in json.load(f)["results"]}
+    regressions = []
+    for result in results:
+        old = baseline.get((result["scenario"], result["app"]))
+        if old is None:
+            continue
+        if old.get("per_second") and result.get("per_second") is not None \
+                and result["per_second"] < old["per_second"] * (1 - tolerance):
+            regressions.append(f"{result['app']} {result['scenario']}: per_second {old['per_second']} -> {result['per_second']}")
+        if old.get("p99_ms") and result.get("p99_ms") is not None \
+                and result["p99_ms"] > old["p99_ms"] * (1 + tolerance):
+            regressions.append(f"{result['app']} {result['scenario']}: p99_ms {old['p99_ms']} -> {result['p99_ms']}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--apps", default="flask,asgi")
+    parser.add_argument("--requests", type=int, default=400, help="Запросов (задач, заказов) на сценарий")
+    parser.add_argument("--concurrency", type=int, default=100, help="Одновременных HTTP-запросов")
+    parser.add_argument("--task-concurrency", type=int, default=8, help="Параллельных задач process_lead")
+    parser.add_argument("--leads-per-webhook", type=int, default=5)
+    parser.add_argument("--latency", type=float, default=0.05, help="Задержка ответов amoCRM и банка, секунды")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Доля ответов 503 от amoCRM и банка")
+    parser.add_argument("--workers", type=int, default=4, help="Sync-воркеры gunicorn для Flask")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--baseline", help="JSON прошлого запуска для сравнения")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    amocrm = FakeAmoCRM(latency=args.latency, error_rate=args.error_rate,
+                        pipeline_id=bench_env.BENCH_PIPELINE_ID, status_id=bench_env.BENCH_STATUS_ID).start()
+    bank = FakeBank(latency=args.latency, error_rate=args.error_rate, paid_ratio=0.05).start()
+    results = []
+    try:
+        for offset, app in enumerate(filter(None, args.apps.split(","))):
+            results.extend(http_scenarios(app, args, amocrm, bank, offset * args.requests))
+
+        import tasks
+        use_fakes(tasks, amocrm, bank)
+        for scenario in (process_lead_scenario, check_payments_task_scenario, ingest_scenario):
+            result = scenario(tasks, args)
+            results.append(result)
+            print(json.dumps(result), flush=True)
+    finally:
+        amocrm.stop()
+        bank.stop()
+
+    report = {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "results": results,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2, ensure_ascii=False)
+    print(f"results: {args.output}, work dir: {bench_env.WORK_DIR}")
+
+    failed = [result for result in results if result["scenario"] == "ingest" and result["errors"]]
+    for result in failed:
+        print(f"FAILED ingest: {result['errors']} events not published")
+
+    if args.baseline:
+        regressions = compare(results, args.baseline, args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression}")
+        if regressions:
+            sys.exit(1)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
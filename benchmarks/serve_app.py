@@ -0,0 +1,65 @@
+"""Запуск webhook_handler (gunicorn, sync-воркеры) или asgi_app (uvicorn) против заглушек amoCRM и банка.
+
+    python benchmarks/serve_app.py flask --port 5001 --workers 4 --amocrm http://127.0.0.1:PORT
+    python benchmarks/serve_app.py asgi --port 5002 --amocrm http://127.0.0.1:PORT [--bank http://127.0.0.1:PORT]
+
+Окружение (пути к базам) наследуется от вызывающего бенчмарка через bench_env. Задачи Celery
+публикуются в брокер в памяти процесса (memory://): замеряется приём запроса, а не RabbitMQ.
+"""
+import argparse
+
+import bench_env  # noqa: F401  (переменные окружения до импорта config)
+
+
+def use_fakes(amocrm_url, bank_url):
+    import tasks
+    tasks.app.conf.broker_url = "memory://"
+    tasks.registry.services().amocrm_client.base_url = f"{amocrm_url}/api/v4"
+    if bank_url:
+        tasks.registry.services().sbp_client.base_url = f"{bank_url}/payment/rest"
+
+
+def serve_flask(port, workers, amocrm_url, bank_url=None):
+    from gunicorn.app.base import BaseApplication
+
+    use_fakes(amocrm_url, bank_url)
+    import webhook_handler
+
+    class Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"127.0.0.1:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "sync")
+            self.cfg.set("timeout", 120)
+            self.cfg.set("loglevel", "warning")
+
+        def load(self):
+            return webhook_handler.create_app()
+
+    Application().run()
+
+
+def serve_asgi(port, amocrm_url, bank_url=None):
+    import uvicorn
+
+    use_fakes(amocrm_url, bank_url)
+    import asgi_app
+    uvicorn.run(asgi_app.app, host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("app", choices=["flask", "asgi"])
+    parser.add_argument("--port", type=int, required=True)
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument("--amocrm", required=True)
+    parser.add_argument("--bank")
+    args = parser.parse_args()
+    if args.app == "flask":
+        serve_flask(args.port, args.workers, args.amocrm, args.bank)
+    else:
+        serve_asgi(args.port, args.amocrm, args.bank)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,59 @@
+"""Запуск процесса: веб-приложения (webhook_handler, asgi_app) и воркера Celery.
+
+Импорт модулей проекта ничего не проверяет и не настраивает. Конфигурация проверяется
+и логирование настраивается один раз при старте процесса (bootstrap_web / bootstrap_worker),
+клиенты и хранилища создаются при первом обращении (Lazy).
+"""
+import threading
+
+from config import Config
+from logging_setup import configure_logging
+
+WEB_LOG_FILES = ('webapp.log', {'callback_handler': 'callback.log'})
+WORKER_LOG_FILES = ('celery.log', {'callback_handler': 'callback.log'})
+
+
+class Lazy:
+    """Объект, создаваемый factory() при первом обращении к его атрибутам; один на процесс.
+
+    Клиенты и хранилища сами пересоздают соединения после fork, поэтому экземпляр,
+    созданный до fork (gunicorn с preload_app), можно использовать и в дочерних процессах.
+    """
+
+    def __init__(self, factory):
+        object.__setattr__(self, "_factory", factory)
+        object.__setattr__(self, "_instance", None)
+        object.__setattr__(self, "_lock", threading.Lock())
+
+    def _get(self):
+        instance = self._instance
+        if instance is None:
+            with self._lock:
+                instance = self._instance
+                if instance is None:
+                    instance = self._factory()
+                    object.__setattr__(self, "_instance", instance)
+        return instance
+
+    def __getattr__(self, name):
+        return getattr(self._get(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self._get(), name, value)
+
+
+def bootstrap(log_file, extra_files=None):
+    """Проверка конфигурации и настройка логирования; повторные вызовы в процессе ничего не делают."""
+    Config.validate()
+    # Файл арендаторов читается при старте: ошибка в нём не должна ждать первого запроса
+    from tenants import registry
+    registry.all()
+    configure_logging(log_file, extra_files)
+
+
+def bootstrap_web():
+    bootstrap(*WEB_LOG_FILES)
+
+
+def bootstrap_worker():
+    bootstrap(*WORKER_LOG_FILES)
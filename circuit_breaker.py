@@ -0,0 +1,135 @@
+import logging
+import os
+import time
+
+from sqlite_db import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+STATE_CLOSED = "closed"
+STATE_OPEN = "open"
+STATE_HALF_OPEN = "half_open"
+
+# Ответы, которые означают недоступность внешнего сервиса, а не ошибку в запросе
+FAILURE_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+MIGRATIONS = [
+    [
+        "CREATE TABLE IF NOT EXISTS circuit_breakers ("
+        "name TEXT PRIMARY KEY, state TEXT NOT NULL, failures INTEGER NOT NULL, "
+        "opened_at REAL, probe_at REAL, updated_at REAL NOT NULL)",
+    ],
+]
+
+
+class CircuitOpen(Exception):
+    """Запрос не отправлен: внешний сервис недоступен, автомат разомкнут до retry_at."""
+
+    def __init__(self, name, retry_at):
+        self.name = name
+        self.retry_at = retry_at
+        super().__init__(f"Circuit '{name}' is open, next probe in {max(retry_at - time.time(), 0):.1f}s")
+
+
+class CircuitBreaker:
+    """Автомат защиты одного внешнего сервиса, общий для всех процессов на хосте (состояние в SQLite).
+
+    После failure_threshold ошибок подряд автомат размыкается: запросы сразу получают
+    CircuitOpen, не занимая поток ожиданием таймаута. Через reset_timeout один процесс
+    пропускает пробный запрос (half-open): успех замыкает автомат, ошибка размыкает снова.
+    В замкнутом состоянии без ошибок проверка — одно чтение, без блокировки на запись.
+    """
+
+    def __init__(self, path, name, failure_threshold=5, reset_timeout=30.0):
+        self.db = SQLiteDatabase(path)
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._ready_pid = None
+
+    def _conn(self):
+        if self._ready_pid != os.getpid():
+            self.db.migrate("circuit_breaker", MIGRATIONS)
+            self._ready_pid = os.getpid()
+        return self.db.connection()
+
+    def _row(self, conn):
+        return conn.execute("SELECT * FROM circuit_breakers WHERE name = ?", (self.name,)).fetchone()
+
+    def before_request(self):
+        """Пропускает запрос или бросает CircuitOpen; в half-open пропускает только одну пробу за reset_timeout."""
+        row = self._row(self._conn())
+        if row is None or row["state"] == STATE_CLOSED:
+            return
+        now = time.time()
+        with self.db.transaction() as conn:
+            row = self._row(conn)
+            if row["state"] == STATE_CLOSED:
+                return
+            probe_at = row["probe_at"] if row["state"] == STATE_HALF_OPEN else row["opened_at"]
+            retry_at = probe_at + self.reset_timeout
+            if now < retry_at:
+                raise CircuitOpen(self.name, retry_at)
+            conn.execute(
+                "UPDATE circuit_breakers SET state = ?, probe_at = ?, updated_at = ? WHERE name = ?",
+                (STATE_HALF_OPEN, now, now, self.name)
+            )
+        logger.info(f"Circuit '{self.name}': half-open, sending a probe request")
+
+    def record_success(self):
+        row = self._row(self._conn())
+        if row is None or (row["state"] == STATE_CLOSED and row["failures"] == 0):
+            return
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE circuit_breakers SET state = ?, failures = 0, opened_at = NULL, probe_at = NULL, "
+                "updated_at = ? WHERE name = ?",
+                (STATE_CLOSED, time.time(), self.name)
+            )
+        if row["state"] != STATE_CLOSED:
+            logger.info(f"Circuit '{self.name}': closed, upstream recovered")
+
+    def record_failure(self):
+        self._conn()
+        now = time.time()
+        with self.db.transaction() as conn:
+            row = self._row(conn)
+            failures = (row["failures"] if row else 0) + 1
+            state = row["state"] if row else STATE_CLOSED
+            opens = state == STATE_HALF_OPEN or (state == STATE_CLOSED and failures >= self.failure_threshold)
+            conn.execute(
+                "INSERT INTO circuit_breakers (name, state, failures, opened_at, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET state = excluded.state, failures = excluded.failures, "
+                "opened_at = COALESCE(excluded.opened_at, circuit_breakers.opened_at), updated_at = excluded.updated_at",
+                (self.name, STATE_OPEN if opens else state, failures, now if opens else None, now)
+            )
+        if opens:
+            logger.warning(f"Circuit '{self.name}': open after {failures} consecutive failures")
+
+    def observe(self, status=None, error=None):
+        """Учитывает исход запроса: исключение транспорта или код из FAILURE_STATUSES — ошибка."""
+        if error is not None or status in FAILURE_STATUSES:
+            self.record_failure()
+        else:
+            self.record_success()
+
+    def allows(self):
+        """Без изменения состояния: можно ли сейчас отправить запрос (замкнут или пора пробовать)."""
+        row = self._row(self._conn())
+        if row is None or row["state"] == STATE_CLOSED:
+            return True
+        probe_at = row["probe_at"] if row["state"] == STATE_HALF_OPEN else row["opened_at"]
+        return time.time() >= probe_at + self.reset_timeout
+
+    def state(self):
+        row = self._row(self._conn())
+        if row is None:
+            return {"name": self.name, "state": STATE_CLOSED, "failures": 0}
+        return dict(row)
+
+
+def circuit_states(path):
+    """Состояние всех автоматов хоста — для /circuits."""
+    db = SQLiteDatabase(path)
+    db.migrate("circuit_breaker", MIGRATIONS)
+    return [dict(row) for row in db.connection().execute("SELECT * FROM circuit_breakers ORDER BY name")]
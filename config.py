@@ -3,6 +3,34 @@ import os
 
 load_dotenv()
 
+
+def id_or_name(value):
+    """Значение настройки amoCRM: число — id, иначе название воронки, статуса или поля (см. amocrm_metadata)."""
+    if isinstance(value, int):
+        return value
+    value = str(value).strip()
+    return int(value) if value.isdigit() else value
+
+
+class RequiredId:
+    """Обязательная переменная окружения с id или названием: читается при первом обращении, а не при импорте config."""
+
+    def __init__(self, env_name):
+        self.env_name = env_name
+
+    def __set_name__(self, owner, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        value = os.getenv(self.env_name)
+        if not value:
+            raise ValueError(f"Отсутствует обязательная переменная окружения: {self.env_name}")
+        value = id_or_name(value)
+        # Дальше атрибут читается как обычное значение класса
+        setattr(owner, self.name, value)
+        return value
+
+
 class Config:
     # Flask
     FLASK_SECRET_KEY = os.getenv("FLASK_SECRET_KEY")
@@ -14,10 +42,18 @@ class Config:
     AMOCRM_ACCESS_TOKEN = os.getenv("AMOCRM_ACCESS_TOKEN")
     AMOCRM_DOMAIN = os.getenv("AMOCRM_DOMAIN")
     AMOCRM_ACCOUNT_ID = os.getenv("AMOCRM_ACCOUNT_ID")
-    PIPELINE_ID = int(os.getenv("AMO_PIPELINE_ID"))
-    STATUS_ID = int(os.getenv("AMO_STATUS_ID"))
-    ALLOWED_STATUS_IDS = [int(status_id) for status_id in os.getenv("AMO_ALLOWED_STATUS_IDS", "").split(",") if status_id]  # Список статусов
-    CUSTOM_FIELD_ID = int(os.getenv("AMO_CUSTOM_FIELD_ID"))
+    # Воронки, статусы и поле можно задать id или названием; названия разрешаются по справочникам amoCRM
+    PIPELINE_ID = RequiredId("AMO_PIPELINE_ID")
+    STATUS_ID = RequiredId("AMO_STATUS_ID")
+    ALLOWED_STATUS_IDS = frozenset(id_or_name(status_id) for status_id in os.getenv("AMO_ALLOWED_STATUS_IDS", "").split(",") if status_id)  # Список статусов
+    PIPELINE_RULES = os.getenv("AMO_PIPELINE_RULES", "")  # Доп. воронки: "pipeline_id:status_id,status_id;..."
+    CUSTOM_FIELD_ID = RequiredId("AMO_CUSTOM_FIELD_ID")
+    PAID_STATUS = id_or_name(os.getenv("AMO_PAID_STATUS", "54415022"))  # Статус «оплачено» в воронке AMO_PIPELINE_ID
+    DECLINED_STATUS = id_or_name(os.getenv("AMO_DECLINED_STATUS", "54415023"))  # Колонка «Оплата не прошла»
+    PAID_TAG = os.getenv("AMO_PAID_TAG", "оплачено")
+    AMOCRM_METADATA_TTL = float(os.getenv("AMOCRM_METADATA_TTL", "3600"))  # Срок сохранённых справочников amoCRM, секунды
+    AMOCRM_RATE_LIMIT = float(os.getenv("AMOCRM_RATE_LIMIT", "7"))  # Запросов в секунду на все процессы хоста
+    AMOCRM_BATCH_WINDOW = float(os.getenv("AMOCRM_BATCH_WINDOW", "0.05"))  # Окно объединения запросов, секунды
     
     # Alfa-Bank SBP
     SBP_MERCHANT_LOGIN = os.getenv("SBP_MERCHANT_LOGIN")
@@ -25,9 +61,72 @@ class Config:
     SBP_TEST_ENV = os.getenv("SBP_TEST_ENV", "true").lower() == "true"
     SBP_RETURN_URL = os.getenv("SBP_RETURN_URL")
     SBP_PAYMENT_TOKEN = os.getenv("SBP_PAYMENT_TOKEN")
+    SBP_SESSION_TIMEOUT_SECS = int(os.getenv("SBP_SESSION_TIMEOUT_SECS", "86400"))  # Время жизни платёжной ссылки
 
     # Alfa-Bank Callback Secret Key
     CALLBACK_SECRET_KEY = os.getenv("CALLBACK_SECRET_KEY")
+    CALLBACK_URL = os.getenv("CALLBACK_URL", "https://alfa-amocrm.ru/payment_callback")  # callbackUrl заказов; у арендаторов — CALLBACK_URL/<name>
+
+    # Арендаторы (аккаунты amoCRM и мерчанты) и шарды очередей Celery
+    TENANTS_FILE = os.getenv("TENANTS_FILE", "")  # JSON-список арендаторов; пусто — только арендатор из переменных выше
+    TENANT_SHARDS = int(os.getenv("TENANT_SHARDS", "1"))  # Больше 1 — очереди "<очередь>.<shard>"
+    CELERY_BROKER_URL = os.getenv("CELERY_BROKER_URL", "pyamqp://guest@localhost//")
+    TASKS_QUEUE = os.getenv("TASKS_QUEUE", "celery")
+
+    # Буфер входящих вебхуков перед RabbitMQ
+    INGEST_BUFFER_SIZE = int(os.getenv("INGEST_BUFFER_SIZE", "10000"))
+    INGEST_BATCH_SIZE = int(os.getenv("INGEST_BATCH_SIZE", "100"))
+    LEAD_DEBOUNCE_WINDOW = float(os.getenv("LEAD_DEBOUNCE_WINDOW", "3"))  # Окно объединения событий одной сделки, секунды
+
+    # HTTP-клиенты amoCRM и банка
+    HTTP_POOL_SIZE = int(os.getenv("HTTP_POOL_SIZE", "10"))
+    HTTP_CONNECT_TIMEOUT = float(os.getenv("HTTP_CONNECT_TIMEOUT", "3.05"))
+    HTTP_READ_TIMEOUT = float(os.getenv("HTTP_READ_TIMEOUT", "15"))
+    HTTP_MAX_RETRIES = int(os.getenv("HTTP_MAX_RETRIES", "3"))
+    HTTP_BACKOFF_FACTOR = float(os.getenv("HTTP_BACKOFF_FACTOR", "0.5"))
+
+    # Логирование
+    LOG_DIR = os.getenv("LOG_DIR", "/root/AlfaAmo")
+    LOG_FORMAT = os.getenv("LOG_FORMAT", "json")  # json или text
+    LOG_BODY_LIMIT = int(os.getenv("LOG_BODY_LIMIT", "500"))  # Максимальная длина тела ответа в логе
+    LOG_SAMPLE_RATES = os.getenv("LOG_SAMPLE_RATES", "amocrm_client=0.2,sbp_client=0.2")  # Доля INFO-записей по логгерам
+
+    # Профилирование (profiling.py); пусто — выключено и не подключается
+    PROFILE_SAMPLE_RATES = os.getenv("PROFILE_SAMPLE_RATES", "")  # Доля запросов и задач: "webhook=0.01,tasks.process_lead=0.01,*=0"
+    PROFILE_TOKEN = os.getenv("PROFILE_TOKEN", "")  # Запрос с заголовком X-Profile: <token> профилируется всегда
+    PROFILE_DIR = os.getenv("PROFILE_DIR", os.path.join(LOG_DIR, "profiles"))
+    PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL", "0.005"))  # Период снятия стеков, секунды
+    PROFILE_FLUSH_INTERVAL = float(os.getenv("PROFILE_FLUSH_INTERVAL", "60"))  # Как часто профили пишутся на диск
+
+    # Метрики Prometheus
+    METRICS_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR", "")  # Общий каталог метрик gunicorn и Celery; пусто — метрики только процесса
+
+    # Хранилище платежей
+    PAYMENTS_DB = os.getenv("PAYMENTS_DB", "/root/AlfaAmo/payments.db")
+    PAYMENTS_POLL_INTERVAL = float(os.getenv("PAYMENTS_POLL_INTERVAL", "30"))  # Период запуска опроса celery beat, секунды
+    PAYMENTS_POLL_CONCURRENCY = int(os.getenv("PAYMENTS_POLL_CONCURRENCY", "8"))
+    PAYMENTS_POLL_LEASE = float(os.getenv("PAYMENTS_POLL_LEASE", "300"))  # На столько секунд опрос забирает заказы себе
+    POLL_MIN_INTERVAL = float(os.getenv("POLL_MIN_INTERVAL", "30"))  # Интервал проверки нового заказа
+    POLL_MAX_INTERVAL = float(os.getenv("POLL_MAX_INTERVAL", "3600"))  # Предельный интервал для старых заказов
+    POLL_BACKOFF_FACTOR = float(os.getenv("POLL_BACKOFF_FACTOR", "0.5"))  # Интервал = возраст заказа * factor
+    RATE_LIMIT_DB = os.getenv("RATE_LIMIT_DB", "/root/AlfaAmo/ratelimit.db")
+    PAYMENTS_FILE = os.getenv("PAYMENTS_FILE", "/root/AlfaAmo/payments.json")  # Старый формат, переносится в PAYMENTS_DB
+    RECONCILE_INTERVAL = float(os.getenv("RECONCILE_INTERVAL", "0"))  # Период сверки со сделками amoCRM, секунды; 0 — только вручную
+    JOURNAL_RETENTION = float(os.getenv("JOURNAL_RETENTION", str(90 * 24 * 3600)))  # Сколько хранится история закрытых платежей, секунды
+    JOURNAL_COMPACT_INTERVAL = float(os.getenv("JOURNAL_COMPACT_INTERVAL", "3600"))  # Период сжатия журнала celery beat, секунды
+
+    # Callback банка: события применяются задачей apply_payment_event в отдельной очереди
+    PAYMENTS_QUEUE = os.getenv("PAYMENTS_QUEUE", "payments")
+    PAYMENT_EVENT_LEASE = float(os.getenv("PAYMENT_EVENT_LEASE", "300"))  # Сколько секунд событие занято воркером
+    PAYMENT_EVENT_REQUEUE_AFTER = float(os.getenv("PAYMENT_EVENT_REQUEUE_AFTER", "60"))  # Необработанное событие ставится в очередь повторно
+    PAYMENT_EVENT_MAX_RETRIES = int(os.getenv("PAYMENT_EVENT_MAX_RETRIES", "12"))  # Затем событие уходит в dead letter (~45 минут повторов)
+
+    # Недоступность amoCRM и банка: автоматы защиты (состояние в RATE_LIMIT_DB) и отложенные задачи
+    CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))  # Ошибок подряд до размыкания
+    CIRCUIT_RESET_TIMEOUT = float(os.getenv("CIRCUIT_RESET_TIMEOUT", "30"))  # Секунд до пробного запроса
+    DEFERRED_REPLAY_INTERVAL = float(os.getenv("DEFERRED_REPLAY_INTERVAL", "10"))  # Период возврата отложенных задач, секунды
+    DEFERRED_REPLAY_BATCH = int(os.getenv("DEFERRED_REPLAY_BATCH", "50"))  # Задач за один запуск на upstream
+    DEFERRED_REPLAY_RATE = float(os.getenv("DEFERRED_REPLAY_RATE", "5"))  # Задач в секунду при возврате
 
     @staticmethod
     def validate():
@@ -44,6 +143,3 @@ class Config:
         missing = [var for var in required_vars if not os.getenv(var)]
         if missing:
             raise ValueError(f"Отсутствуют обязательные переменные окружения: {', '.join(missing)}")
-
-# Проверка конфигурации при загрузке модуля
-Config.validate()
\ No newline at end of file
@@ -0,0 +1,74 @@
+import json
+import logging
+import os
+import time
+
+from sqlite_db import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    [
+        # Одна отложенная задача на (task, key): повторная отсрочка заменяет аргументы, очередь не растёт
+        "CREATE TABLE IF NOT EXISTS deferred_tasks ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "task TEXT NOT NULL, "
+        "key TEXT NOT NULL, "
+        "kwargs TEXT NOT NULL, "
+        "upstream TEXT NOT NULL, "
+        "deferred_at REAL NOT NULL, "
+        "UNIQUE (task, key))",
+        "CREATE INDEX IF NOT EXISTS idx_deferred_tasks_upstream ON deferred_tasks (upstream, id)",
+    ],
+]
+
+
+class DeferredQueue:
+    """Задачи, отложенные на время недоступности amoCRM или банка (автомат CircuitBreaker разомкнут).
+
+    Задача не ждёт таймаутов и не повторяется впустую, а сохраняется в SQLite вместе
+    с именем автомата (upstream). replay_deferred_task возвращает их в Celery порциями,
+    когда автомат снова пропускает запросы.
+    """
+
+    def __init__(self, path):
+        self.db = SQLiteDatabase(path)
+        self._ready_pid = None
+
+    def _conn(self):
+        if self._ready_pid != os.getpid():
+            self.db.migrate("deferred_tasks", MIGRATIONS)
+            self._ready_pid = os.getpid()
+        return self.db.connection()
+
+    def park(self, task, key, kwargs, upstream):
+        self._conn()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO deferred_tasks (task, key, kwargs, upstream, deferred_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(task, key) DO UPDATE SET kwargs = excluded.kwargs, upstream = excluded.upstream",
+                (task, str(key), json.dumps(kwargs), upstream, time.time())
+            )
+        logger.info(f"Задача {task} ({key}) отложена до восстановления {upstream}")
+
+    def peek(self, upstream, limit):
+        """Старейшие отложенные задачи upstream: [{"id", "task", "kwargs"}]."""
+        rows = self._conn().execute(
+            "SELECT id, task, kwargs FROM deferred_tasks WHERE upstream = ? ORDER BY id LIMIT ?", (upstream, limit)
+        ).fetchall()
+        return [{"id": row["id"], "task": row["task"], "kwargs": json.loads(row["kwargs"])} for row in rows]
+
+    def delete(self, ids):
+        if not ids:
+            return 0
+        self._conn()
+        with self.db.transaction() as conn:
+            cursor = conn.executemany("DELETE FROM deferred_tasks WHERE id = ?", [(task_id,) for task_id in ids])
+        return cursor.rowcount
+
+    def stats(self):
+        """Число отложенных задач и время самой старой по upstream."""
+        rows = self._conn().execute(
+            "SELECT upstream, COUNT(*) AS count, MIN(deferred_at) AS oldest FROM deferred_tasks GROUP BY upstream"
+        ).fetchall()
+        return {row["upstream"]: {"count": row["count"], "oldest": row["oldest"]} for row in rows}
@@ -0,0 +1,15 @@
+# gunicorn -c gunicorn.conf.py
+# Приложение импортируется один раз в мастере (preload_app) и достаётся воркерам через fork:
+# воркер не повторяет импорт flask, celery и requests. Клиенты и хранилища создаются уже
+# в воркере при первом запросе, соединения SQLite и HTTP после fork открываются заново.
+import os
+
+wsgi_app = "webhook_handler:create_app()"
+bind = os.getenv("GUNICORN_BIND", "0.0.0.0:5000")
+workers = int(os.getenv("GUNICORN_WORKERS", "4"))
+preload_app = True
+
+
+def child_exit(server, worker):
+    from metrics import mark_process_dead
+    mark_process_dead(worker.pid)
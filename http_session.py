@@ -0,0 +1,109 @@
+import logging
+import os
+import random
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from config import Config
+from metrics import HTTP_POOL_CONNECTIONS, HTTP_POOL_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class JitteredRetry(Retry):
+    """Экспоненциальная задержка с full jitter, чтобы воркеры не повторяли запросы синхронно."""
+
+    def get_backoff_time(self):
+        backoff = super().get_backoff_time()
+        return random.uniform(0, backoff) if backoff > 0 else 0
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, timeout, **kwargs):
+        self.timeout = timeout
+        super().__init__(**kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+class PooledSession(requests.Session):
+    """requests.Session с пулом keep-alive соединений, таймаутами и повторами на 429/5xx.
+
+    Повторы по коду ответа выполняются только для методов из retry_methods;
+    ошибки установки соединения повторяются для любых методов, так как запрос ещё не отправлен.
+    Счётчики пула после каждого запроса переносятся в метрики с меткой service.
+    """
+
+    def __init__(self, pool_size=None, connect_timeout=None, read_timeout=None,
+                 max_retries=None, backoff_factor=None, retry_methods=("GET",), service="http"):
+        super().__init__()
+        self.service = service
+        self._exported = {"requests": 0, "misses": 0}
+        self._export_lock = threading.Lock()
+        max_retries = Config.HTTP_MAX_RETRIES if max_retries is None else max_retries
+        retry = JitteredRetry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            status_forcelist=RETRY_STATUSES,
+            allowed_methods=frozenset(retry_methods),
+            backoff_factor=Config.HTTP_BACKOFF_FACTOR if backoff_factor is None else backoff_factor,
+            raise_on_status=False,
+            respect_retry_after_header=True
+        )
+        pool_size = pool_size or Config.HTTP_POOL_SIZE
+        adapter = TimeoutHTTPAdapter(
+            timeout=(connect_timeout or Config.HTTP_CONNECT_TIMEOUT, read_timeout or Config.HTTP_READ_TIMEOUT),
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=retry
+        )
+        self.mount("https://", adapter)
+        self.mount("http://", adapter)
+        self.pid = os.getpid()
+
+    def send(self, request, **kwargs):
+        try:
+            return super().send(request, **kwargs)
+        finally:
+            self._export_pool_stats()
+
+    def _export_pool_stats(self):
+        # Счётчики urllib3 накопительные: в метрики уходит прирост с прошлого запроса
+        stats = self.pool_stats()
+        with self._export_lock:
+            requests_delta = stats["requests"] - self._exported["requests"]
+            misses_delta = stats["misses"] - self._exported["misses"]
+            self._exported = {"requests": stats["requests"], "misses": stats["misses"]}
+        if requests_delta > 0:
+            HTTP_POOL_REQUESTS.labels(self.service).inc(requests_delta)
+        if misses_delta > 0:
+            HTTP_POOL_CONNECTIONS.labels(self.service).inc(misses_delta)
+
+    def pool_stats(self):
+        """Счётчики пула: requests — всего запросов, misses — новых соединений, hits — переиспользованных."""
+        requests_total = 0
+        connections = 0
+        for adapter in set(self.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                try:
+                    pool = pools[key]
+                except KeyError:
+                    continue
+                requests_total += pool.num_requests
+                connections += pool.num_connections
+        return {
+            "requests": requests_total,
+            "hits": max(requests_total - connections, 0),
+            "misses": connections,
+        }
@@ -0,0 +1,106 @@
+import logging
+import os
+import time
+import uuid
+
+from metrics import LEAD_DEBOUNCE_EVENTS
+from sqlite_db import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+MIGRATIONS = [
+    [
+        "CREATE TABLE IF NOT EXISTS pending_lead_events ("
+        "lead_id TEXT PRIMARY KEY, token TEXT NOT NULL, status_id INTEGER, pipeline_id INTEGER, "
+        "received_at REAL NOT NULL)",
+    ],
+]
+
+
+class LeadDebouncer:
+    """Объединение частых событий одной сделки перед process_lead.
+
+    register() запоминает последнее событие сделки и выдаёт ему токен; задача ставится
+    с задержкой window. claim() в задаче пропускает событие, если за это время пришло
+    более новое (токен не совпал) — обрабатывается только последний (status_id, pipeline_id).
+    Состояние хранится в SQLite, поэтому работает между процессами gunicorn и Celery.
+    """
+
+    def __init__(self, path, window):
+        self.db = SQLiteDatabase(path)
+        self.window = window
+        self._ready_pid = None
+
+    def _conn(self):
+        if self._ready_pid != os.getpid():
+            self.db.migrate("lead_debouncer", MIGRATIONS)
+            self._ready_pid = os.getpid()
+        return self.db.connection()
+
+    @staticmethod
+    def _count(result, value=1):
+        if value:
+            LEAD_DEBOUNCE_EVENTS.labels(result).inc(value)
+
+    @staticmethod
+    def coalesce(events):
+        """Оставляет последнее событие каждой сделки внутри пачки; возвращает (события, число отброшенных)."""
+        latest = {}
+        for event in events:
+            latest.pop(event[0], None)
+            latest[event[0]] = event
+        return list(latest.values()), len(events) - len(latest)
+
+    def register_many(self, events):
+        """Регистрирует события (lead_id, status_id, pipeline_id, ...); возвращает токены в том же порядке."""
+        self._conn()
+        tokens = []
+        superseded = 0
+        now = time.time()
+        with self.db.transaction() as conn:
+            for lead_id, status_id, pipeline_id, *_ in events:
+                token = uuid.uuid4().hex
+                cursor = conn.execute(
+                    "UPDATE pending_lead_events SET token = ?, status_id = ?, pipeline_id = ?, received_at = ? "
+                    "WHERE lead_id = ?",
+                    (token, status_id, pipeline_id, now, str(lead_id))
+                )
+                if cursor.rowcount:
+                    superseded += 1
+                else:
+                    conn.execute(
+                        "INSERT INTO pending_lead_events (lead_id, token, status_id, pipeline_id, received_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (str(lead_id), token, status_id, pipeline_id, now)
+                    )
+                tokens.append(token)
+        self._count("registered", len(events))
+        self._count("coalesced", superseded)
+        return tokens
+
+    def claim(self, lead_id, token):
+        """Возвращает (status_id, pipeline_id) последнего события, если token актуален, иначе None."""
+        self._conn()
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT token, status_id, pipeline_id FROM pending_lead_events WHERE lead_id = ?", (str(lead_id),)
+            ).fetchone()
+            if row is None or row["token"] != token:
+                self._count("skipped")
+                return None
+            conn.execute("DELETE FROM pending_lead_events WHERE lead_id = ?", (str(lead_id),))
+        self._count("claimed")
+        return row["status_id"], row["pipeline_id"]
+
+    def record_coalesced(self, count):
+        """Учитывает события, отброшенные до регистрации (дубликаты внутри одной пачки)."""
+        self._count("coalesced", count)
+
+    def purge(self, max_age_seconds=24 * 3600):
+        """Удаляет события, задачи которых так и не выполнились (например, потеряны брокером)."""
+        self._conn()
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM pending_lead_events WHERE received_at < ?", (time.time() - max_age_seconds,)
+            )
+        return cursor.rowcount
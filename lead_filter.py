@@ -0,0 +1,30 @@
+from config import id_or_name
+
+
+def parse_pipeline_rules(value):
+    """Разбирает AMO_PIPELINE_RULES вида "pipeline_id:status_id,status_id;pipeline_id:status_id".
+
+    Вместо id можно указать названия воронки и статусов (AmoCRMMetadata.resolve_rules).
+    """
+    rules = {}
+    for rule in filter(None, (part.strip() for part in (value or "").split(";"))):
+        pipeline_id, _, statuses = rule.partition(":")
+        rules[id_or_name(pipeline_id)] = frozenset(id_or_name(status_id) for status_id in statuses.split(",") if status_id.strip())
+    return rules
+
+
+class LeadFilter:
+    """Отбор событий сделок, для которых нужна ссылка на оплату.
+
+    Правила {pipeline_id: frozenset(status_id)} заранее сворачиваются в множество пар
+    (pipeline_id, status_id), поэтому проверка события — одна операция над множеством.
+    """
+
+    def __init__(self, rules):
+        self.rules = {pipeline_id: frozenset(statuses) for pipeline_id, statuses in rules.items()}
+        self._accepted_pairs = frozenset(
+            (pipeline_id, status_id) for pipeline_id, statuses in self.rules.items() for status_id in statuses
+        )
+
+    def matches(self, status_id, pipeline_id):
+        return (pipeline_id, status_id) in self._accepted_pairs
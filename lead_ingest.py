@@ -0,0 +1,103 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+
+from metrics import INGEST_BUFFER_DEPTH, INGEST_PUBLISH_ERRORS
+
+logger = logging.getLogger(__name__)
+
+
+class LeadEventBuffer:
+    """Ограниченный буфер событий сделок между /webhook и брокером.
+
+    put() только кладёт событие в очередь процесса и сразу возвращает управление; фоновый поток
+    забирает события пачками до batch_size, один раз готовит пачку через prepare_batch и передаёт
+    результат в publish_batch. При ошибке публикация повторяется с экспоненциальной задержкой
+    без повторной подготовки, новые события тем временем копятся в буфере.
+    Если буфер заполнен, put() возвращает False и вызывающий код публикует событие сам.
+    """
+
+    def __init__(self, publish_batch, prepare_batch=None, maxsize=10000, batch_size=100, linger=0.005,
+                 max_backoff=5.0):
+        self.publish_batch = publish_batch
+        self.prepare_batch = prepare_batch
+        self.maxsize = maxsize
+        self.batch_size = batch_size
+        self.linger = linger
+        self.max_backoff = max_backoff
+        self._lock = threading.Lock()
+        self._queue = None
+        self._thread = None
+        self._pid = None
+
+    def _ensure_started(self):
+        # Поток публикации запускается в каждом процессе gunicorn после fork
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._queue = queue.Queue(maxsize=self.maxsize)
+            self._thread = threading.Thread(target=self._run, name="lead-event-publisher", daemon=True)
+            self._thread.start()
+            self._pid = os.getpid()
+            atexit.register(self.drain)
+
+    def put(self, event):
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(event)
+        except queue.Full:
+            logger.warning(f"Lead event buffer is full ({self.maxsize}), event {event} is published synchronously")
+            return False
+        INGEST_BUFFER_DEPTH.inc()
+        return True
+
+    def _next_batch(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.linger
+        while len(batch) < self.batch_size:
+            timeout = deadline - time.monotonic()
+            try:
+                batch.append(self._queue.get(timeout=timeout) if timeout > 0 else self._queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            self._publish(batch)
+            INGEST_BUFFER_DEPTH.dec(len(batch))
+            for _ in batch:
+                self._queue.task_done()
+
+    def _publish(self, batch):
+        backoff = 0.1
+        prepared = None
+        while True:
+            try:
+                if prepared is None:
+                    prepared = self.prepare_batch(batch) if self.prepare_batch else batch
+                self.publish_batch(prepared)
+            except Exception as e:
+                INGEST_PUBLISH_ERRORS.inc()
+                logger.error(f"Failed to publish {len(batch)} lead events, retrying in {backoff:.1f}s: {str(e)}")
+                time.sleep(backoff)
+                backoff = min(backoff * 2, self.max_backoff)
+                continue
+            return
+
+    def drain(self, timeout=5.0):
+        """Ждёт публикации накопленных событий (при остановке процесса)."""
+        if self._pid != os.getpid():
+            return
+        deadline = time.monotonic() + timeout
+        while self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.01)
+        if self._queue.unfinished_tasks:
+            logger.warning(f"Lead event buffer stopped with {self._queue.unfinished_tasks} unpublished events")
+
@@ -0,0 +1,144 @@
+import atexit
+import contextvars
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import random
+import time
+import uuid
+
+from config import Config
+
+correlation_id = contextvars.ContextVar("correlation_id", default=None)
+
+_listener = None
+
+
+def new_correlation_id():
+    return uuid.uuid4().hex[:16]
+
+
+def get_correlation_id():
+    return correlation_id.get()
+
+
+def set_correlation_id(value):
+    """Привязывает correlation id к текущему контексту (запросу или задаче); возвращает токен для reset."""
+    return correlation_id.set(value)
+
+
+def reset_correlation_id(token):
+    correlation_id.reset(token)
+
+
+def truncate(text, limit=None):
+    """Обрезает тело ответа для лога до LOG_BODY_LIMIT символов."""
+    limit = Config.LOG_BODY_LIMIT if limit is None else limit
+    text = "" if text is None else str(text)
+    if len(text) <= limit:
+        return text
+    return f"{text[:limit]}... [{len(text) - limit} more chars]"
+
+
+def parse_sample_rates(value):
+    """LOG_SAMPLE_RATES вида "logger=0.1,other.logger=0.5"."""
+    rates = {}
+    for item in filter(None, (part.strip() for part in (value or "").split(","))):
+        name, _, rate = item.partition("=")
+        rates[name.strip()] = float(rate)
+    return rates
+
+
+class SamplingFilter(logging.Filter):
+    """Пропускает долю INFO/DEBUG записей объёмных логгеров; WARNING и выше проходят всегда.
+
+    Доля задаётся по имени логгера (rates) или для отдельного вызова через extra={"sample_rate": 0.01}.
+    """
+
+    def __init__(self, rates):
+        super().__init__()
+        self.rates = rates
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING:
+            return True
+        rate = getattr(record, "sample_rate", None)
+        if rate is None:
+            rate = self.rates.get(record.name)
+        return rate is None or random.random() < rate
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": time.strftime("%Y-%m-%dT%H:%M:%S", time.localtime(record.created)) + f".{int(record.msecs):03d}",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "correlation_id": getattr(record, "correlation_id", None),
+            "pid": record.process,
+        }
+        if record.exc_info:
+            entry["exc_info"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+class ContextQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который фиксирует correlation_id до передачи записи в поток записи."""
+
+    def prepare(self, record):
+        record.correlation_id = correlation_id.get()
+        return super().prepare(record)
+
+
+def _formatter():
+    if Config.LOG_FORMAT == "json":
+        return JsonFormatter()
+    return logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - [%(correlation_id)s] %(message)s')
+
+
+def configure_logging(log_file, extra_files=None, level=logging.INFO):
+    """Настраивает корневой логгер: запись в файлы выполняет фоновый QueueListener.
+
+    extra_files — {имя логгера: файл}: записи этих логгеров дополнительно пишутся в отдельный файл.
+    Потоки запроса только кладут запись в очередь; форматирование и запись на диск — в потоке listener.
+    """
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    formatter = _formatter()
+    handlers = [logging.FileHandler(os.path.join(Config.LOG_DIR, log_file), mode='a'), logging.StreamHandler()]
+    for logger_name, file_name in (extra_files or {}).items():
+        handler = logging.FileHandler(os.path.join(Config.LOG_DIR, file_name), mode='a')
+        handler.addFilter(logging.Filter(logger_name))
+        handlers.append(handler)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = ContextQueueHandler(log_queue)
+    queue_handler.addFilter(SamplingFilter(parse_sample_rates(Config.LOG_SAMPLE_RATES)))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(log_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
+
+    def restart_in_child():
+        # Поток listener не переживает fork (prefork Celery): в дочернем процессе нужна своя очередь
+        child_queue = queue.SimpleQueue()
+        queue_handler.queue = child_queue
+        _listener.queue = child_queue
+        _listener._thread = None
+        _listener.start()
+
+    os.register_at_fork(after_in_child=restart_in_child)
+    return _listener
@@ -0,0 +1,131 @@
+import os
+import re
+import time
+from contextlib import contextmanager
+
+from config import Config
+
+# В режиме нескольких процессов (gunicorn, prefork Celery) значения пишутся в файлы каталога
+# PROMETHEUS_MULTIPROC_DIR; prometheus_client проверяет его при импорте
+if Config.METRICS_DIR:
+    os.makedirs(Config.METRICS_DIR, exist_ok=True)
+
+from prometheus_client import CONTENT_TYPE_LATEST, REGISTRY, CollectorRegistry, Counter, Gauge, Histogram, generate_latest
+from prometheus_client import multiprocess
+
+# Операции SQLite занимают микросекунды, HTTP-вызовы — десятки и сотни миллисекунд
+FAST_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+HTTP_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+HTTP_REQUEST_SECONDS = Histogram(
+    "alfaamo_http_request_seconds", "Обработка входящих запросов Flask",
+    ["endpoint", "status"], buckets=HTTP_BUCKETS
+)
+WEBHOOK_EVENTS = Counter(
+    "alfaamo_webhook_events_total", "События сделок из /webhook",
+    ["result"]
+)
+QUEUE_PUBLISH_SECONDS = Histogram(
+    "alfaamo_queue_publish_seconds", "Публикация пачки событий в брокер",
+    buckets=HTTP_BUCKETS
+)
+QUEUE_PUBLISHED_EVENTS = Counter(
+    "alfaamo_queue_published_events_total", "События, поставленные в очередь process_lead"
+)
+TASK_SECONDS = Histogram(
+    "alfaamo_task_seconds", "Выполнение задач Celery",
+    ["task", "state"], buckets=HTTP_BUCKETS
+)
+TASK_STAGE_SECONDS = Histogram(
+    "alfaamo_task_stage_seconds", "Этапы задач Celery",
+    ["task", "stage"], buckets=HTTP_BUCKETS
+)
+CLIENT_REQUEST_SECONDS = Histogram(
+    "alfaamo_client_request_seconds", "Запросы к внешним API",
+    ["service", "method", "endpoint", "status"], buckets=HTTP_BUCKETS
+)
+RATE_LIMIT_WAIT_SECONDS = Histogram(
+    "alfaamo_rate_limit_wait_seconds", "Ожидание токена лимита запросов amoCRM",
+    ["priority"], buckets=(0.0,) + HTTP_BUCKETS
+)
+STORE_OPERATION_SECONDS = Histogram(
+    "alfaamo_payment_store_seconds", "Операции хранилища оплат",
+    ["operation"], buckets=FAST_BUCKETS
+)
+# Gauge-метрики в режиме нескольких процессов: livesum — сумма по живым процессам,
+# livemostrecent — последнее записанное значение (остаток токенов общий для хоста)
+HTTP_POOL_REQUESTS = Counter(
+    "alfaamo_http_pool_requests_total", "Запросы через пулы соединений к внешним API, включая повторы",
+    ["service"]
+)
+HTTP_POOL_CONNECTIONS = Counter(
+    "alfaamo_http_pool_connections_total", "Новые соединения пулов (промахи); переиспользованные = requests - connections",
+    ["service"]
+)
+RATE_LIMIT_TOKENS = Gauge(
+    "alfaamo_rate_limit_tokens", "Токены в корзине лимита запросов после последнего запроса",
+    ["limiter"], multiprocess_mode="livemostrecent"
+)
+INGEST_BUFFER_DEPTH = Gauge(
+    "alfaamo_ingest_buffer_depth", "События /webhook в буфере, ещё не опубликованные в брокер",
+    multiprocess_mode="livesum"
+)
+INGEST_PUBLISH_ERRORS = Counter(
+    "alfaamo_ingest_publish_errors_total", "Неудачные попытки публикации пачки событий из буфера"
+)
+LEAD_DEBOUNCE_EVENTS = Counter(
+    "alfaamo_lead_debounce_events_total", "События сделок в LeadDebouncer",
+    ["result"]
+)
+
+_ID_SEGMENT = re.compile(r"/\d+(?=/|$)")
+
+
+def endpoint_label(path):
+    """Путь запроса без идентификаторов: /api/v4/leads/123/notes -> /api/v4/leads/{id}/notes."""
+    return _ID_SEGMENT.sub("/{id}", path)
+
+
+@contextmanager
+def timed(histogram, *labels):
+    """Замеряет время блока, в том числе завершившегося исключением; labels — только у гистограмм с метками."""
+    child = histogram.labels(*labels) if labels else histogram
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        child.observe(time.perf_counter() - started)
+
+
+def observe_stage(task, stage):
+    return timed(TASK_STAGE_SECONDS, task, stage)
+
+
+def observe_store(operation):
+    """Декоратор метода PaymentStore."""
+    child = STORE_OPERATION_SECONDS.labels(operation)
+    return child.time()
+
+
+def observe_client_request(service, method, path, started, status=None, error=None):
+    """status — HTTP-код ответа; если ответа нет, в метку попадает имя исключения."""
+    status = str(status) if status is not None else type(error).__name__
+    CLIENT_REQUEST_SECONDS.labels(service, method, endpoint_label(path), status).observe(
+        time.perf_counter() - started
+    )
+
+
+def mark_process_dead(pid):
+    # Файлы gauge-метрик завершившегося процесса больше не должны учитываться
+    if Config.METRICS_DIR:
+        multiprocess.mark_process_dead(pid)
+
+
+def render():
+    """Текст для /metrics: в режиме нескольких процессов — сумма по всем процессам gunicorn и Celery на хосте."""
+    if Config.METRICS_DIR:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry), CONTENT_TYPE_LATEST
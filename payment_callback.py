@@ -0,0 +1,24 @@
+import hashlib
+import hmac
+import urllib.parse
+
+
+def callback_sign_string(params):
+    """Строка подписи callback банка: параметры без checksum и sign_alias по алфавиту, "key;value;"."""
+    params = dict(params)
+    params.pop("checksum", None)
+    params.pop("sign_alias", None)
+    sign_string = ""
+    for key, value in sorted(params.items(), key=lambda x: x[0]):
+        if "%" in value:
+            value = urllib.parse.unquote(value)
+        sign_string += f"{key};{value};"
+    return sign_string
+
+
+def callback_checksum(sign_string, secret_key):
+    return hmac.new(
+        secret_key.encode('utf-8'),
+        sign_string.encode('utf-8'),
+        hashlib.sha256
+    ).hexdigest().upper()
@@ -0,0 +1,97 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from payment_store import JOURNAL_EXPIRED, JOURNAL_PAID
+from rate_limiter import PRIORITY_PAYMENT
+
+logger = logging.getLogger(__name__)
+
+ORDER_STATUS_DEPOSITED = 2  # Заказ оплачен (getOrderStatus.do)
+EXPIRY_GRACE_SECONDS = 600  # Запас после sessionTimeoutSecs на запоздалую оплату
+
+
+def next_check_delay(age_seconds, min_interval=None, max_interval=None, backoff=None):
+    """Интервал до следующей проверки заказа возрастом age_seconds.
+
+    Интервал пропорционален возрасту, поэтому моменты проверок образуют геометрическую
+    прогрессию: свежие заказы проверяются раз в min_interval, старые — не чаще max_interval.
+    """
+    min_interval = Config.POLL_MIN_INTERVAL if min_interval is None else min_interval
+    max_interval = Config.POLL_MAX_INTERVAL if max_interval is None else max_interval
+    backoff = Config.POLL_BACKOFF_FACTOR if backoff is None else backoff
+    return min(max_interval, max(min_interval, age_seconds * backoff))
+
+
+class PaymentPoller:
+    """Опрос статусов открытых заказов в банке с ограниченной параллельностью.
+
+    Опрашиваются только заказы, у которых подошло время проверки (next_check_delay) и не было
+    callback. Запросы getOrderStatus.do выполняются в пуле потоков, оплаченные сделки отмечаются
+    в amoCRM одним пакетом (тег paid_tag и статус paid_status_id), закрытые и просроченные
+    заказы удаляются одной транзакцией.
+    """
+
+    def __init__(self, payment_store, sbp_client, amocrm_client, paid_status_id, paid_tag, max_workers=8):
+        self.payment_store = payment_store
+        self.sbp_client = sbp_client
+        self.amocrm_client = amocrm_client
+        self.paid_status_id = paid_status_id
+        self.paid_tag = paid_tag
+        self.max_workers = max_workers
+        self.expires_after = Config.SBP_SESSION_TIMEOUT_SECS + EXPIRY_GRACE_SECONDS
+
+    def _check(self, lead_id, payment):
+        try:
+            status_data = self.sbp_client.get_order_status(payment["order_number"])
+            return lead_id, payment, status_data.get("orderStatus"), None
+        except Exception as e:
+            return lead_id, payment, None, e
+
+    def run(self):
+        started = time.monotonic()
+        now = time.time()
+        summary = {"checked": 0, "paid": 0, "settled": 0, "expired": 0, "errors": 0}
+        paid = self.amocrm_client.batch(PRIORITY_PAYMENT)
+        expired = []
+        next_checks = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = executor.map(lambda item: self._check(*item), self.payment_store.due_for_polling(now, Config.PAYMENTS_POLL_LEASE))
+            for lead_id, payment, order_status, error in results:
+                summary["checked"] += 1
+                age = now - payment["created_at"]
+                if error is not None:
+                    summary["errors"] += 1
+                    logger.error(f"Ошибка проверки оплаты для сделки {lead_id}: {str(error)}")
+                elif order_status == ORDER_STATUS_DEPOSITED:
+                    summary["paid"] += 1
+                    logger.info(f"Оплата для сделки {lead_id} успешна")
+                    paid.add_tag(lead_id, self.paid_tag).change_status(lead_id, self.paid_status_id)
+                    continue
+                if age >= self.expires_after:
+                    # Платёжная сессия истекла: оплатить заказ уже нельзя
+                    logger.info(f"Заказ {payment['order_number']} сделки {lead_id} просрочен, прекращаем опрос")
+                    expired.append(lead_id)
+                else:
+                    # Последняя проверка — сразу после истечения сессии
+                    next_check_at = min(now + next_check_delay(age), payment["created_at"] + self.expires_after)
+                    next_checks.append((lead_id, next_check_at, order_status))
+
+        settled = []
+        if paid:
+            for lead_id, error in paid.flush().items():
+                if error is None:
+                    settled.append(lead_id)
+                else:
+                    summary["errors"] += 1
+                    logger.error(f"Не удалось отметить оплату сделки {lead_id}: {str(error)}")
+                    next_checks.append((lead_id, now + next_check_delay(0), ORDER_STATUS_DEPOSITED))
+        summary["settled"] = self.payment_store.delete_many(settled, JOURNAL_PAID)
+        summary["expired"] = self.payment_store.delete_many(expired, JOURNAL_EXPIRED)
+        self.payment_store.schedule_checks(next_checks)
+        summary["remaining"] = self.payment_store.count()
+        summary["elapsed"] = round(time.monotonic() - started, 3)
+        logger.info(f"Проверка оплат завершена: {summary}")
+        return summary
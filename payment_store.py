@@ -0,0 +1,602 @@
+import json
+import logging
+import os
+import sys
+import time
+
+from metrics import observe_store
+from sqlite_db import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+PAYMENT_FIELDS = ("order_number", "amount", "form_url", "order_id", "created_at")
+SCHEDULE_FIELDS = ("next_check_at", "check_count", "callback_received")
+
+# События журнала платежа (payment_journal)
+JOURNAL_LINK_CREATED = "link_created"
+JOURNAL_CALLBACK = "callback_received"
+JOURNAL_POLLED = "status_polled"
+JOURNAL_PAID = "paid"
+JOURNAL_EXPIRED = "expired"
+JOURNAL_RETIRED = "retired"
+JOURNAL_REMOVED = "removed"
+
+MIGRATIONS = [
+    [
+        "CREATE TABLE IF NOT EXISTS payments ("
+        "lead_id TEXT PRIMARY KEY, "
+        "order_number TEXT, "
+        "amount INTEGER, "
+        "form_url TEXT, "
+        "order_id TEXT, "
+        "created_at REAL NOT NULL, "
+        "updated_at REAL NOT NULL, "
+        "rev INTEGER NOT NULL DEFAULT 1)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_order_id ON payments (order_id)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_created_at ON payments (created_at)",
+    ],
+    [
+        # Обратный индекс для callback банка: (mdOrder, orderNumber) -> lead_id без чтения строки
+        "CREATE INDEX IF NOT EXISTS idx_payments_order ON payments (order_id, order_number, lead_id)",
+        "DROP INDEX IF EXISTS idx_payments_order_id",
+    ],
+    [
+        # Расписание опроса банка: когда проверять заказ в следующий раз и был ли уже callback
+        "ALTER TABLE payments ADD COLUMN next_check_at REAL",
+        "ALTER TABLE payments ADD COLUMN check_count INTEGER NOT NULL DEFAULT 0",
+        "ALTER TABLE payments ADD COLUMN callback_received INTEGER NOT NULL DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_payments_due ON payments (callback_received, next_check_at)",
+    ],
+    [
+        # Последний заказ сделки в банке: версия номера и признак, что ссылка уже сохранена в payments
+        "CREATE TABLE IF NOT EXISTS lead_orders ("
+        "lead_id TEXT PRIMARY KEY, "
+        "version INTEGER NOT NULL, "
+        "order_number TEXT NOT NULL, "
+        "amount INTEGER NOT NULL, "
+        "order_id TEXT, "
+        "form_url TEXT, "
+        "reserved_at REAL NOT NULL, "
+        "delivered INTEGER NOT NULL DEFAULT 0)",
+    ],
+    [
+        # Callback банка сохраняется до ответа 200; изменения в amoCRM применяет задача apply_payment_event.
+        # Повтор того же callback банком не создаёт второе событие
+        "CREATE TABLE IF NOT EXISTS payment_events ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "lead_id TEXT NOT NULL, "
+        "md_order TEXT NOT NULL, "
+        "order_number TEXT NOT NULL, "
+        "operation TEXT, "
+        "status TEXT, "
+        "received_at REAL NOT NULL, "
+        "claimed_at REAL, "
+        "processed_at REAL, "
+        "attempts INTEGER NOT NULL DEFAULT 0, "
+        "last_error TEXT, "
+        "UNIQUE (md_order, operation, status))",
+        "CREATE INDEX IF NOT EXISTS idx_payment_events_pending ON payment_events (processed_at, received_at)",
+    ],
+    [
+        # Сверка с amoCRM идёт по возрастанию числового id сделки, как amoCRM отдаёт страницы /leads
+        "CREATE INDEX IF NOT EXISTS idx_payments_lead_number ON payments (CAST(lead_id AS INTEGER))",
+    ],
+    [
+        # История платежей: только INSERT в той же транзакции, что и изменение payments.
+        # Закрытые платежи удаляются из payments, но остаются в журнале до compact_journal
+        "CREATE TABLE IF NOT EXISTS payment_journal ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, "
+        "lead_id TEXT NOT NULL, "
+        "kind TEXT NOT NULL, "
+        "order_number TEXT, "
+        "data TEXT, "
+        "at REAL NOT NULL)",
+        "CREATE INDEX IF NOT EXISTS idx_payment_journal_lead ON payment_journal (lead_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_payment_journal_at ON payment_journal (at)",
+    ],
+    [
+        # retry_at — запланированный повтор Celery: до него (и ещё lease после) событие не переотправляется.
+        # failed_at — событие, которое повтор не исправит (dead letter): больше не берётся в работу
+        "ALTER TABLE payment_events ADD COLUMN retry_at REAL",
+        "ALTER TABLE payment_events ADD COLUMN failed_at REAL",
+    ],
+]
+
+
+def order_number_for(lead_id, amount, version, prefix=""):
+    """Номер заказа определяется сделкой, суммой в копейках и версией: повтор задачи получает тот же номер.
+
+    prefix различает сделки разных аккаунтов amoCRM, которые платят одному мерчанту.
+    """
+    return f"{prefix}{lead_id}_{int(amount)}_{version}"
+
+
+class PaymentStore:
+    """Хранилище открытых платежей (lead_id -> данные заказа) в SQLite.
+
+    Все записи точечные (upsert/delete одной строки), поэтому несколько процессов
+    gunicorn и Celery могут писать одновременно. Поле rev используется для
+    compare-and-set: запись проходит, только если строку никто не изменил.
+
+    payments — текущее состояние, payment_journal — история: каждое изменение добавляет
+    строку журнала в той же транзакции (создана ссылка, callback, проверка в банке,
+    оплата, просрочка). Журнал только дописывается; compact_journal удаляет устаревшее.
+    """
+
+    def __init__(self, path, order_prefix=""):
+        self.db = SQLiteDatabase(path)
+        self.order_prefix = order_prefix
+        self._ready_pid = None
+
+    def _conn(self):
+        if self._ready_pid != os.getpid():
+            self.db.migrate("payments", MIGRATIONS)
+            self._ready_pid = os.getpid()
+        return self.db.connection()
+
+    @staticmethod
+    def _row_to_payment(row):
+        if row is None:
+            return None
+        payment = {field: row[field] for field in PAYMENT_FIELDS + SCHEDULE_FIELDS}
+        payment["rev"] = row["rev"]
+        return payment
+
+    @observe_store("get")
+    def get(self, lead_id):
+        row = self._conn().execute(
+            "SELECT * FROM payments WHERE lead_id = ?", (str(lead_id),)
+        ).fetchone()
+        return self._row_to_payment(row)
+
+    def items(self):
+        for row in self._conn().execute("SELECT * FROM payments ORDER BY created_at"):
+            yield row["lead_id"], self._row_to_payment(row)
+
+    def iter_by_lead_id(self, chunk_size=500):
+        """Открытые платежи (int lead_id, payment) по возрастанию lead_id.
+
+        Строки читаются порциями по chunk_size от последнего прочитанного id, поэтому
+        между порциями можно изменять и удалять записи.
+        """
+        last_id = -1
+        while True:
+            rows = self._conn().execute(
+                "SELECT * FROM payments WHERE CAST(lead_id AS INTEGER) > ? "
+                "ORDER BY CAST(lead_id AS INTEGER) LIMIT ?",
+                (last_id, chunk_size)
+            ).fetchall()
+            if not rows:
+                return
+            for row in rows:
+                yield int(row["lead_id"]), self._row_to_payment(row)
+            last_id = int(rows[-1]["lead_id"])
+
+    @observe_store("count")
+    def count(self):
+        return self._conn().execute("SELECT COUNT(*) FROM payments").fetchone()[0]
+
+    @observe_store("find_lead_by_order")
+    def find_lead_by_order(self, order_id, order_number):
+        """lead_id открытого платежа по паре (mdOrder, orderNumber) из callback; None, если не найден."""
+        row = self._conn().execute(
+            "SELECT lead_id FROM payments WHERE order_id = ? AND order_number = ?",
+            (order_id, order_number)
+        ).fetchone()
+        return row["lead_id"] if row else None
+
+    @observe_store("upsert")
+    def upsert(self, lead_id, payment):
+        self._conn()
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO payments (lead_id, order_number, amount, form_url, order_id, created_at, updated_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT(lead_id) DO UPDATE SET "
+                "order_number = excluded.order_number, amount = excluded.amount, "
+                "form_url = excluded.form_url, order_id = excluded.order_id, "
+                "created_at = excluded.created_at, updated_at = excluded.updated_at, "
+                "next_check_at = NULL, check_count = 0, callback_received = 0, "
+                "rev = payments.rev + 1",
+                self._values(lead_id, payment, now)
+            )
+            self._mark_delivered(conn, lead_id, payment)
+            self._journal(conn, [self._link_entry(lead_id, payment)], now)
+
+    @observe_store("delete")
+    def delete(self, lead_id, reason=JOURNAL_REMOVED):
+        """Закрывает платёж; reason записывается в журнал (JOURNAL_PAID, JOURNAL_EXPIRED...)."""
+        return self.delete_many([lead_id], reason) > 0
+
+    @observe_store("delete_many")
+    def delete_many(self, lead_ids, reason=JOURNAL_REMOVED):
+        """Удаляет несколько записей одной транзакцией; возвращает число удалённых."""
+        lead_ids = [str(lead_id) for lead_id in lead_ids]
+        if not lead_ids:
+            return 0
+        self._conn()
+        with self.db.transaction() as conn:
+            self._journal_removal(conn, lead_ids, reason, time.time())
+            cursor = conn.executemany("DELETE FROM payments WHERE lead_id = ?", [(lead_id,) for lead_id in lead_ids])
+        return cursor.rowcount
+
+    @observe_store("compare_and_set")
+    def compare_and_set(self, lead_id, expected_rev, payment):
+        """Атомарно заменяет запись, если её rev равен expected_rev.
+
+        expected_rev=None означает «записи ещё нет», payment=None — удаление.
+        Возвращает True, если изменение применено.
+        """
+        self._conn()
+        now = time.time()
+        with self.db.transaction() as conn:
+            row = conn.execute(
+                "SELECT rev FROM payments WHERE lead_id = ?", (str(lead_id),)
+            ).fetchone()
+            current_rev = row["rev"] if row else None
+            if current_rev != expected_rev:
+                logger.info(f"CAS conflict for lead {lead_id}: expected rev {expected_rev}, current {current_rev}")
+                return False
+            if payment is None:
+                self._journal_removal(conn, [str(lead_id)], JOURNAL_REMOVED, now)
+                conn.execute("DELETE FROM payments WHERE lead_id = ?", (str(lead_id),))
+            elif row is None:
+                conn.execute(
+                    "INSERT INTO payments (lead_id, order_number, amount, form_url, order_id, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    self._values(lead_id, payment, now)
+                )
+            else:
+                conn.execute(
+                    "UPDATE payments SET order_number = ?, amount = ?, form_url = ?, order_id = ?, "
+                    "created_at = ?, updated_at = ?, next_check_at = NULL, check_count = 0, "
+                    "callback_received = 0, rev = rev + 1 WHERE lead_id = ?",
+                    self._values(lead_id, payment, now)[1:] + (str(lead_id),)
+                )
+            if payment is not None:
+                self._mark_delivered(conn, lead_id, payment)
+                self._journal(conn, [self._link_entry(lead_id, payment)], now)
+        return True
+
+    @staticmethod
+    def _journal(conn, entries, now):
+        """Дописывает (lead_id, kind, order_number, data) в журнал; одна вставка на пакет."""
+        conn.executemany(
+            "INSERT INTO payment_journal (lead_id, kind, order_number, data, at) VALUES (?, ?, ?, ?, ?)",
+            [
+                (str(lead_id), kind, order_number, json.dumps(data) if data else None, now)
+                for lead_id, kind, order_number, data in entries
+            ]
+        )
+
+    @staticmethod
+    def _journal_removal(conn, lead_ids, kind, now):
+        # Строка журнала пишется до удаления, пока номер заказа ещё в payments
+        conn.executemany(
+            "INSERT INTO payment_journal (lead_id, kind, order_number, at) "
+            "SELECT lead_id, ?, order_number, ? FROM payments WHERE lead_id = ?",
+            [(kind, now, lead_id) for lead_id in lead_ids]
+        )
+
+    @staticmethod
+    def _link_entry(lead_id, payment):
+        return lead_id, JOURNAL_LINK_CREATED, payment.get("order_number"), {
+            "amount": payment.get("amount"), "order_id": payment.get("order_id")
+        }
+
+    @staticmethod
+    def _mark_delivered(conn, lead_id, payment):
+        # Ссылка заказа сохранена вместе с платежом: следующий reserve_order выдаст новую версию
+        conn.execute(
+            "UPDATE lead_orders SET delivered = 1 WHERE lead_id = ? AND order_number = ?",
+            (str(lead_id), payment.get("order_number"))
+        )
+
+    @observe_store("reserve_order")
+    def reserve_order(self, lead_id, amount, max_age, new_version=False):
+        """Заказ в банке, под которым регистрируется ссылка на сумму amount.
+
+        Пока ссылка не сохранена в payments, повторный вызов с той же суммой (не старше max_age)
+        возвращает тот же заказ — вместе с order_id и form_url, если банк уже ответил.
+        Иначе, а также при new_version=True, версия увеличивается и выдаётся новый номер.
+        В результате reused=True, если заказ был зарезервирован раньше.
+        """
+        self._conn()
+        now = time.time()
+        with self.db.transaction() as conn:
+            row = conn.execute("SELECT * FROM lead_orders WHERE lead_id = ?", (str(lead_id),)).fetchone()
+            if (row is not None and not new_version and not row["delivered"]
+                    and row["amount"] == amount and row["reserved_at"] > now - max_age):
+                return dict(row, reused=True)
+            version = row["version"] + 1 if row else 1
+            order = {
+                "lead_id": str(lead_id),
+                "version": version,
+                "order_number": order_number_for(lead_id, amount, version, self.order_prefix),
+                "amount": amount,
+                "order_id": None,
+                "form_url": None,
+                "reserved_at": now,
+                "delivered": 0,
+            }
+            conn.execute(
+                "INSERT INTO lead_orders (lead_id, version, order_number, amount, reserved_at) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT(lead_id) DO UPDATE SET "
+                "version = excluded.version, order_number = excluded.order_number, amount = excluded.amount, "
+                "order_id = NULL, form_url = NULL, reserved_at = excluded.reserved_at, delivered = 0",
+                (order["lead_id"], version, order["order_number"], amount, now)
+            )
+        return dict(order, reused=False)
+
+    @observe_store("confirm_order")
+    def confirm_order(self, lead_id, order_number, order_id, form_url):
+        """Запоминает ответ register.do, чтобы повтор задачи взял эту ссылку, а не регистрировал заказ снова."""
+        self._conn()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE lead_orders SET order_id = ?, form_url = ? WHERE lead_id = ? AND order_number = ?",
+                (order_id, form_url, str(lead_id), order_number)
+            )
+
+    @observe_store("due_for_polling")
+    def due_for_polling(self, now=None, lease=300):
+        """Забирает платежи без callback, у которых подошло время проверки в банке: [(lead_id, payment)].
+
+        В той же транзакции next_check_at сдвигается на lease секунд, поэтому параллельный запуск
+        опроса эти заказы не получит; schedule_checks затем ставит настоящее время проверки.
+        Список, а не генератор: метрика due_for_polling должна включать сам запрос.
+        """
+        now = time.time() if now is None else now
+        self._conn()
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT * FROM payments WHERE callback_received = 0 "
+                "AND (next_check_at IS NULL OR next_check_at <= ?) ORDER BY next_check_at",
+                (now,)
+            ).fetchall()
+            conn.executemany(
+                "UPDATE payments SET next_check_at = ? WHERE lead_id = ?",
+                [(now + lease, row["lead_id"]) for row in rows]
+            )
+        return [(row["lead_id"], self._row_to_payment(row)) for row in rows]
+
+    @observe_store("schedule_checks")
+    def schedule_checks(self, next_checks):
+        """Сохраняет результат проверки в банке и время следующей для (lead_id, next_check_at, order_status).
+
+        order_status — статус заказа из getOrderStatus.do, None при ошибке запроса.
+        """
+        if not next_checks:
+            return
+        self._conn()
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "UPDATE payments SET next_check_at = ?, check_count = check_count + 1 WHERE lead_id = ?",
+                [(next_check_at, str(lead_id)) for lead_id, next_check_at, _ in next_checks]
+            )
+            conn.executemany(
+                "INSERT INTO payment_journal (lead_id, kind, order_number, data, at) "
+                "SELECT lead_id, ?, order_number, ?, ? FROM payments WHERE lead_id = ?",
+                [
+                    (JOURNAL_POLLED, json.dumps({"order_status": order_status}), now, str(lead_id))
+                    for lead_id, _, order_status in next_checks
+                ]
+            )
+
+    @observe_store("record_callback_event")
+    def record_callback_event(self, lead_id, md_order, order_number, operation, status):
+        """Сохраняет callback банка и снимает заказ с опроса одной транзакцией.
+
+        Возвращает (event_id, pending): pending=False, если такой callback уже был и обработан.
+        """
+        # NULL в UNIQUE (md_order, operation, status) не совпадает с NULL: без operation повтор не распознался бы
+        operation = operation or ""
+        self._conn()
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "INSERT OR IGNORE INTO payment_events (lead_id, md_order, order_number, operation, status, received_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (str(lead_id), md_order, order_number, operation, status, time.time())
+            )
+            if cursor.rowcount:
+                event_id, pending = cursor.lastrowid, True
+                self._journal(conn, [(lead_id, JOURNAL_CALLBACK, order_number, {
+                    "md_order": md_order, "operation": operation, "status": status
+                })], time.time())
+            else:
+                row = conn.execute(
+                    "SELECT id, processed_at FROM payment_events WHERE md_order = ? AND operation IS ? AND status IS ?",
+                    (md_order, operation, status)
+                ).fetchone()
+                event_id, pending = row["id"], row["processed_at"] is None
+            conn.execute("UPDATE payments SET callback_received = 1 WHERE lead_id = ?", (str(lead_id),))
+        return event_id, pending
+
+    @observe_store("claim_payment_event")
+    def claim_payment_event(self, event_id, lease):
+        """Захватывает необработанное событие на lease секунд; None, если оно обработано или занято другим воркером."""
+        self._conn()
+        now = time.time()
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE payment_events SET claimed_at = ?, attempts = attempts + 1 "
+                "WHERE id = ? AND processed_at IS NULL AND failed_at IS NULL AND (claimed_at IS NULL OR claimed_at < ?)",
+                (now, event_id, now - lease)
+            )
+            if not cursor.rowcount:
+                return None
+            row = conn.execute("SELECT * FROM payment_events WHERE id = ?", (event_id,)).fetchone()
+        return dict(row)
+
+    @observe_store("complete_payment_event")
+    def complete_payment_event(self, event_id):
+        self._conn()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE payment_events SET processed_at = ?, last_error = NULL WHERE id = ?", (time.time(), event_id)
+            )
+
+    @observe_store("release_payment_event")
+    def release_payment_event(self, event_id, error, retry_at=None):
+        """Снимает захват после ошибки, чтобы повтор задачи мог взять событие сразу.
+
+        retry_at — время запланированного повтора Celery: до него pending_payment_events
+        не вернёт событие, иначе каждый запуск check_payments_task начинал бы ещё одну цепочку повторов.
+        """
+        self._conn()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE payment_events SET claimed_at = NULL, retry_at = ?, last_error = ? WHERE id = ?",
+                (retry_at, str(error)[:500], event_id)
+            )
+
+    @observe_store("fail_payment_event")
+    def fail_payment_event(self, event_id, error):
+        """Окончательная ошибка события (dead letter): не повторяется и не переотправляется."""
+        self._conn()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "UPDATE payment_events SET claimed_at = NULL, retry_at = NULL, failed_at = ?, last_error = ? WHERE id = ?",
+                (time.time(), str(error)[:500], event_id)
+            )
+
+    @observe_store("pending_payment_events")
+    def pending_payment_events(self, older_than, lease, limit=500):
+        """id необработанных событий, полученных раньше older_than секунд назад, не захваченных воркером
+        и без ожидающего повтора; события в dead letter (failed_at) не возвращаются."""
+        now = time.time()
+        rows = self._conn().execute(
+            "SELECT id FROM payment_events WHERE processed_at IS NULL AND failed_at IS NULL AND received_at < ? "
+            "AND (claimed_at IS NULL OR claimed_at < ?) AND (retry_at IS NULL OR retry_at < ?) "
+            "ORDER BY received_at LIMIT ?",
+            (now - older_than, now - lease, now - lease, limit)
+        ).fetchall()
+        return [row["id"] for row in rows]
+
+    @observe_store("delete_processed_events")
+    def delete_processed_events(self, max_age_seconds):
+        self._conn()
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM payment_events WHERE processed_at < ? OR failed_at < ?",
+                (time.time() - max_age_seconds, time.time() - max_age_seconds)
+            )
+        return cursor.rowcount
+
+    @observe_store("delete_older_than")
+    def delete_older_than(self, max_age_seconds):
+        self._conn()
+        now = time.time()
+        with self.db.transaction() as conn:
+            conn.execute(
+                "INSERT INTO payment_journal (lead_id, kind, order_number, at) "
+                "SELECT lead_id, ?, order_number, ? FROM payments WHERE created_at < ?",
+                (JOURNAL_EXPIRED, now, now - max_age_seconds)
+            )
+            cursor = conn.execute(
+                "DELETE FROM payments WHERE created_at < ?", (now - max_age_seconds,)
+            )
+        if cursor.rowcount:
+            logger.info(f"Removed {cursor.rowcount} payments older than {max_age_seconds} seconds")
+        return cursor.rowcount
+
+    @observe_store("history")
+    def history(self, lead_id):
+        """Журнал платежей сделки по порядку: [{"kind", "order_number", "at", ...данные события}]."""
+        rows = self._conn().execute(
+            "SELECT * FROM payment_journal WHERE lead_id = ? ORDER BY id", (str(lead_id),)
+        ).fetchall()
+        return [
+            dict(json.loads(row["data"]) if row["data"] else {},
+                 kind=row["kind"], order_number=row["order_number"], at=row["at"])
+            for row in rows
+        ]
+
+    @observe_store("compact_journal")
+    def compact_journal(self, retention_seconds):
+        """Сжатие журнала: удаляет записи старше retention_seconds.
+
+        У открытых платежей сохраняются все записи, кроме проверок в банке (status_polled):
+        по ним восстанавливается история текущего заказа. После удаления WAL переносится
+        в основной файл и обрезается, чтобы открытие базы после рестарта не перечитывало его.
+        Возвращает число удалённых записей.
+        """
+        self._conn()
+        cutoff = time.time() - retention_seconds
+        with self.db.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM payment_journal WHERE at < ? AND (kind = ? OR lead_id NOT IN (SELECT lead_id FROM payments))",
+                (cutoff, JOURNAL_POLLED)
+            )
+        removed = cursor.rowcount
+        if removed:
+            self.db.checkpoint()
+            logger.info(f"Compacted payment journal: removed {removed} entries older than {retention_seconds} seconds")
+        return removed
+
+    def migrate_from_json(self, json_path):
+        """Однократный перенос payments.json в базу; файл переименовывается в *.migrated."""
+        self._conn()
+        with self.db.transaction() as conn:
+            # Проверка внутри транзакции: параллельный процесс мог уже перенести файл
+            if not os.path.exists(json_path):
+                return 0
+            with open(json_path, "r") as f:
+                content = f.read().strip()
+            try:
+                payments = json.loads(content) if content else {}
+            except json.JSONDecodeError as e:
+                logger.error(f"Invalid JSON in {json_path}, skipping migration: {str(e)}")
+                return 0
+            now = time.time()
+            for lead_id, payment in payments.items():
+                conn.execute(
+                    "INSERT OR IGNORE INTO payments (lead_id, order_number, amount, form_url, order_id, created_at, updated_at) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    self._values(lead_id, payment, now)
+                )
+        # Файл переименовывается только после фиксации транзакции, иначе при её откате данные
+        # остались бы лишь в *.migrated. Повторный перенос безопасен (INSERT OR IGNORE)
+        try:
+            os.replace(json_path, f"{json_path}.migrated")
+        except FileNotFoundError:
+            # Параллельный процесс перенёс и переименовал файл одновременно с нами
+            pass
+        logger.info(f"Migrated {len(payments)} payments from {json_path} to {self.db.path}")
+        return len(payments)
+
+    @staticmethod
+    def _values(lead_id, payment, now):
+        return (
+            str(lead_id),
+            payment.get("order_number"),
+            payment.get("amount"),
+            payment.get("form_url"),
+            payment.get("order_id"),
+            payment.get("created_at") or now,
+            now,
+        )
+
+
+if __name__ == "__main__":
+    # python payment_store.py migrate [payments.json] [payments.db]
+    # python payment_store.py history LEAD_ID [payments.db]  — журнал платежей сделки (разбор обращений, сверка)
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    usage = "Usage: python payment_store.py migrate [payments.json] [payments.db]\n" \
+            "       python payment_store.py history LEAD_ID [payments.db]"
+    if len(sys.argv) < 2 or sys.argv[1] not in ("migrate", "history") or (sys.argv[1] == "history" and len(sys.argv) < 3):
+        print(usage)
+        sys.exit(1)
+    if sys.argv[1] == "history":
+        db_path = sys.argv[3] if len(sys.argv) > 3 else os.getenv("PAYMENTS_DB", "/root/AlfaAmo/payments.db")
+        for entry in PaymentStore(db_path).history(sys.argv[2]):
+            at = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(entry.pop("at")))
+            print(f"{at}  {entry.pop('kind'):<17} {entry.pop('order_number') or '-'}  {json.dumps(entry, ensure_ascii=False)}")
+        sys.exit(0)
+    json_path = sys.argv[2] if len(sys.argv) > 2 else os.getenv("PAYMENTS_FILE", "/root/AlfaAmo/payments.json")
+    db_path = sys.argv[3] if len(sys.argv) > 3 else os.getenv("PAYMENTS_DB", "/root/AlfaAmo/payments.db")
+    migrated = PaymentStore(db_path).migrate_from_json(json_path)
+    print(f"Migrated {migrated} payments")
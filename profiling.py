@@ -0,0 +1,201 @@
+"""Выборочное профилирование запросов Flask и задач Celery.
+
+Включается переменными окружения:
+    PROFILE_SAMPLE_RATES="webhook=0.01,payment_callback=0.05,tasks.process_lead=0.01"  (* — все остальные)
+    PROFILE_TOKEN=<секрет>  — запрос с заголовком X-Profile: <секрет> профилируется всегда
+
+Без этих переменных обработчики не подключаются и профилирование ничего не стоит.
+Отобранные запросы и задачи регистрируют свой поток в сэмплере: фоновый поток раз в
+PROFILE_INTERVAL секунд снимает стеки только этих потоков. Стеки копятся в памяти процесса
+и пишутся в PROFILE_DIR/<имя>.<pid>.folded в формате folded stacks ("кадр;кадр;кадр N"),
+который понимают flamegraph.pl и speedscope. Объединение и сводка:
+
+    python profiling.py merge [--dir PROFILE_DIR] [--output merged.folded] [--top 25]
+"""
+import argparse
+import atexit
+import glob
+import os
+import random
+import re
+import sys
+import threading
+import time
+from collections import Counter
+
+from config import Config
+from logging_setup import parse_sample_rates
+
+PROFILE_HEADER = "X-Profile"
+
+
+class StackSampler:
+    """Сэмплер стеков отобранных потоков; один на процесс, поток сэмплера создаётся заново после fork."""
+
+    def __init__(self, directory, interval, flush_interval=60.0):
+        self.directory = directory
+        self.interval = interval
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._active = {}
+        self._totals = {}
+        self._labels = {}
+        self._thread = None
+        self._pid = None
+        self._flushed_at = time.monotonic()
+
+    def _ensure_thread(self):
+        if self._thread is None or self._pid != os.getpid():
+            self._pid = os.getpid()
+            self._active, self._totals = {}, {}
+            self._thread = threading.Thread(target=self._run, name="profiling-sampler", daemon=True)
+            self._thread.start()
+            atexit.register(self.flush)
+
+    def start(self, name):
+        """Начинает профилирование текущего потока; возвращает токен для stop()."""
+        with self._lock:
+            self._ensure_thread()
+            token = (threading.get_ident(), name, Counter())
+            self._active[token[0]] = token
+        self._wake.set()
+        return token
+
+    def stop(self, token):
+        thread_id, name, stacks = token
+        with self._lock:
+            self._active.pop(thread_id, None)
+            total = self._totals.setdefault(name, Counter())
+            total.update(stacks)
+            due = time.monotonic() - self._flushed_at >= self.flush_interval
+        if due:
+            self.flush()
+
+    def _run(self):
+        while True:
+            with self._lock:
+                active = list(self._active.values())
+                if not active:
+                    self._wake.clear()
+            if not active:
+                self._wake.wait()
+                continue
+            frames = sys._current_frames()
+            for thread_id, name, stacks in active:
+                frame = frames.get(thread_id)
+                if frame is not None:
+                    stacks[self._fold(name, frame)] += 1
+            del frames
+            time.sleep(self.interval)
+
+    def _fold(self, name, frame):
+        labels = []
+        while frame is not None:
+            code = frame.f_code
+            label = self._labels.get(code)
+            if label is None:
+                label = self._labels[code] = f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+            labels.append(label)
+            frame = frame.f_back
+        labels.append(name)
+        return ";".join(reversed(labels))
+
+    def flush(self):
+        """Пишет накопленные стеки процесса: по файлу на имя профиля, целиком заменяя прошлую запись."""
+        with self._lock:
+            totals = {name: Counter(stacks) for name, stacks in self._totals.items()}
+            self._flushed_at = time.monotonic()
+        if not totals:
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        for name, stacks in totals.items():
+            path = os.path.join(self.directory, f"{re.sub(r'[^A-Za-z0-9_.-]', '_', name)}.{os.getpid()}.folded")
+            with open(f"{path}.tmp", "w") as f:
+                for stack, count in stacks.items():
+                    f.write(f"{stack} {count}\n")
+            os.replace(f"{path}.tmp", path)
+
+
+class Profiler:
+    """Решает, профилировать ли запрос или задачу name, и ведёт сэмплер."""
+
+    def __init__(self, rates, token=None, directory=None, interval=None):
+        self.rates = rates
+        self.token = token
+        self.sampler = StackSampler(
+            directory or Config.PROFILE_DIR, interval or Config.PROFILE_INTERVAL, Config.PROFILE_FLUSH_INTERVAL
+        )
+
+    @classmethod
+    def from_config(cls):
+        """None, если профилирование не включено: обработчики тогда не подключаются вовсе."""
+        rates = parse_sample_rates(Config.PROFILE_SAMPLE_RATES)
+        if not rates and not Config.PROFILE_TOKEN:
+            return None
+        return cls(rates, Config.PROFILE_TOKEN or None)
+
+    def start(self, name, header=None):
+        """Токен профиля, если name попал в выборку (или передан верный X-Profile), иначе None."""
+        forced = self.token is not None and header == self.token
+        if not forced and random.random() >= self.rates.get(name, self.rates.get("*", 0.0)):
+            return None
+        return self.sampler.start(name)
+
+    def stop(self, token):
+        if token is not None:
+            self.sampler.stop(token)
+
+
+def read_folded(paths):
+    stacks = Counter()
+    for path in paths:
+        with open(path) as f:
+            for line in f:
+                stack, _, count = line.rstrip("\n").rpartition(" ")
+                if stack:
+                    stacks[stack] += int(count)
+    return stacks
+
+
+def summarize(stacks, top=25):
+    """Сэмплы по профилям, а также функции с наибольшим собственным (self) и общим (total) временем."""
+    by_profile, self_samples, total_samples = Counter(), Counter(), Counter()
+    for stack, count in stacks.items():
+        frames = stack.split(";")
+        by_profile[frames[0]] += count
+        self_samples[frames[-1]] += count
+        for frame in set(frames[1:]):
+            total_samples[frame] += count
+    lines = ["samples by profile:"]
+    lines += [f"  {count:8d}  {name}" for name, count in by_profile.most_common()]
+    lines.append(f"top {top} by self samples:")
+    lines += [f"  {count:8d}  {frame}" for frame, count in self_samples.most_common(top)]
+    lines.append(f"top {top} by total samples:")
+    lines += [f"  {count:8d}  {frame}" for frame, count in total_samples.most_common(top)]
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Объединение и сводка профилей *.folded")
+    parser.add_argument("command", choices=["merge"])
+    parser.add_argument("--dir", default=Config.PROFILE_DIR)
+    parser.add_argument("--profile", help="Только профили с этим префиксом имени (webhook, tasks.process_lead)")
+    parser.add_argument("--output", help="Объединённый файл folded stacks для flamegraph.pl / speedscope")
+    parser.add_argument("--top", type=int, default=25)
+    args = parser.parse_args()
+
+    paths = sorted(glob.glob(os.path.join(args.dir, "*.folded")))
+    stacks = read_folded(paths)
+    if args.profile:
+        stacks = Counter({stack: count for stack, count in stacks.items() if stack.startswith(args.profile)})
+    if args.output:
+        with open(args.output, "w") as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+    print(f"{len(paths)} files, {sum(stacks.values())} samples")
+    print(summarize(stacks, args.top))
+
+
+if __name__ == "__main__":
+    main()
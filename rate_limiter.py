@@ -0,0 +1,96 @@
+import logging
+import os
+import random
+import time
+
+from metrics import RATE_LIMIT_TOKENS
+from sqlite_db import SQLiteDatabase
+
+logger = logging.getLogger(__name__)
+
+# Классы приоритета: чем меньше число, тем важнее запрос
+PRIORITY_PAYMENT = 0  # подтверждение оплаты: примечание, тег, статус
+PRIORITY_DEFAULT = 1
+PRIORITY_LINK = 2     # создание ссылки на оплату
+
+PRIORITY_NAMES = {PRIORITY_PAYMENT: "payment", PRIORITY_DEFAULT: "default", PRIORITY_LINK: "link"}
+
+MIGRATIONS = [
+    [
+        "CREATE TABLE IF NOT EXISTS rate_buckets ("
+        "name TEXT PRIMARY KEY, tokens REAL NOT NULL, updated_at REAL NOT NULL)",
+    ],
+]
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class RateLimiter:
+    """Token bucket, общий для всех процессов на хосте (состояние в SQLite).
+
+    Приоритет реализован резервированием: запрос класса priority получает токен, только если
+    после этого в корзине останется не меньше reserves[priority] токенов. Поэтому при нагрузке
+    создание ссылок ждёт, а подтверждения оплаты проходят первыми.
+    """
+
+    def __init__(self, path, name, rate, capacity=None, reserves=None):
+        self.db = SQLiteDatabase(path)
+        self.name = name
+        self.rate = float(rate)
+        self.capacity = float(capacity or rate)
+        self.reserves = reserves if reserves is not None else {
+            PRIORITY_PAYMENT: 0,
+            PRIORITY_DEFAULT: min(1, self.capacity - 1),
+            PRIORITY_LINK: min(2, self.capacity - 1),
+        }
+        self._ready_pid = None
+
+    def _conn(self):
+        if self._ready_pid != os.getpid():
+            self.db.migrate("rate_limiter", MIGRATIONS)
+            self._ready_pid = os.getpid()
+        return self.db.connection()
+
+    def _try_acquire(self, priority):
+        """Возвращает 0, если токен получен, иначе сколько секунд подождать."""
+        self._conn()
+        needed = 1 + self.reserves.get(priority, 0)
+        with self.db.transaction() as conn:
+            now = time.time()
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_buckets WHERE name = ?", (self.name,)
+            ).fetchone()
+            if row is None:
+                tokens = self.capacity
+            else:
+                tokens = min(self.capacity, row["tokens"] + max(now - row["updated_at"], 0) * self.rate)
+            wait = 0.0
+            if tokens >= needed:
+                tokens -= 1
+            else:
+                wait = (needed - tokens) / self.rate
+            conn.execute(
+                "INSERT INTO rate_buckets (name, tokens, updated_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(name) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                (self.name, tokens, now)
+            )
+        RATE_LIMIT_TOKENS.labels(self.name).set(tokens)
+        return wait
+
+    def acquire(self, priority=PRIORITY_DEFAULT, timeout=None):
+        """Блокирует до получения токена; возвращает время ожидания в секундах."""
+        started = time.monotonic()
+        while True:
+            wait = self._try_acquire(priority)
+            if wait == 0:
+                break
+            if timeout is not None and time.monotonic() - started + wait > timeout:
+                raise RateLimitTimeout(f"Rate limiter '{self.name}': no token within {timeout} seconds")
+            # Небольшой разброс, чтобы ожидающие процессы не просыпались одновременно
+            time.sleep(wait * random.uniform(1.0, 1.2))
+        waited = time.monotonic() - started
+        if waited > 1:
+            logger.info(f"Rate limiter '{self.name}': {PRIORITY_NAMES.get(priority, priority)} request waited {waited:.2f}s")
+        return waited
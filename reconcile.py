@@ -0,0 +1,138 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from config import Config
+from payment_store import JOURNAL_RETIRED
+from rate_limiter import PRIORITY_LINK
+
+logger = logging.getLogger(__name__)
+
+# Закрытые статусы amoCRM, общие для всех воронок: «Успешно реализовано» и «Закрыто и не реализовано»
+STATUS_WON = 142
+STATUS_LOST = 143
+
+
+class LeadReconciler:
+    """Сверка открытых платежей со сделками amoCRM после простоя или пропущенных вебхуков.
+
+    Сделки отобранных воронок и статусов читаются постранично по возрастанию id, открытые
+    платежи — в том же порядке, поэтому расхождения находятся одним проходом слиянием,
+    а в памяти держится одна страница. Сделкам без ссылки или с изменённой суммой заказы
+    регистрируются в пуле потоков, ссылки уходят в amoCRM одним пакетом на страницу.
+    Платежи удалённых, закрытых и уже оплаченных (paid_status_id) сделок снимаются с опроса.
+    """
+
+    def __init__(self, payment_store, amocrm_client, lead_filter, register_order, save_payment,
+                 paid_status_id, max_workers=8, page_size=250, custom_field_id=None):
+        self.payment_store = payment_store
+        self.amocrm_client = amocrm_client
+        self.lead_filter = lead_filter
+        self.register_order = register_order
+        self.save_payment = save_payment
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self.custom_field_id = custom_field_id or Config.CUSTOM_FIELD_ID
+        self.retired_status_ids = frozenset({STATUS_WON, STATUS_LOST, paid_status_id})
+
+    def run(self):
+        started = time.monotonic()
+        summary = {"pages": 0, "leads": 0, "created": 0, "updated": 0, "unchanged": 0, "retired": 0, "errors": 0}
+        payments = self.payment_store.iter_by_lead_id()
+        current = next(payments, None)
+        unmatched = []
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            pages = self.amocrm_client.iter_lead_pages(self.lead_filter.rules, priority=PRIORITY_LINK, limit=self.page_size)
+            for leads in pages:
+                summary["pages"] += 1
+                summary["leads"] += len(leads)
+                missing = []
+                for lead in leads:
+                    lead_id = int(lead["id"])
+                    # Платежи с меньшим id не попали в выборку: сделка ушла из отобранных статусов
+                    while current is not None and current[0] < lead_id:
+                        unmatched.append(current)
+                        current = next(payments, None)
+                    existing = None
+                    if current is not None and current[0] == lead_id:
+                        existing = current[1]
+                        current = next(payments, None)
+                    amount = (lead.get("price") or 0) * 100
+                    if amount <= 0:
+                        continue
+                    if existing and existing["amount"] == amount:
+                        summary["unchanged"] += 1
+                    else:
+                        missing.append((lead_id, amount, existing))
+                self._create_links(executor, missing, summary)
+                if len(unmatched) >= self.page_size:
+                    self._retire(unmatched, summary)
+                    unmatched = []
+
+        while current is not None:
+            unmatched.append(current)
+            current = next(payments, None)
+            if len(unmatched) >= self.page_size:
+                self._retire(unmatched, summary)
+                unmatched = []
+        if unmatched:
+            self._retire(unmatched, summary)
+
+        summary["elapsed"] = round(time.monotonic() - started, 3)
+        logger.info(f"Сверка сделок завершена: {summary}")
+        return summary
+
+    def _register(self, lead_id, amount, existing):
+        try:
+            return lead_id, amount, existing, self.register_order(lead_id, amount), None
+        except Exception as e:
+            return lead_id, amount, existing, None, e
+
+    def _create_links(self, executor, missing, summary):
+        if not missing:
+            return
+        batch = self.amocrm_client.batch(PRIORITY_LINK)
+        registered = []
+        for lead_id, amount, existing, order, error in executor.map(lambda item: self._register(*item), missing):
+            if error is not None:
+                summary["errors"] += 1
+                logger.error(f"Не удалось зарегистрировать заказ для сделки {lead_id}: {str(error)}")
+                continue
+            field_value = f"{order['form_url']} (Order ID: {order['order_id']})"
+            note_text = f"Создана ссылка на оплату при сверке: {order['form_url']} (Order ID: {order['order_id']})"
+            batch.update_lead(lead_id, self.custom_field_id, field_value).add_note(lead_id, note_text)
+            registered.append((lead_id, amount, existing, order))
+
+        results = batch.flush()
+        for lead_id, amount, existing, order in registered:
+            error = results.get(lead_id)
+            if error is not None:
+                summary["errors"] += 1
+                logger.error(f"Не удалось записать ссылку в сделку {lead_id}: {str(error)}")
+                continue
+            self.save_payment(lead_id, existing["rev"] if existing else None, {
+                "order_number": order["order_number"],
+                "amount": amount,
+                "form_url": order["form_url"],
+                "order_id": order["order_id"],
+                "created_at": time.time()
+            })
+            summary["updated" if existing else "created"] += 1
+
+    def _retire(self, unmatched, summary):
+        """Снимает с опроса платежи сделок, которые удалены, закрыты или уже оплачены."""
+        try:
+            leads = self.amocrm_client.get_leads_by_ids([lead_id for lead_id, _ in unmatched], priority=PRIORITY_LINK)
+        except Exception as e:
+            summary["errors"] += 1
+            logger.error(f"Не удалось получить {len(unmatched)} сделок для сверки: {str(e)}")
+            return
+        statuses = {int(lead["id"]): lead.get("status_id") for lead in leads}
+        stale = [
+            lead_id for lead_id, _ in unmatched
+            if lead_id not in statuses or statuses[lead_id] in self.retired_status_ids
+        ]
+        if stale:
+            logger.info(f"Сверка: сняты с опроса платежи {len(stale)} удалённых или закрытых сделок")
+        summary["retired"] += self.payment_store.delete_many(stale, JOURNAL_RETIRED)
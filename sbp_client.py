@@ -1,19 +1,55 @@
-import requests
+import os
+import time
 import logging
+from urllib.parse import urlparse
+
+import requests
 
+from circuit_breaker import CircuitBreaker
 from config import Config
+from http_session import PooledSession
+from logging_setup import truncate
+from metrics import observe_client_request
 
 logger = logging.getLogger(__name__)
 
 class SBPClient:
-    def __init__(self):
+    def __init__(self, merchant_login=None, merchant_password=None, payment_token=None, callback_url=None):
         self.base_url = "https://payment.alfabank.ru/payment/rest" if not Config.SBP_TEST_ENV else "https://alfa.rbsuat.com/payment/rest"
-        self.merchant_login = Config.SBP_MERCHANT_LOGIN
-        self.merchant_password = Config.SBP_MERCHANT_PASSWORD
-        self.payment_token = Config.SBP_PAYMENT_TOKEN
+        # По умолчанию — мерчант из Config; арендаторы (tenants.py) передают свои учётные данные
+        self.merchant_login = merchant_login or Config.SBP_MERCHANT_LOGIN
+        self.merchant_password = merchant_password or Config.SBP_MERCHANT_PASSWORD
+        self.payment_token = payment_token or Config.SBP_PAYMENT_TOKEN
+        self.callback_url = callback_url or Config.CALLBACK_URL
+        self._session = None
+        # Пока банк не отвечает, запросы сразу получают CircuitOpen вместо ожидания таймаута
+        self.breaker = CircuitBreaker(
+            Config.RATE_LIMIT_DB, f"sbp:{urlparse(self.base_url).netloc}",
+            Config.CIRCUIT_FAILURE_THRESHOLD, Config.CIRCUIT_RESET_TIMEOUT
+        )
+
+    @property
+    def session(self):
+        # Пул соединений создаётся заново в каждом процессе после fork;
+        # повтор register.do безопасен: банк не регистрирует второй заказ с тем же orderNumber
+        if self._session is None or self._session.pid != os.getpid():
+            self._session = PooledSession(retry_methods=("GET", "POST"), service="sbp")
+        return self._session
+
+    def _request(self, method, endpoint, **kwargs):
+        self.breaker.before_request()
+        started = time.perf_counter()
+        try:
+            response = self.session.request(method, f"{self.base_url}/{endpoint}", **kwargs)
+        except requests.RequestException as e:
+            observe_client_request("sbp", method, endpoint, started, error=e)
+            self.breaker.observe(error=e)
+            raise
+        observe_client_request("sbp", method, endpoint, started, status=response.status_code)
+        self.breaker.observe(status=response.status_code)
+        return response
 
     def create_payment_link(self, amount, order_number):
-        url = f"{self.base_url}/register.do"
         params = {
             "amount": amount,
             "orderNumber": order_number,
@@ -21,8 +57,8 @@ class SBPClient:
             "description": "Payment",
             "language": "ru",
             "pageView": "DESKTOP",
-            "callbackUrl": "https://alfa-amocrm.ru/payment_callback",
-            "sessionTimeoutSecs": 86400  # Устанавливаем 24 часа
+            "callbackUrl": self.callback_url,
+            "sessionTimeoutSecs": Config.SBP_SESSION_TIMEOUT_SECS  # По умолчанию 24 часа
         }
 
         if Config.SBP_TEST_ENV:
@@ -31,11 +67,36 @@ class SBPClient:
         else:
             params["token"] = self.payment_token
 
-        response = requests.post(url, data=params)
-        logger.info(f"Create payment link response: {response.status_code}, {response.text}")
+        response = self._request("POST", "register.do", data=params)
+        logger.info(f"Create payment link response: {response.status_code}, {truncate(response.text)}")
         response.raise_for_status()
         response_data = response.json()
         if "errorCode" in response_data:
             error_message = response_data.get("errorMessage", "Unknown error")
             raise Exception(f"Failed to create payment link: {response_data}")
-        return response_data
\ No newline at end of file
+        return response_data
+
+    def get_order_status(self, order_number):
+        params = {
+            "userName": self.merchant_login,
+            "password": self.merchant_password,
+            "orderNumber": order_number,
+            "language": "ru"
+        }
+        response = self._request("GET", "getOrderStatus.do", params=params)
+        logger.info(f"Order {order_number} status response: {response.status_code}, {truncate(response.text)}")
+        response.raise_for_status()
+        return response.json()
+
+    def get_order_status_extended(self, order_number):
+        """Состояние заказа по orderNumber; для неизвестного банку номера errorCode отличен от 0 и нет orderStatus."""
+        params = {
+            "userName": self.merchant_login,
+            "password": self.merchant_password,
+            "orderNumber": order_number,
+            "language": "ru"
+        }
+        response = self._request("GET", "getOrderStatusExtended.do", params=params)
+        logger.info(f"Order {order_number} extended status response: {response.status_code}, {truncate(response.text)}")
+        response.raise_for_status()
+        return response.json()
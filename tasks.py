@@ -1,161 +1,455 @@
 from celery import Celery
-from amocrm_client import AmoCRMClient
-from sbp_client import SBPClient
+from celery.signals import setup_logging, task_prerun, task_postrun, worker_process_shutdown
+from amocrm_client import BatchError
+from circuit_breaker import STATE_CLOSED, CircuitOpen
+from rate_limiter import PRIORITY_LINK, PRIORITY_PAYMENT
+from payment_store import JOURNAL_PAID
+from payment_poller import PaymentPoller
+from reconcile import LeadReconciler
+from lead_debouncer import LeadDebouncer
 from config import Config
+from bootstrap import bootstrap_worker
+from tenants import UnknownTenant, registry
+from profiling import Profiler
+from logging_setup import get_correlation_id, set_correlation_id, reset_correlation_id
+from metrics import QUEUE_PUBLISH_SECONDS, QUEUE_PUBLISHED_EVENTS, TASK_SECONDS, mark_process_dead, observe_stage, timed
+import functools
 import json
+import os
 import time
-import random
-import string
 import logging
-import os
 
-# Настройка логирования для Celery
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/root/AlfaAmo/celery.log', mode='a'),  # Убедимся, что файл открывается в режиме добавления
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger('webhook_handler')
 logger.setLevel(logging.INFO)
+callback_logger = logging.getLogger('callback_handler')
 
-app = Celery('tasks', broker='pyamqp://guest@localhost//')
+app = Celery('tasks', broker=Config.CELERY_BROKER_URL)
 app.conf.task_serializer = 'json'
 app.conf.accept_content = ['json']
 app.conf.result_serializer = 'json'
 app.conf.task_track_started = True
 
-amocrm_client = AmoCRMClient()
-sbp_client = SBPClient()
+def route_by_tenant(name, args, kwargs, options, task=None, **kw):
+    """Очередь задачи: payments для callback банка, иначе TASKS_QUEUE; при TENANT_SHARDS > 1 — с номером шарда арендатора.
 
-PAYMENTS_FILE = "/root/AlfaAmo/payments.json"
+    Callback банка применяются отдельными воркерами и не ждут за созданием ссылок в process_lead,
+    а каждый шард обслуживают свои воркеры, поэтому шумный аккаунт не задерживает остальные:
+      celery -A tasks worker -Q payments          (при шардах: -Q payments.0,payments.1)
+      celery -A tasks worker -Q celery            (при шардах: -Q celery.0 на одних машинах, -Q celery.1 на других)
+    """
+    base = Config.PAYMENTS_QUEUE if name == "tasks.apply_payment_event" else Config.TASKS_QUEUE
+    try:
+        tenant = registry.get((kwargs or {}).get("tenant"))
+    except UnknownTenant:
+        return {"queue": base}
+    return {"queue": tenant.queue(base)}
 
-logger.info("Celery worker started, logging configured")
+app.conf.task_default_queue = Config.TASKS_QUEUE
+app.conf.task_routes = (route_by_tenant,)
+app.conf.beat_schedule = {
+    "check-payments": {
+        "task": "tasks.check_payments_task",
+        "schedule": Config.PAYMENTS_POLL_INTERVAL,
+    },
+    "refresh-amocrm-metadata": {
+        "task": "tasks.refresh_metadata_task",
+        "schedule": Config.AMOCRM_METADATA_TTL / 2,
+    },
+    "replay-deferred": {
+        "task": "tasks.replay_deferred_task",
+        "schedule": Config.DEFERRED_REPLAY_INTERVAL,
+    },
+    "compact-payment-journal": {
+        "task": "tasks.compact_journal_task",
+        "schedule": Config.JOURNAL_COMPACT_INTERVAL,
+    },
+}
+if Config.RECONCILE_INTERVAL > 0:
+    app.conf.beat_schedule["reconcile-leads"] = {
+        "task": "tasks.reconcile_leads_task",
+        "schedule": Config.RECONCILE_INTERVAL,
+    }
 
-def load_payments():
-    logger.info(f"Loading payments from {PAYMENTS_FILE}")
-    if not os.path.exists(PAYMENTS_FILE):
-        logger.info("Payments file does not exist, creating new one")
-        save_payments({})
-        return {}
-    try:
-        with open(PAYMENTS_FILE, "r") as f:
-            content = f.read().strip()
-            if not content:
-                logger.info("Payments file is empty, initializing with {}")
-                return {}
-            return json.loads(content)
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in payments file: {str(e)}")
-        save_payments({})
-        return {}
-    except Exception as e:
-        logger.error(f"Failed to load payments: {str(e)}")
-        return {}
+# Заголовок задачи с correlation id запроса /webhook; имя correlation_id занято самим Celery
+CORRELATION_HEADER = "log_correlation_id"
 
-def save_payments(payments):
-    logger.info(f"Saving payments to {PAYMENTS_FILE}")
-    try:
-        with open(PAYMENTS_FILE, "w") as f:
-            json.dump(payments, f, indent=4)
-    except Exception as e:
-        logger.error(f"Failed to save payments: {str(e)}")
+@setup_logging.connect
+def setup_worker_logging(**kwargs):
+    # Celery не настраивает логирование сам, если подключён обработчик этого сигнала
+    bootstrap_worker()
+    logger.info("Celery worker started, logging configured")
+
+@task_prerun.connect
+def bind_task_correlation_id(task=None, **kwargs):
+    request = task.request
+    request.correlation_token = set_correlation_id(getattr(request, CORRELATION_HEADER, None) or request.id)
+    request.started_at = time.perf_counter()
+
+@task_postrun.connect
+def unbind_task_correlation_id(task=None, state=None, **kwargs):
+    request = task.request
+    started_at = getattr(request, "started_at", None)
+    if started_at is not None:
+        TASK_SECONDS.labels(task.name, state or "UNKNOWN").observe(time.perf_counter() - started_at)
+    token = getattr(request, "correlation_token", None)
+    if token is not None:
+        reset_correlation_id(token)
+
+# Профилирование задач (PROFILE_SAMPLE_RATES); без него обработчики не подключаются
+profiler = Profiler.from_config()
+if profiler is not None:
+    @task_prerun.connect(weak=False)
+    def start_task_profile(task=None, **kwargs):
+        task.request.profile_token = profiler.start(task.name)
+
+    @task_postrun.connect(weak=False)
+    def stop_task_profile(task=None, **kwargs):
+        profiler.stop(getattr(task.request, "profile_token", None))
+
+@worker_process_shutdown.connect
+def cleanup_worker_metrics(pid=None, **kwargs):
+    mark_process_dead(pid or os.getpid())
+
+def circuit_open(error):
+    """CircuitOpen, из-за которого не отправлен запрос (в том числе внутри пакета amoCRM), иначе None."""
+    if isinstance(error, CircuitOpen):
+        return error
+    if isinstance(error, BatchError):
+        return next((item for item in error.errors.values() if isinstance(item, CircuitOpen)), None)
+    return None
+
+def permanent_error(error):
+    """Ошибка, которую повтор не исправит: ответ amoCRM 4xx, кроме 429 (сделка удалена, данные отклонены)."""
+    if isinstance(error, BatchError):
+        return all(permanent_error(item) for item in error.errors.values())
+    response = getattr(error, "response", None)
+    return response is not None and 400 <= response.status_code < 500 and response.status_code != 429
 
-def generate_order_number(lead_id):
-    logger.info(f"Generating order number for lead_id: {lead_id}")
-    random_letter = random.choice(string.ascii_uppercase)
-    random_digits = random.randint(100, 999)
-    return f"{lead_id}_{random_letter}{random_digits}"
+def clean_old_payments(payment_store, max_age_seconds=7*24*3600):
+    payment_store.delete_processed_events(max_age_seconds)
+    return payment_store.delete_older_than(max_age_seconds)
+
+# Заказ, зарегистрированный, но ещё не сохранённый в payments, переиспользуется, пока жива хотя бы половина его срока
+ORDER_REUSE_MAX_AGE = Config.SBP_SESSION_TIMEOUT_SECS / 2
+
+def register_order(services, lead_id, amount):
+    """Ссылка на оплату суммы amount: повтор или повторная доставка задачи не регистрируют второй заказ.
+
+    Номер заказа детерминирован (сделка, сумма, версия); ответ банка сохраняется сразу после register.do.
+    Возвращает dict с order_number, order_id и form_url.
+    """
+    payment_store, sbp_client = services.payment_store, services.sbp_client
+    order = payment_store.reserve_order(lead_id, amount, ORDER_REUSE_MAX_AGE)
+    if order["order_id"]:
+        logger.info(f"Reusing order {order['order_number']} already registered for lead {lead_id}")
+        return order
+    if order["reused"]:
+        # Прошлая попытка могла зарегистрировать заказ и не дождаться ответа; ссылку из неё никто не получил
+        status = sbp_client.get_order_status_extended(order["order_number"])
+        if status.get("orderStatus") is not None:
+            logger.warning(f"Order {order['order_number']} exists in the bank without a saved link, registering next version")
+            order = payment_store.reserve_order(lead_id, amount, ORDER_REUSE_MAX_AGE, new_version=True)
+    logger.info(f"Creating payment link for amount: {amount}, order_number: {order['order_number']}")
+    payment_response = sbp_client.create_payment_link(amount, order["order_number"])
+    if isinstance(payment_response, str):
+        payment_response = json.loads(payment_response)
+    order["form_url"] = payment_response.get("formUrl")
+    order["order_id"] = payment_response.get("orderId")
+    payment_store.confirm_order(lead_id, order["order_number"], order["order_id"], order["form_url"])
+    return order
+
+def save_payment(services, lead_id, expected_rev, payment):
+    # Параллельная задача могла успеть записать свою ссылку; в сделке остаётся ссылка из последнего update_lead,
+    # поэтому сохраняем свою поверх, но фиксируем конфликт в логе
+    payment_store = services.payment_store
+    if not payment_store.compare_and_set(lead_id, expected_rev, payment):
+        logger.warning(f"Payment for lead {lead_id} was changed concurrently, overwriting with the latest link")
+        payment_store.upsert(lead_id, payment)
 
 @app.task
-def process_lead(lead_id, status_id, pipeline_id):
+def process_lead(lead_id, status_id, pipeline_id, event_token=None, tenant=None):
     logger.info(f"Starting async processing for lead_id: {lead_id}, status_id: {status_id}, pipeline_id: {pipeline_id}")
+    services = registry.services(tenant)
+    amocrm_client, payment_store = services.amocrm_client, services.payment_store
 
-    if pipeline_id != Config.PIPELINE_ID or status_id not in Config.ALLOWED_STATUS_IDS:
-        logger.info(f"Lead {lead_id} is not in pipeline 'Доставка цветов' or not in allowed status: {Config.ALLOWED_STATUS_IDS}")
+    if event_token is not None and services.lead_debouncer.claim(lead_id, event_token) is None:
+        logger.info(f"Lead {lead_id} received a newer event within the debounce window, skipping")
+        return
+
+    # Основной отбор выполняется в /webhook; проверка здесь — для задач, поставленных в обход него
+    if not services.lead_filter.matches(status_id, pipeline_id):
+        logger.info(f"Lead {lead_id} is not in pipeline 'Доставка цветов' or not in allowed status: {services.lead_filter.rules}")
         return
 
     try:
         logger.info(f"Fetching lead {lead_id} from amoCRM")
-        lead = amocrm_client.get_lead_by_id(lead_id)
-        logger.info(f"Lead {lead_id} found: {lead}")
+        with observe_stage("process_lead", "fetch_lead"):
+            lead = amocrm_client.get_lead_by_id(lead_id, priority=PRIORITY_LINK)
+        # Только нужные задаче поля: сделка целиком — большой JSON на каждую задачу
+        logger.info(f"Lead {lead_id} found: status_id {lead.get('status_id')}, pipeline_id {lead.get('pipeline_id')}, price {lead.get('price')}")
 
         amount = lead.get("price", 0) * 100
         if amount <= 0:
             logger.warning(f"Lead {lead_id} has no price set")
             return
 
-        payments = load_payments()
+        existing_payment = payment_store.get(lead_id)
+        expected_rev = existing_payment["rev"] if existing_payment else None
 
-        if str(lead_id) in payments:
-            existing_payment = payments[str(lead_id)]
+        if existing_payment:
             existing_amount = existing_payment.get("amount")
-            logger.info(f"Lead {lead_id} already in payments.json, existing amount: {existing_amount}, new amount: {amount}")
-
-            if existing_amount != amount:
-                logger.info(f"Amounts differ, updating data for lead {lead_id}")
-                order_number = generate_order_number(lead_id)
-                logger.info(f"Creating payment link for amount: {amount}, order_number: {order_number}")
-                payment_response = sbp_client.create_payment_link(amount, order_number)
-                if isinstance(payment_response, str):
-                    payment_response = json.loads(payment_response)
-                payment_link = payment_response.get("formUrl")
-                order_id = payment_response.get("orderId")
-                logger.info(f"Created new payment link for lead {lead_id}: {payment_link}, orderId: {order_id}")
-
-                field_value = f"{payment_link} (Order ID: {order_id})"
-                logger.info(f"Updating lead {lead_id} in amoCRM with new payment link")
-                amocrm_client.update_lead(lead_id, Config.CUSTOM_FIELD_ID, field_value)
-                logger.info(f"Lead {lead_id} updated with new link and orderId")
-
-                note_text = f"Создана новая ссылка на оплату (сумма изменена): {payment_link} (Order ID: {order_id})"
-                logger.info(f"Adding note to lead {lead_id}: {note_text}")
-                amocrm_client.add_note(lead_id, note_text)
-                logger.info(f"Note added to lead {lead_id}")
-
-                payments[lead_id] = {
-                    "order_number": order_number,
-                    "amount": amount,
-                    "form_url": payment_link,
-                    "order_id": order_id,
-                    "created_at": time.time()
-                }
-                save_payments(payments)
-                logger.info(f"Lead {lead_id} updated in payments.json with new amount and link")
-            else:
+            logger.info(f"Lead {lead_id} already in payment store, existing amount: {existing_amount}, new amount: {amount}")
+            if existing_amount == amount:
                 logger.info(f"Amounts are the same, skipping processing for lead {lead_id}")
-            return
+                return
+            logger.info(f"Amounts differ, updating data for lead {lead_id}")
 
-        order_number = generate_order_number(lead_id)
-        logger.info(f"Creating payment link for amount: {amount}, order_number: {order_number}")
-        payment_response = sbp_client.create_payment_link(amount, order_number)
-        if isinstance(payment_response, str):
-            payment_response = json.loads(payment_response)
-        payment_link = payment_response.get("formUrl")
-        order_id = payment_response.get("orderId")
+        with observe_stage("process_lead", "register_order"):
+            order = register_order(services, lead_id, amount)
+        payment_link = order["form_url"]
+        order_id = order["order_id"]
         logger.info(f"Created payment link for lead {lead_id}: {payment_link}, orderId: {order_id}")
 
         field_value = f"{payment_link} (Order ID: {order_id})"
-        logger.info(f"Updating lead {lead_id} in amoCRM with payment link")
-        amocrm_client.update_lead(lead_id, Config.CUSTOM_FIELD_ID, field_value)
-        logger.info(f"Lead {lead_id} updated with link and orderId")
-
-        note_text = f"Создана ссылка на оплату: {payment_link} (Order ID: {order_id})"
-        logger.info(f"Adding note to lead {lead_id}: {note_text}")
-        amocrm_client.add_note(lead_id, note_text)
-        logger.info(f"Note added to lead {lead_id}")
+        if existing_payment:
+            note_text = f"Создана новая ссылка на оплату (сумма изменена): {payment_link} (Order ID: {order_id})"
+        else:
+            note_text = f"Создана ссылка на оплату: {payment_link} (Order ID: {order_id})"
+        logger.info(f"Updating lead {lead_id} in amoCRM with payment link and note: {note_text}")
+        with observe_stage("process_lead", "update_lead"):
+            amocrm_client.apply(
+                amocrm_client.batch(PRIORITY_LINK)
+                .update_lead(lead_id, services.custom_field_id, field_value)
+                .add_note(lead_id, note_text)
+            )
+        logger.info(f"Lead {lead_id} updated with link and orderId, note added")
 
-        payments[lead_id] = {
-            "order_number": order_number,
+        save_payment(services, lead_id, expected_rev, {
+            "order_number": order["order_number"],
             "amount": amount,
             "form_url": payment_link,
             "order_id": order_id,
             "created_at": time.time()
-        }
-        save_payments(payments)
-        logger.info(f"Lead {lead_id} saved to payments.json")
+        })
+        logger.info(f"Lead {lead_id} saved to payment store")
     except Exception as e:
+        opened = circuit_open(e)
+        if opened is not None:
+            # amoCRM или банк недоступен: задача ждёт в отложенной очереди, а не в повторах и таймаутах
+            services.deferred.park("process_lead", lead_id, {
+                "lead_id": lead_id, "status_id": status_id, "pipeline_id": pipeline_id, "tenant": tenant
+            }, opened.name)
+            return
         logger.error(f"Error during async processing of lead {lead_id}: {str(e)}")
-        raise
\ No newline at end of file
+        raise
+
+def register_lead_events(events):
+    """Регистрирует события в LeadDebouncer; возвращает пачки (tenant, события, токены) для публикации."""
+    # События: (lead_id, status_id, pipeline_id, correlation_id, tenant)
+    # Из нескольких событий одной сделки в окне LEAD_DEBOUNCE_WINDOW выполнится только последнее
+    by_tenant = {}
+    for lead_id, status_id, pipeline_id, correlation_id, tenant in events:
+        by_tenant.setdefault(tenant, []).append((lead_id, status_id, pipeline_id, correlation_id))
+    batches = []
+    for tenant, tenant_events in by_tenant.items():
+        lead_debouncer = registry.services(tenant).lead_debouncer
+        tenant_events, duplicates = LeadDebouncer.coalesce(tenant_events)
+        tokens = lead_debouncer.register_many(tenant_events)
+        lead_debouncer.record_coalesced(duplicates)
+        batches.append((tenant, tenant_events, tokens))
+    return batches
+
+def publish_registered_lead_events(batches):
+    """Публикует пачки register_lead_events; повтор публикации не регистрирует события заново."""
+    # Одно соединение и канал из пула продюсеров Celery на всю пачку событий
+    published = 0
+    with timed(QUEUE_PUBLISH_SECONDS), app.producer_or_acquire() as producer:
+        for tenant, tenant_events, tokens in batches:
+            for (lead_id, status_id, pipeline_id, correlation_id), token in zip(tenant_events, tokens):
+                process_lead.apply_async(
+                    (lead_id, status_id, pipeline_id),
+                    {"event_token": token, "tenant": tenant},
+                    countdown=Config.LEAD_DEBOUNCE_WINDOW,
+                    producer=producer,
+                    headers={CORRELATION_HEADER: correlation_id}
+                )
+            published += len(tenant_events)
+    QUEUE_PUBLISHED_EVENTS.inc(published)
+
+def publish_lead_events(events):
+    publish_registered_lead_events(register_lead_events(events))
+
+def enqueue_payment_event(event_id, tenant=None):
+    """Ставит событие callback в очередь payments; при недоступном брокере его переотправит check_payments_task."""
+    try:
+        apply_payment_event.apply_async((event_id,), {"tenant": tenant}, headers={CORRELATION_HEADER: get_correlation_id()})
+        return True
+    except Exception as e:
+        logger.error(f"Failed to enqueue payment event {event_id}, it will be requeued later: {str(e)}")
+        return False
+
+def requeue_payment_events(services):
+    if not services.amocrm_client.breaker.allows():
+        return 0
+    event_ids = services.payment_store.pending_payment_events(Config.PAYMENT_EVENT_REQUEUE_AFTER, Config.PAYMENT_EVENT_LEASE)
+    for event_id in event_ids:
+        enqueue_payment_event(event_id, services.tenant.name)
+    if event_ids:
+        logger.warning(f"Requeued {len(event_ids)} unprocessed payment events")
+    return len(event_ids)
+
+@app.task(bind=True, acks_late=True, max_retries=Config.PAYMENT_EVENT_MAX_RETRIES)
+def apply_payment_event(self, event_id, tenant=None):
+    """Применяет callback банка к сделке: примечание, а при оплате — тег и статус «оплачено»."""
+    services = registry.services(tenant)
+    amocrm_client, payment_store = services.amocrm_client, services.payment_store
+    event = payment_store.claim_payment_event(event_id, Config.PAYMENT_EVENT_LEASE)
+    if event is None:
+        logger.info(f"Payment event {event_id} is already processed or claimed, skipping")
+        return
+    lead_id, operation, status = event["lead_id"], event["operation"], event["status"]
+    try:
+        paid = operation == "deposited" and int(status) == 1
+    except (TypeError, ValueError):
+        # Повтор не исправит статус: событие закрывается, чтобы не повторяться бесконечно
+        callback_logger.error(f"Событие {event_id} для сделки {lead_id} с некорректным статусом {status!r} пропущено")
+        payment_store.complete_payment_event(event_id)
+        return
+
+    try:
+        # Примечание, тег и смена статуса уходят в amoCRM одним пакетом
+        note_text = f"Callback: операция {operation}, статус {status}"
+        batch = amocrm_client.batch(PRIORITY_PAYMENT).add_note(lead_id, note_text)
+        with observe_stage("apply_payment_event", "update_lead"):
+            if paid:
+                lead = amocrm_client.get_lead_by_id(lead_id, priority=PRIORITY_PAYMENT)
+                if lead.get("status_id") == services.paid_status_id:
+                    amocrm_client.apply(batch)
+                    callback_logger.info(f"Добавлено примечание к сделке {lead_id}: {note_text}")
+                    callback_logger.info(f"Сделка {lead_id} уже обработана ранее (статус {services.paid_status_id}), пропускаем")
+                else:
+                    amocrm_client.apply(
+                        batch.add_tag(lead_id, services.tenant.paid_tag).change_status(lead_id, services.paid_status_id)
+                    )
+                    payment_store.delete(lead_id, JOURNAL_PAID)
+                    callback_logger.info(f"Сделка {lead_id} обработана по callback: успешная оплата, операция: {operation}")
+            elif operation == "declined_timeout":
+                amocrm_client.apply(batch.change_status(lead_id, services.declined_status_id))
+                callback_logger.info(f"Сделка {lead_id} перемещена в колонку 'Оплата не прошла' из-за отклонения по таймауту")
+            else:
+                amocrm_client.apply(batch)
+                callback_logger.info(f"Событие обработано: операция {operation}, статус {status}, примечание добавлено")
+    except Exception as e:
+        opened = circuit_open(e)
+        if opened is not None:
+            payment_store.release_payment_event(event_id, e)
+            services.deferred.park("apply_payment_event", event_id, {"event_id": event_id, "tenant": tenant}, opened.name)
+            return
+        if permanent_error(e) or self.request.retries >= self.max_retries:
+            payment_store.fail_payment_event(event_id, e)
+            logger.error(f"Payment event {event_id} for lead {lead_id} failed permanently after {event['attempts']} attempts: {str(e)}")
+            return
+        countdown = min(300, 5 * 2 ** self.request.retries)
+        # Событие остаётся за этой цепочкой повторов: check_payments_task не переотправит его до retry_at
+        payment_store.release_payment_event(event_id, e, retry_at=time.time() + countdown)
+        logger.error(f"Failed to apply payment event {event_id} to lead {lead_id}, retry in {countdown}s: {str(e)}")
+        raise self.retry(exc=e, countdown=countdown)
+    payment_store.complete_payment_event(event_id)
+
+def fan_out(task, tenant):
+    """Без арендатора и при нескольких арендаторах ставит task отдельно для каждого — в очередь его шарда.
+
+    Возвращает имена арендаторов, для которых задача поставлена, или None, если выполнять нужно здесь.
+    """
+    tenants = registry.all()
+    if tenant is not None or len(tenants) == 1:
+        return None
+    for item in tenants:
+        task.apply_async(kwargs={"tenant": item.name})
+    return [item.name for item in tenants]
+
+@app.task
+def check_payments_task(tenant=None):
+    # Периодическая задача celery beat; выполняется вне потока запроса gunicorn
+    scheduled = fan_out(check_payments_task, tenant)
+    if scheduled is not None:
+        return {"scheduled": scheduled}
+    services = registry.services(tenant)
+    clean_old_payments(services.payment_store)
+    services.lead_debouncer.purge()
+    requeue_payment_events(services)
+    if not services.sbp_client.breaker.allows():
+        # Банк недоступен: опрос пропускается, заказы проверятся в первом запуске после восстановления
+        logger.warning(f"Bank circuit {services.sbp_client.breaker.name} is open, skipping payment polling")
+        return {"skipped": services.sbp_client.breaker.name}
+    poller = PaymentPoller(
+        services.payment_store, services.sbp_client, services.amocrm_client,
+        services.paid_status_id, services.tenant.paid_tag, max_workers=Config.PAYMENTS_POLL_CONCURRENCY
+    )
+    return poller.run()
+
+@app.task
+def reconcile_leads_task(tenant=None):
+    # После простоя или пропущенных вебхуков: celery -A tasks call tasks.reconcile_leads_task
+    scheduled = fan_out(reconcile_leads_task, tenant)
+    if scheduled is not None:
+        return {"scheduled": scheduled}
+    services = registry.services(tenant)
+    if not services.amocrm_client.breaker.allows():
+        logger.warning(f"amoCRM circuit {services.amocrm_client.breaker.name} is open, skipping reconciliation")
+        return {"skipped": services.amocrm_client.breaker.name}
+    reconciler = LeadReconciler(
+        services.payment_store, services.amocrm_client, services.lead_filter,
+        functools.partial(register_order, services), functools.partial(save_payment, services),
+        services.paid_status_id, max_workers=Config.PAYMENTS_POLL_CONCURRENCY, custom_field_id=services.custom_field_id
+    )
+    return reconciler.run()
+
+@app.task
+def replay_deferred_task(tenant=None):
+    """Возвращает в Celery задачи, отложенные из-за недоступности amoCRM или банка.
+
+    Пока автомат разомкнут, задачи upstream остаются в очереди; в half-open уходит одна задача —
+    она и станет пробным запросом. После восстановления задачи уходят порциями по
+    DEFERRED_REPLAY_BATCH, с интервалом 1 / DEFERRED_REPLAY_RATE, чтобы не обрушить сервис снова.
+    """
+    scheduled = fan_out(replay_deferred_task, tenant)
+    if scheduled is not None:
+        return {"scheduled": scheduled}
+    services = registry.services(tenant)
+    replayed = {}
+    for name, breaker in services.breakers().items():
+        if not breaker.allows():
+            continue
+        limit = Config.DEFERRED_REPLAY_BATCH if breaker.state()["state"] == STATE_CLOSED else 1
+        entries = services.deferred.peek(name, limit)
+        for index, entry in enumerate(entries):
+            app.tasks[f"tasks.{entry['task']}"].apply_async(
+                kwargs=entry["kwargs"], countdown=index / Config.DEFERRED_REPLAY_RATE
+            )
+        services.deferred.delete([entry["id"] for entry in entries])
+        if entries:
+            replayed[name] = len(entries)
+            logger.info(f"Replayed {len(entries)} deferred tasks for {name}")
+    return replayed
+
+@app.task
+def refresh_metadata_task(tenant=None):
+    # Справочники amoCRM обновляются в фоне; процессы читают сохранённую копию
+    scheduled = fan_out(refresh_metadata_task, tenant)
+    if scheduled is not None:
+        return {"scheduled": scheduled}
+    services = registry.services(tenant)
+    if not services.tenant.uses_names:
+        # Все воронки, статусы и поле заданы id: справочники не читаются, лимит amoCRM не тратим
+        return {"skipped": "numeric ids"}
+    snapshot = services.metadata.refresh()
+    return {"pipelines": len(snapshot["pipelines"]), "custom_fields": len(snapshot["custom_fields"])}
+
+@app.task
+def compact_journal_task(tenant=None):
+    # История платежей хранится JOURNAL_RETENTION секунд; WAL базы обрезается после сжатия
+    scheduled = fan_out(compact_journal_task, tenant)
+    if scheduled is not None:
+        return {"scheduled": scheduled}
+    return registry.services(tenant).payment_store.compact_journal(Config.JOURNAL_RETENTION)
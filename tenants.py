@@ -0,0 +1,211 @@
+"""Арендаторы: аккаунты amoCRM и мерчанты банка, которые обслуживает одно развёртывание.
+
+Без TENANTS_FILE есть один арендатор "default", собранный из Config. Файл — JSON-список:
+
+    [{"name": "flowers", "amocrm_domain": "flowers.amocrm.ru", "amocrm_access_token_env": "FLOWERS_AMO_TOKEN",
+      "pipelines": {"123": [456, 457]}, "custom_field_id": 789,
+      "sbp_merchant_login": "flowers-api", "sbp_merchant_password_env": "FLOWERS_SBP_PASSWORD",
+      "callback_secret_key_env": "FLOWERS_CALLBACK_KEY", "shard": 1,
+      "paid_status": "Оплачено", "declined_status": "Оплата не прошла"}]
+
+Секреты можно указать значением или именем переменной окружения (ключ с суффиксом _env);
+токен amoCRM, логин и пароль мерчанта, ключ подписи callback (и токен банка вне тестовой среды)
+обязательны, как и переменные окружения арендатора по умолчанию.
+Воронки, статусы и поле задаются id или названием; статусы оплаты ищутся в первой воронке.
+Вебхуки и callback арендатора приходят на /webhook/<name> и /payment_callback/<name>.
+У каждого арендатора свои клиенты (пул соединений, лимит запросов amoCRM), своя база платежей
+и свои очереди Celery: задачи уходят в очередь "<очередь>.<shard>", если TENANT_SHARDS > 1.
+"""
+import functools
+import json
+import os
+import threading
+import zlib
+
+from amocrm_client import AmoCRMClient
+from amocrm_metadata import AmoCRMMetadata
+from bootstrap import Lazy
+from config import Config, id_or_name
+from deferred_queue import DeferredQueue
+from lead_debouncer import LeadDebouncer
+from lead_filter import LeadFilter, parse_pipeline_rules
+from payment_store import PaymentStore
+from sbp_client import SBPClient
+
+DEFAULT_TENANT = "default"
+
+
+class UnknownTenant(KeyError):
+    pass
+
+
+REQUIRED_SECRETS = ("amocrm_access_token", "sbp_merchant_login", "sbp_merchant_password", "callback_secret_key")
+
+
+def _secret(data, key):
+    if f"{key}_env" in data:
+        return os.getenv(data[f"{key}_env"])
+    return data.get(key)
+
+
+def _require_secrets(data):
+    required = REQUIRED_SECRETS if Config.SBP_TEST_ENV else REQUIRED_SECRETS + ("sbp_payment_token",)
+    missing = [key for key in required if not _secret(data, key)]
+    if missing:
+        raise ValueError(f"Арендатор {data.get('name')}: не заданы секреты {', '.join(missing)}")
+
+
+class Tenant:
+    def __init__(self, name, amocrm_domain, amocrm_access_token, pipeline_rules, custom_field_id,
+                 sbp_merchant_login, sbp_merchant_password, sbp_payment_token=None, callback_secret_key=None,
+                 amocrm_rate_limit=None, payments_db=None, callback_url=None, order_prefix="", shard=None,
+                 paid_status=None, declined_status=None, paid_tag=None):
+        self.name = name
+        self.amocrm_domain = amocrm_domain
+        self.amocrm_access_token = amocrm_access_token
+        self.pipeline_rules = pipeline_rules
+        self.custom_field_id = custom_field_id
+        self.sbp_merchant_login = sbp_merchant_login
+        self.sbp_merchant_password = sbp_merchant_password
+        self.sbp_payment_token = sbp_payment_token
+        self.callback_secret_key = callback_secret_key
+        self.amocrm_rate_limit = amocrm_rate_limit or Config.AMOCRM_RATE_LIMIT
+        # У каждого арендатора свой файл: блокировки записи SQLite одного аккаунта не задерживают другие
+        self.payments_db = payments_db or os.path.join(os.path.dirname(Config.PAYMENTS_DB), f"payments-{name}.db")
+        self.callback_url = callback_url or f"{Config.CALLBACK_URL}/{name}"
+        self.order_prefix = order_prefix
+        self.shard = shard if shard is not None else zlib.crc32(name.encode("utf-8")) % Config.TENANT_SHARDS
+        self.paid_status = paid_status if paid_status is not None else Config.PAID_STATUS
+        self.declined_status = declined_status if declined_status is not None else Config.DECLINED_STATUS
+        self.paid_tag = paid_tag or Config.PAID_TAG
+        self.metadata_file = os.path.join(os.path.dirname(self.payments_db), f"amocrm-metadata-{name}.json")
+
+    @property
+    def main_pipeline(self):
+        return next(iter(self.pipeline_rules))
+
+    @property
+    def uses_names(self):
+        """Заданы ли воронки, статусы или поле названием: справочники amoCRM нужны только тогда."""
+        values = [self.custom_field_id, self.paid_status, self.declined_status]
+        for pipeline, statuses in self.pipeline_rules.items():
+            values.append(pipeline)
+            values.extend(statuses)
+        return any(not isinstance(value, int) for value in values)
+
+    @classmethod
+    def from_config(cls):
+        rules = {Config.PIPELINE_ID: Config.ALLOWED_STATUS_IDS}
+        rules.update(parse_pipeline_rules(Config.PIPELINE_RULES))
+        return cls(
+            DEFAULT_TENANT, Config.AMOCRM_DOMAIN, Config.AMOCRM_ACCESS_TOKEN, rules, Config.CUSTOM_FIELD_ID,
+            Config.SBP_MERCHANT_LOGIN, Config.SBP_MERCHANT_PASSWORD, Config.SBP_PAYMENT_TOKEN,
+            Config.CALLBACK_SECRET_KEY, payments_db=Config.PAYMENTS_DB, callback_url=Config.CALLBACK_URL,
+            shard=0
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        _require_secrets(data)
+        return cls(
+            data["name"], data["amocrm_domain"], _secret(data, "amocrm_access_token"),
+            {
+                id_or_name(pipeline): frozenset(id_or_name(status) for status in statuses)
+                for pipeline, statuses in data["pipelines"].items()
+            },
+            id_or_name(data["custom_field_id"]),
+            _secret(data, "sbp_merchant_login"), _secret(data, "sbp_merchant_password"),
+            _secret(data, "sbp_payment_token"), _secret(data, "callback_secret_key"),
+            amocrm_rate_limit=data.get("amocrm_rate_limit"), payments_db=data.get("payments_db"),
+            callback_url=data.get("callback_url"), order_prefix=data.get("order_prefix", ""),
+            shard=data.get("shard"), paid_status=id_or_name(data["paid_status"]) if "paid_status" in data else None,
+            declined_status=id_or_name(data["declined_status"]) if "declined_status" in data else None,
+            paid_tag=data.get("paid_tag")
+        )
+
+    def queue(self, base):
+        """Очередь Celery шарда арендатора; при одном шарде — базовая очередь без суффикса."""
+        return f"{base}.{self.shard}" if Config.TENANT_SHARDS > 1 else base
+
+
+class TenantServices:
+    """Клиенты и хранилища одного арендатора; каждый создаётся при первом обращении.
+
+    Названия воронок, статусов и поля переводятся в id один раз на процесс по справочникам
+    amoCRM (AmoCRMMetadata), поэтому обработка вебхуков и задач не делает запросов за ними.
+    """
+
+    def __init__(self, tenant):
+        self.tenant = tenant
+        self.amocrm_client = Lazy(lambda: AmoCRMClient(
+            tenant.amocrm_domain, tenant.amocrm_access_token, tenant.amocrm_rate_limit
+        ))
+        self.sbp_client = Lazy(lambda: SBPClient(
+            tenant.sbp_merchant_login, tenant.sbp_merchant_password, tenant.sbp_payment_token, tenant.callback_url
+        ))
+        self.payment_store = Lazy(self._open_payment_store)
+        self.lead_debouncer = Lazy(lambda: LeadDebouncer(tenant.payments_db, Config.LEAD_DEBOUNCE_WINDOW))
+        self.deferred = Lazy(lambda: DeferredQueue(tenant.payments_db))
+        self.metadata = Lazy(lambda: AmoCRMMetadata(self.amocrm_client, tenant.metadata_file, Config.AMOCRM_METADATA_TTL))
+        self.lead_filter = Lazy(lambda: LeadFilter(self.metadata.resolve_rules(tenant.pipeline_rules)))
+
+    def breakers(self):
+        """Автоматы защиты внешних сервисов арендатора по имени."""
+        return {breaker.name: breaker for breaker in (self.amocrm_client.breaker, self.sbp_client.breaker)}
+
+    @functools.cached_property
+    def custom_field_id(self):
+        return self.metadata.custom_field_id(self.tenant.custom_field_id)
+
+    @functools.cached_property
+    def paid_status_id(self):
+        return self.metadata.status_id(self.tenant.main_pipeline, self.tenant.paid_status)
+
+    @functools.cached_property
+    def declined_status_id(self):
+        return self.metadata.status_id(self.tenant.main_pipeline, self.tenant.declined_status)
+
+    def _open_payment_store(self):
+        store = PaymentStore(self.tenant.payments_db, order_prefix=self.tenant.order_prefix)
+        if self.tenant.name == DEFAULT_TENANT:
+            store.migrate_from_json(Config.PAYMENTS_FILE)
+        return store
+
+
+class TenantRegistry:
+    def __init__(self, tenants):
+        self.tenants = {tenant.name: tenant for tenant in tenants}
+        self._services = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path=None):
+        path = path if path is not None else Config.TENANTS_FILE
+        tenants = []
+        if path:
+            with open(path) as f:
+                tenants = [Tenant.from_dict(data) for data in json.load(f)]
+        if not any(tenant.name == DEFAULT_TENANT for tenant in tenants):
+            tenants.insert(0, Tenant.from_config())
+        return cls(tenants)
+
+    def all(self):
+        return list(self.tenants.values())
+
+    def get(self, name=None):
+        """Арендатор по имени; None — арендатор по умолчанию. UnknownTenant, если такого нет."""
+        try:
+            return self.tenants[name or DEFAULT_TENANT]
+        except KeyError:
+            raise UnknownTenant(name)
+
+    def services(self, name=None):
+        tenant = self.get(name)
+        services = self._services.get(tenant.name)
+        if services is None:
+            with self._lock:
+                services = self._services.setdefault(tenant.name, TenantServices(tenant))
+        return services
+
+
+registry = Lazy(TenantRegistry.load)
@@ -1,97 +1,100 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify, g
 import logging
 import json
-import os
 import time
 import random
 import string
-import hmac
-import hashlib
-import urllib.parse
 from config import Config
-import requests
 from urllib.parse import parse_qs
-from amocrm_client import AmoCRMClient
-from sbp_client import SBPClient
-from tasks import process_lead
+from bootstrap import bootstrap_web
+from lead_ingest import LeadEventBuffer
+from webhook_parser import has_lead_statuses, iter_lead_events
+from tasks import publish_lead_events, publish_registered_lead_events, register_lead_events, check_payments_task, enqueue_payment_event
+from tenants import UnknownTenant, registry
+from logging_setup import new_correlation_id, set_correlation_id, reset_correlation_id
+from payment_callback import callback_checksum, callback_sign_string
+from circuit_breaker import circuit_states
+from profiling import PROFILE_HEADER, Profiler
+from metrics import HTTP_REQUEST_SECONDS, WEBHOOK_EVENTS, render as render_metrics
 
 app = Flask(__name__)
 
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    handlers=[
-        logging.FileHandler('/root/AlfaAmo/webapp.log'),
-        logging.StreamHandler()
-    ]
-)
 logger = logging.getLogger(__name__)
-
 callback_logger = logging.getLogger('callback_handler')
-callback_handler = logging.FileHandler('/root/AlfaAmo/callback.log')
-callback_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
-callback_logger.setLevel(logging.INFO)
-callback_logger.addHandler(callback_handler)
-
-amocrm_client = AmoCRMClient()
-sbp_client = SBPClient()
-PAYMENTS_FILE = "/root/AlfaAmo/payments.json"
-
-CALLBACK_SECRET_KEY = Config.CALLBACK_SECRET_KEY
-
-def load_payments():
-    if not os.path.exists(PAYMENTS_FILE):
-        logger.info("Payments file does not exist, creating new one")
-        save_payments({})
-        return {}
-    try:
-        with open(PAYMENTS_FILE, "r") as f:
-            content = f.read().strip()
-            if not content:
-                logger.info("Payments file is empty, initializing with {}")
-                return {}
-            return json.loads(content)
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in payments file: {str(e)}")
-        save_payments({})
-        return {}
-    except Exception as e:
-        logger.error(f"Failed to load payments: {str(e)}")
-        return {}
 
-def save_payments(payments):
-    try:
-        with open(PAYMENTS_FILE, "w") as f:
-            json.dump(payments, f, indent=4)
-    except Exception as e:
-        logger.error(f"Failed to save payments: {str(e)}")
-
-def clean_old_payments(payments, max_age_seconds=7*24*3600):
-    current_time = time.time()
-    return {k: v for k, v in payments.items() if current_time - v["created_at"] < max_age_seconds}
-
-def parse_form_data(form_data):
-    result = {}
-    for key, value in form_data.items():
-        parts = key.replace(']', '').split('[')
-        current = result
-        for part in parts[:-1]:
-            if part.isdigit():
-                part = int(part)
-                if part not in current:
-                    current[part] = {}
-                current = current[part]
-            else:
-                if part not in current:
-                    current[part] = {}
-                current = current[part]
-        current[parts[-1]] = value[0] if isinstance(value, list) else value
-    return result
+# События из /webhook публикуются в RabbitMQ фоновым потоком, чтобы ответ amoCRM не ждал брокера
+lead_buffer = LeadEventBuffer(
+    publish_registered_lead_events,
+    register_lead_events,
+    maxsize=Config.INGEST_BUFFER_SIZE,
+    batch_size=Config.INGEST_BATCH_SIZE
+)
+
+def create_app():
+    """Точка входа WSGI-сервера: gunicorn -c gunicorn.conf.py (или "webhook_handler:create_app()").
+
+    Проверяет конфигурацию и настраивает логирование (записи callback_handler дополнительно
+    пишутся в callback.log); клиенты amoCRM и хранилища создаются при первом запросе.
+    """
+    bootstrap_web()
+    install_profiling()
+    return app
+
+profiler = None
+
+def install_profiling():
+    # Обработчики подключаются, только если профилирование включено: иначе оно ничего не стоит
+    global profiler
+    if profiler is not None:
+        return
+    profiler = Profiler.from_config()
+    if profiler is None:
+        return
+
+    @app.before_request
+    def start_profile():
+        g.profile_token = profiler.start(request.endpoint or "unknown", request.headers.get(PROFILE_HEADER))
+
+    @app.teardown_request
+    def stop_profile(exc=None):
+        profiler.stop(g.pop("profile_token", None))
+
+@app.before_request
+def bind_correlation_id():
+    # Идентификатор запроса попадает во все записи лога, в том числе в задачи Celery по событиям /webhook
+    g.correlation_id = request.headers.get("X-Request-ID") or new_correlation_id()
+    g.correlation_token = set_correlation_id(g.correlation_id)
+    g.request_started = time.perf_counter()
+
+@app.after_request
+def add_correlation_header(response):
+    response.headers["X-Request-ID"] = g.correlation_id
+    HTTP_REQUEST_SECONDS.labels(request.endpoint or "unknown", str(response.status_code)).observe(
+        time.perf_counter() - g.request_started
+    )
+    return response
+
+@app.teardown_request
+def unbind_correlation_id(exc=None):
+    token = g.pop("correlation_token", None)
+    if token is not None:
+        reset_correlation_id(token)
 
 @app.route("/", methods=["GET"])
 def index():
     return jsonify({"status": "ok"}), 200
 
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    body, content_type = render_metrics()
+    return Response(body, content_type=content_type)
+
+@app.route("/circuits", methods=["GET"])
+def circuits():
+    # Состояние автоматов amoCRM и банка на хосте и отложенные задачи арендаторов
+    deferred = {tenant.name: registry.services(tenant.name).deferred.stats() for tenant in registry.all()}
+    return jsonify({"circuits": circuit_states(Config.RATE_LIMIT_DB), "deferred": deferred}), 200
+
 @app.route("/webhook_test", methods=["POST"])
 def webhook_test():
     data = request.get_json(silent=True) or request.form
@@ -99,53 +102,59 @@ def webhook_test():
     logger.info(f"Заголовки: {dict(request.headers)}")
     return jsonify({"status": "received"}), 200
 
+def unknown_tenant(tenant):
+    logger.warning(f"Запрос для неизвестного арендатора: {tenant}")
+    return jsonify({"status": "error", "message": "Unknown tenant"}), 404
+
 @app.route("/webhook", methods=["POST"])
-def webhook():
+@app.route("/webhook/<tenant>", methods=["POST"])
+def webhook(tenant=None):
     start_time = time.time()
+    try:
+        services = registry.services(tenant)
+    except UnknownTenant:
+        return unknown_tenant(tenant)
     try:
         content_type = request.headers.get("Content-Type", "")
-        logger.info(f"Получен вебхук с Content-Type: {content_type}")
-        logger.info(f"Заголовки запроса: {dict(request.headers)}")
-
-        if "application/x-www-form-urlencoded" in content_type:
-            form_data = request.form
-            logger.info(f"Данные формы: {dict(form_data)}")
-            data = parse_form_data(form_data)
-            logger.info(f"Декодированные данные: {json.dumps(data, indent=2)}")
-        elif "application/json" in content_type:
-            data = request.get_json(silent=True)
-            if data is None:
-                logger.warning("Получен невалидный JSON")
-                return jsonify({"status": "invalid_json"}), 200
-            logger.info(f"Тело вебхука: {json.dumps(data, indent=2)}")
-        else:
+        if "application/x-www-form-urlencoded" not in content_type and "application/json" not in content_type:
             logger.warning(f"Неподдерживаемый Content-Type: {content_type}")
             return jsonify({"status": "ignored_non_json"}), 200
 
-        if not data or "leads" not in data or "status" not in data["leads"]:
-            logger.info("Нет обновленных сделок")
-            return jsonify({"status": "ignored"})
-
-        if len(data["leads"]["status"]) == 0 or not any(data["leads"]["status"].values()):
-            logger.info("Тестовый вебхук, возвращаем быстрый ответ")
-            return jsonify({"status": "test_received"}), 200
-
-        status_dict = data["leads"]["status"]
-        status_list = list(status_dict.values()) if isinstance(status_dict, dict) else status_dict
-        if not isinstance(status_list, list):
-            status_list = [status_list]
-
-        for lead_status in status_list:
-            lead_id = str(lead_status.get("id"))
-            status_id = int(lead_status.get("status_id")) if lead_status.get("status_id") else None
-            pipeline_id = int(lead_status.get("pipeline_id")) if lead_status.get("pipeline_id") else None
+        # Из тела за один проход извлекаются только id, status_id и pipeline_id сделок
+        body = request.get_data(cache=False)
+        try:
+            events = iter_lead_events(body, content_type)
+        except ValueError:
+            logger.warning("Получен невалидный JSON")
+            return jsonify({"status": "invalid_json"}), 200
+
+        received = queued = 0
+        for lead_id, status_id, pipeline_id in events:
+            received += 1
+            # Сделки других воронок и статусов не доходят до брокера
+            if not services.lead_filter.matches(status_id, pipeline_id):
+                WEBHOOK_EVENTS.labels("filtered").inc()
+                continue
+            queued += 1
             logger.info(f"Добавление задачи для сделки с ID: {lead_id}, status_id: {status_id}, pipeline_id: {pipeline_id}")
 
-            # Асинхронно добавляем задачу в очередь
-            process_lead.delay(lead_id, status_id, pipeline_id)
+            # Задача уходит в очередь фоновым потоком; при переполненном буфере публикуем сразу
+            event = (lead_id, status_id, pipeline_id, g.correlation_id, services.tenant.name)
+            if lead_buffer.put(event):
+                WEBHOOK_EVENTS.labels("buffered").inc()
+            else:
+                WEBHOOK_EVENTS.labels("published_inline").inc()
+                publish_lead_events([event])
+
+        if not received:
+            if has_lead_statuses(body, content_type):
+                logger.info("Тестовый вебхук, возвращаем быстрый ответ")
+                return jsonify({"status": "test_received"}), 200
+            logger.info("Нет обновленных сделок")
+            return jsonify({"status": "ignored"})
 
         elapsed_time = time.time() - start_time
-        logger.info(f"Вебхук обработан за {elapsed_time:.2f} секунд")
+        logger.info(f"Вебхук обработан за {elapsed_time:.3f} секунд: сделок {received}, в очередь {queued}")
         return jsonify({"status": "success"})
     except Exception as e:
         logger.error(f"Критическая ошибка в вебхуке: {str(e)}")
@@ -153,40 +162,21 @@ def webhook():
 
 @app.route("/check_payments", methods=["GET"])
 def check_payments():
-    payments = clean_old_payments(load_payments())
-    updated_payments = payments.copy()
-
-    for lead_id, payment in payments.items():
-        order_number = payment["order_number"]
-        try:
-            status_url = "https://alfa.rbsuat.com/payment/rest/getOrderStatus.do"
-            status_params = {
-                "userName": Config.SBP_MERCHANT_LOGIN,
-                "password": Config.SBP_MERCHANT_PASSWORD,
-                "orderNumber": order_number,
-                "language": "ru"
-            }
-            response = requests.get(status_url, params=status_params)
-            logger.info(f"Check payment status for {lead_id}: {response.status_code}, {response.text}")
-            response.raise_for_status()
-            status_data = response.json()
-
-            if status_data.get("orderStatus") == 2:
-                logger.info(f"Оплата для сделки {lead_id} успешна")
-                amocrm_client.add_tag(lead_id, "оплачено")
-                amocrm_client.change_status(lead_id, 54415022)
-                del updated_payments[lead_id]
-                save_payments(updated_payments)
-                logger.info(f"Сделка {lead_id} удалена из payments.json")
-        except Exception as e:
-            logger.error(f"Ошибка проверки оплаты для сделки {lead_id}: {str(e)}")
-            continue
-
-    return jsonify({"status": "checked", "remaining_payments": len(updated_payments)})
+    # Опрос банка выполняется задачей Celery; запрос только ставит её в очередь (для каждого арендатора — свою)
+    task = check_payments_task.delay()
+    logger.info(f"Проверка оплат поставлена в очередь, task_id: {task.id}")
+    open_payments = sum(registry.services(tenant.name).payment_store.count() for tenant in registry.all())
+    return jsonify({"status": "scheduled", "task_id": task.id, "open_payments": open_payments}), 202
 
 @app.route("/payment_callback", methods=["GET"])
-def payment_callback():
+@app.route("/payment_callback/<tenant>", methods=["GET"])
+def payment_callback(tenant=None):
     callback_logger.info(f"Payment callback received: {request.query_string}")
+    try:
+        services = registry.services(tenant)
+    except UnknownTenant:
+        return unknown_tenant(tenant)
+    payment_store = services.payment_store
 
     params = request.args
     md_order = params.get("mdOrder")
@@ -202,65 +192,36 @@ def payment_callback():
         callback_logger.error("Некорректные данные в callback: отсутствуют обязательные параметры")
         return jsonify({"status": "error", "message": "Missing required parameters"}), 400
 
+    if not status.isdigit():
+        callback_logger.error(f"Некорректный статус в callback: {status}")
+        return jsonify({"status": "error", "message": "Invalid status"}), 400
+
     if checksum:
-        params_copy = dict(params)
-        params_copy.pop("checksum", None)
-        params_copy.pop("sign_alias", None)
-        sorted_params = sorted(params_copy.items(), key=lambda x: x[0])
-        sign_string = ""
-        for key, value in sorted_params:
-            if "%" in value:
-                value = urllib.parse.unquote(value)
-            sign_string += f"{key};{value};"
+        sign_string = callback_sign_string(params.items())
         callback_logger.info(f"Sign string for checksum: {sign_string}")
 
-        computed_checksum = hmac.new(
-            CALLBACK_SECRET_KEY.encode('utf-8'),
-            sign_string.encode('utf-8'),
-            hashlib.sha256
-        ).hexdigest().upper()
+        computed_checksum = callback_checksum(sign_string, services.tenant.callback_secret_key)
 
         if computed_checksum != checksum:
             callback_logger.error(f"Неверная контрольная сумма: ожидаемая {computed_checksum}, полученная {checksum}")
             return jsonify({"status": "error", "message": "Invalid checksum"}), 400
         callback_logger.info("Контрольная сумма успешно проверена")
 
-    lead_id = None
-    payments = load_payments()
-    callback_logger.info(f"Current payments: {json.dumps(payments, indent=2)}")
-
-    for lid, payment in payments.items():
-        callback_logger.info(f"Checking payment: lead_id={lid}, payment={payment}")
-        if payment.get("order_id") == md_order and payment.get("order_number") == order_number:
-            lead_id = lid
-            break
+    lead_id = payment_store.find_lead_by_order(md_order, order_number)
 
     if not lead_id:
         callback_logger.warning(f"Не найдена сделка с mdOrder: {md_order} и orderNumber: {order_number}")
         return jsonify({"status": "received"}), 200
 
-    note_text = f"Callback: операция {operation}, статус {status}"
-    amocrm_client.add_note(lead_id, note_text)
-    callback_logger.info(f"Добавлено примечание к сделке {lead_id}: {note_text}")
-
-    if operation == "deposited" and int(status) == 1:
-        lead = amocrm_client.get_lead_by_id(lead_id)
-        if lead.get("status_id") == 54415022:
-            callback_logger.info(f"Сделка {lead_id} уже обработана ранее (статус 54415022), пропускаем")
-            return jsonify({"status": "received"}), 200
-
-        amocrm_client.add_tag(lead_id, "оплачено")
-        amocrm_client.change_status(lead_id, 54415022)
-        del payments[lead_id]
-        save_payments(payments)
-        callback_logger.info(f"Сделка {lead_id} обработана по callback: успешная оплата, операция: {operation}")
-    elif operation == "declined_timeout":
-        amocrm_client.change_status(lead_id, 54415023)
-        callback_logger.info(f"Сделка {lead_id} перемещена в колонку 'Оплата не прошла' из-за отклонения по таймауту")
-    else:
-        callback_logger.info(f"Событие обработано: операция {operation}, статус {status}, примечание добавлено")
+    # Событие сохраняется до ответа банку; примечание, тег и статус в amoCRM применит задача в очереди payments.
+    # Заказ при этом снимается с опроса в check_payments_task
+    event_id, pending = payment_store.record_callback_event(lead_id, md_order, order_number, operation, status)
+    if not pending:
+        callback_logger.info(f"Повторный callback для сделки {lead_id}: событие {event_id} уже обработано")
+    elif enqueue_payment_event(event_id, services.tenant.name):
+        callback_logger.info(f"Событие {event_id} для сделки {lead_id} поставлено в очередь: операция {operation}, статус {status}")
 
     return jsonify({"status": "received"}), 200
 
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    create_app().run(host="0.0.0.0", port=5000)
\ No newline at end of file
@@ -0,0 +1,106 @@
+import json
+import logging
+from urllib.parse import unquote_plus
+
+from metrics import WEBHOOK_EVENTS
+
+logger = logging.getLogger("webhook_handler")
+
+FORM_PREFIX = b"leads[status]["
+FORM_PREFIXES = (b"leads%5Bstatus%5D%5B", b"leads%5bstatus%5d%5b", FORM_PREFIX)
+STATUS_KEYS = (b"leads[status]", b"leads%5Bstatus%5D", b"leads%5bstatus%5d")
+LEAD_FIELDS = {b"id": "id", b"status_id": "status_id", b"pipeline_id": "pipeline_id"}
+
+
+def _lead_event(fields):
+    """(lead_id, status_id, pipeline_id) или None, если поля не числа: такое событие пропускается, остальные — нет."""
+    lead_id = fields.get("id")
+    status_id = fields.get("status_id")
+    pipeline_id = fields.get("pipeline_id")
+    try:
+        return (
+            str(int(lead_id)),
+            int(status_id) if status_id else None,
+            int(pipeline_id) if pipeline_id else None,
+        )
+    except (TypeError, ValueError):
+        logger.warning(f"Пропущено событие сделки с некорректными полями: id={lead_id!r}, "
+                       f"status_id={status_id!r}, pipeline_id={pipeline_id!r}")
+        WEBHOOK_EVENTS.labels("invalid").inc()
+        return None
+
+
+def _decode(raw):
+    # Идентификаторы приходят цифрами, полное декодирование нужно редко
+    if b"%" in raw or b"+" in raw:
+        return unquote_plus(raw.decode("utf-8"))
+    return raw.decode("ascii")
+
+
+def iter_form_lead_events(body):
+    """События (lead_id, status_id, pipeline_id) из urlencoded-тела вебхука amoCRM за один проход.
+
+    Разбираются только ключи leads[status][N][id|status_id|pipeline_id], остальные поля
+    сделок пропускаются без декодирования; событие выдаётся, как только собраны все три поля сделки N.
+    """
+    partial = {}
+    for pair in body.split(b"&"):
+        if not pair.startswith(FORM_PREFIXES):
+            continue
+        key, _, value = pair.partition(b"=")
+        if not key.startswith(FORM_PREFIX):
+            key = key.replace(b"%5B", b"[").replace(b"%5D", b"]")
+            if b"%" in key:
+                key = unquote_plus(key.decode("utf-8")).encode("utf-8")
+        # leads[status][N][field]
+        index, _, field = key[len(FORM_PREFIX):].partition(b"][")
+        field = LEAD_FIELDS.get(field[:-1])
+        if field is None:
+            continue
+        fields = partial.setdefault(index, {})
+        fields[field] = _decode(value)
+        if len(fields) == len(LEAD_FIELDS):
+            del partial[index]
+            event = _lead_event(fields)
+            if event is not None:
+                yield event
+    # Сделки без части полей (статус или воронка не переданы)
+    for fields in partial.values():
+        if "id" in fields:
+            event = _lead_event(fields)
+            if event is not None:
+                yield event
+
+
+def iter_json_lead_events(data):
+    statuses = ((data or {}).get("leads") or {}).get("status") or []
+    if isinstance(statuses, dict):
+        statuses = statuses.values()
+    elif not isinstance(statuses, list):
+        statuses = [statuses]
+    for lead_status in statuses:
+        if isinstance(lead_status, dict) and lead_status.get("id") is not None:
+            event = _lead_event(lead_status)
+            if event is not None:
+                yield event
+
+
+def has_lead_statuses(body, content_type):
+    """Есть ли в теле ключ leads[status]: без событий это тестовый вебхук amoCRM, а не посторонний запрос."""
+    if "application/x-www-form-urlencoded" in content_type:
+        return any(key in body for key in STATUS_KEYS)
+    try:
+        data = json.loads(body)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and isinstance(data.get("leads"), dict) and "status" in data["leads"]
+
+
+def iter_lead_events(body, content_type):
+    """События смены статуса сделок из тела вебхука; ValueError для невалидного JSON."""
+    if "application/x-www-form-urlencoded" in content_type:
+        return iter_form_lead_events(body)
+    if "application/json" in content_type:
+        return iter_json_lead_events(json.loads(body))
+    raise ValueError(f"Unsupported Content-Type: {content_type}")
+